@@ -0,0 +1,230 @@
+"""
+Change feed for the devices of a user.
+
+Every mutation of the wardrobe or the account publishes a compact event
+
+    {"entity": "item", "id": 12, "op": "update", "synchronized_at": "2025-05-01T10:00:00.123456"}
+
+to the devices of the user connected to the `/changes` WebSocket, so they
+sync when something changed instead of polling. `entity` is "item",
+"combination", "wardrobe" (a sync that changed several rows) or "user", `id`
+is None when several rows changed, and `op` is "create", "update", "delete"
+or "sync".
+
+Connections are served by the `ChangeFeed` of their process. The "memory"
+backend delivers events only there; the "database" backend also relays them
+to the other worker processes through the `change_events` table.
+"""
+from abc import ABC, abstractmethod
+import asyncio
+from functools import lru_cache
+import json
+import logging
+import threading
+import time
+from typing import Optional
+from uuid import uuid4
+
+from sqlalchemy import or_
+
+from app.constants import (
+    CHANGE_FEED_BACKEND, CHANGE_FEED_POLL_INTERVAL_SECONDS, CHANGE_FEED_POLL_OVERLAP_SECONDS, CHANGE_FEED_QUEUE_SIZE,
+    CHANGE_FEED_RETENTION_SECONDS,
+)
+
+# Sent instead of the events a slow connection missed; the device should do a full delta sync
+RESYNC_EVENT = {"entity": "wardrobe", "id": None, "op": "sync", "synchronized_at": None}
+
+
+def build_change_event(entity: str, entity_id: Optional[int], op: str, synchronized_at: Optional[str]) -> dict:
+    return {"entity": entity, "id": entity_id, "op": op, "synchronized_at": synchronized_at}
+
+
+class Subscription:
+    """Events for one connection, queued on the event loop that serves it."""
+
+    def __init__(self, user_id: int, queue_size: int = CHANGE_FEED_QUEUE_SIZE):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event: dict):
+        """Queues an event; must be called on `self.loop`."""
+        if self.queue.full():
+            # The connection can't keep up: replace the backlog by one resync request
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC_EVENT
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class ChangeFeed:
+    """In-process pub/sub of change events by user id."""
+
+    def __init__(self):
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Subscribes to the events of a user; must be called on the event loop of the connection."""
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[subscription.user_id]
+
+    def dispatch(self, user_id: int, event: dict):
+        """Delivers an event to the connections of the user in this process; safe to call from any thread."""
+        with self.lock:
+            subscriptions = list(self.subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The loop of the connection is closed, it unsubscribes when its handler ends
+                pass
+
+
+class ChangeFeedBackend(ABC):
+    def __init__(self, feed: ChangeFeed):
+        self.feed = feed
+
+    @abstractmethod
+    def publish(self, user_id: int, event: dict):
+        """Publishes an event to all connected devices of the user. May block, call it off the event loop."""
+
+    async def run(self):
+        """Background task that delivers events published by other processes."""
+
+
+class MemoryChangeFeedBackend(ChangeFeedBackend):
+    """Delivers events to the connections of the current process only."""
+
+    def publish(self, user_id: int, event: dict):
+        self.feed.dispatch(user_id, event)
+
+
+class DatabaseChangeFeedBackend(ChangeFeedBackend):
+    """
+    Relays events between worker processes through the `change_events` table.
+
+    Events are delivered to local connections immediately; the other workers
+    poll the table every CHANGE_FEED_POLL_INTERVAL_SECONDS with one indexed
+    query, however many devices are connected.
+
+    Autoincrement ids are allocated before commit, so an event can become
+    visible after one with a higher id. Every poll therefore also re-reads the
+    last CHANGE_FEED_POLL_OVERLAP_SECONDS of events and skips the ids it
+    already handled.
+    """
+
+    def __init__(self, feed: ChangeFeed, session_factory=None, poll_interval: float = CHANGE_FEED_POLL_INTERVAL_SECONDS):
+        super().__init__(feed)
+        if session_factory is None:
+            from app.database.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.origin = str(uuid4())
+        self.last_id: Optional[int] = None
+        self.seen: dict[int, float] = {}  # Ids handled within the overlap window -> created_at
+
+    def publish(self, user_id: int, event: dict):
+        from app.model import ChangeEvent
+        self.feed.dispatch(user_id, event)
+        with self.session_factory() as db:
+            db.add(ChangeEvent(user_id=user_id, origin=self.origin, payload=json.dumps(event), created_at=time.time()))
+            db.commit()
+
+    def poll(self, now: Optional[float] = None) -> int:
+        """Delivers the events of other workers published since the last poll and returns their number."""
+        from app.model import ChangeEvent
+        cutoff = (time.time() if now is None else now) - CHANGE_FEED_POLL_OVERLAP_SECONDS
+        with self.session_factory() as db:
+            if self.last_id is None:
+                # Events published before this worker started are not relayed
+                self.last_id = db.query(ChangeEvent.id).order_by(ChangeEvent.id.desc()).limit(1).scalar() or 0
+                self.seen = dict(db.query(ChangeEvent.id, ChangeEvent.created_at).filter(
+                    ChangeEvent.created_at >= cutoff).all())
+                return 0
+            rows = db.query(
+                ChangeEvent.id, ChangeEvent.user_id, ChangeEvent.origin, ChangeEvent.payload, ChangeEvent.created_at
+            ).filter(
+                or_(ChangeEvent.id > self.last_id, ChangeEvent.created_at >= cutoff)
+            ).order_by(ChangeEvent.id).all()
+        delivered = 0
+        for row in rows:
+            if row.id in self.seen:
+                continue
+            self.seen[row.id] = row.created_at
+            self.last_id = max(self.last_id, row.id)
+            if row.origin != self.origin:
+                self.feed.dispatch(row.user_id, json.loads(row.payload))
+                delivered += 1
+        self.seen = {event_id: created_at for event_id, created_at in self.seen.items() if created_at >= cutoff}
+        return delivered
+
+    def remove_old_events(self):
+        from app.model import ChangeEvent
+        with self.session_factory() as db:
+            db.query(ChangeEvent).filter(
+                ChangeEvent.created_at < time.time() - CHANGE_FEED_RETENTION_SECONDS
+            ).delete(synchronize_session=False)
+            db.commit()
+
+    async def run(self):
+        from app.executors import run_in_pool
+        last_cleanup = 0.0
+        while True:
+            try:
+                await run_in_pool("db", self.poll)
+                if time.monotonic() - last_cleanup > CHANGE_FEED_RETENTION_SECONDS:
+                    await run_in_pool("db", self.remove_old_events)
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logging.error(f"❌ Change feed polling failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+CHANGE_FEED_BACKENDS = {
+    "memory": MemoryChangeFeedBackend,
+    "database": DatabaseChangeFeedBackend,
+}
+
+change_feed = ChangeFeed()
+
+
+def create_change_feed_backend(name: str, feed: ChangeFeed = change_feed) -> ChangeFeedBackend:
+    backend_class = CHANGE_FEED_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"❌ Unsupported change feed backend: '{name}'")
+    logging.info(f"Using '{name}' change feed backend")
+    return backend_class(feed)
+
+
+@lru_cache(maxsize=1)
+def get_change_feed_backend() -> ChangeFeedBackend:
+    """Returns the backend configured by CHANGE_FEED_BACKEND."""
+    return create_change_feed_backend(CHANGE_FEED_BACKEND)
+
+
+def publish_change(user_id: int, entity: str, entity_id: Optional[int], op: str, synchronized_at: Optional[str]):
+    """
+    Publishes a change of a user's data, after it was committed.
+
+    A failure is only logged: devices catch up with their next sync anyway.
+    """
+    try:
+        get_change_feed_backend().publish(user_id, build_change_event(entity, entity_id, op, synchronized_at))
+    except Exception as e:
+        logging.warning(f"⚠️ Failed to publish {op} of {entity} {entity_id} of user {user_id}: {e}")
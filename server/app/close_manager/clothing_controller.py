@@ -3,59 +3,51 @@ import logging
 import os
 import uuid
 from fastapi import HTTPException, UploadFile
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from datetime import datetime
 from app.model import *
-from app.user_manager import get_current_user_id
+from app.model.clothing_combination import clothing_combination_items
+from app.user_manager import get_current_user_id, get_current_user_id_async
+from app.executors import get_executor
+from app.close_manager.duplicate_detector import duplicate_index
+from app.close_manager.image_ingestion import IngestedImage, ingest_image
+from app.storage_manager import StoredBlob, get_storage, store_upload, release_blobs, generate_image_derivatives, build_file_url, build_variant_urls, describe_variants, get_derivative_formats, parse_variants
+from app.response_encoding import to_columnar
 from rembg import remove
-from app.constants import UPLOAD_DIR, MAX_FILE_SIZE_BYTES, MAX_CLOTHING_ITEMS_COUNT, MAX_CLOTHING_COMBINATIONS_COUNT, SERVER_URL, MAX_FILE_SIZE_MB
+from app.constants import IMAGE_VARIANTS, UPLOAD_DIR, STORAGE_BACKEND, BATCH_UPLOAD_WORKERS, MAX_CLOTHING_ITEMS_COUNT, MAX_CLOTHING_COMBINATIONS_COUNT, SERVER_URL
 # Directory for storing files, max file size, and max clothing items/combination counts
 
 
 
-if not os.path.exists(UPLOAD_DIR):
+if STORAGE_BACKEND == "local" and not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
 # Function for saving a file on the server
-def save_file(file: UploadFile):
-    # Generate a unique filename for the file
-    file_extension = file.filename.split('.')[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+def save_file(file: UploadFile) -> StoredBlob:
+    """
+    Streams the uploaded file into the content-addressed upload storage.
 
-    # Create the directory if it doesn't exist
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    The upload is copied in chunks to a temporary file, so the size limit is
+    enforced without reading the whole file into memory, and is then renamed
+    into place atomically. Files are named by their SHA-256, so uploading bytes
+    that are already stored does not write anything. Resized WebP/AVIF variants
+    are generated for new files.
 
-    # Read the entire content of the file
-    content = file.file.read()
-
-    # Check file size
-    if len(content) > MAX_FILE_SIZE_BYTES:
-        return JSONResponse(
-            status_code=400,
-            content={"detail": f"File size more than {MAX_FILE_SIZE_MB} MB."}
-        )
-
-    # Write the file to the disk
-    with open(file_path, "wb") as f:
-        f.write(content)
-
-    return unique_filename
+    :raises HTTPException: 400 if the file is larger than MAX_FILE_SIZE_BYTES.
+    """
+    return store_upload(file)
 
 
 def remove_background_preview(filename: str) -> tuple[str, BytesIO]:
-    input_path = os.path.join(UPLOAD_DIR, filename)
-
-
-    with open(input_path, 'rb') as input_file:
-        input_data = input_file.read()
-        output_data = remove(input_data)
+    input_data = get_storage().read_bytes(filename)
+    output_data = remove(input_data)
 
     output_io = BytesIO(output_data)
 
 
-    base_name = os.path.splitext(filename)[0]
+    base_name = os.path.splitext(os.path.basename(filename))[0]
     output_filename = f"{base_name}_bg_removed.png"
 
     return output_filename, output_io
@@ -75,7 +67,10 @@ def add_clothing_item_to_db(
     purchase_date: str,
     price: float,
     is_favorite: bool,
-    owner_id: int
+    owner_id: int,
+    content_hash: str = None,
+    perceptual_hash: str = None,
+    image_variants: str = None
 ) -> ClothingItem:
     # ✅ Checking the number of user items
     item_count = db.query(ClothingItem).filter(
@@ -98,7 +93,10 @@ def add_clothing_item_to_db(
             purchase_date, "%Y-%m-%d") if purchase_date else None,
         price=price,
         is_favorite=is_favorite,
-        owner_id=owner_id
+        owner_id=owner_id,
+        content_hash=content_hash,
+        perceptual_hash=perceptual_hash,
+        image_variants=image_variants
     )
     logging.debug(f"Adding clothing item: {new_clothing_item}")
     logging.debug(f"Clothing item dict: {new_clothing_item.__dict__}")
@@ -106,9 +104,138 @@ def add_clothing_item_to_db(
     db.add(new_clothing_item)
     db.commit()
     db.refresh(new_clothing_item)
+    duplicate_index.add(owner_id, new_clothing_item.id, perceptual_hash)
 
     return new_clothing_item
 
+def prepare_batch_item(file: UploadFile, item_data: dict) -> dict:
+    """
+    Does the per-file work of a batch upload: runs the image through the ingestion pipeline.
+
+    Runs in a worker thread, so it must not touch the database session.
+    """
+    red, green, blue = item_data.get("red"), item_data.get("green"), item_data.get("blue")
+    ingested = ingest_image(file)
+    if red is None or green is None or blue is None or red == "" or green == "" or blue == "":
+        red, green, blue = ingested.dominant_color
+    else:
+        try:
+            red, green, blue = int(red), int(green), int(blue)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid color values")
+
+    return {
+        "red": red, "green": green, "blue": blue,
+        "filename": ingested.blob.filename, "content_hash": ingested.blob.sha256,
+        "perceptual_hash": ingested.perceptual_hash, "image_variants": ingested.blob.image_variants
+    }
+
+
+def add_clothing_items_batch(
+    db: Session,
+    owner_id: int,
+    files: list[UploadFile],
+    items_data: list[dict]
+) -> list[dict]:
+    """
+    Adds several clothing items in one request.
+
+    The item limit is checked once for the whole batch, images are decoded and
+    stored in parallel on a worker pool, and all rows are written in a single
+    transaction. Invalid items do not stop the rest of the batch. Created items
+    list the ids of existing items that look the same in `possible_duplicates`.
+
+    :return: Per-item results in the order of `items_data`.
+    """
+    if len(files) != len(items_data):
+        raise HTTPException(
+            status_code=400, detail="Number of files does not match number of items.")
+
+    # ✅ Checking the number of user items once for the whole batch
+    item_count = db.query(ClothingItem).filter(
+        ClothingItem.owner_id == owner_id).count()
+    if item_count + len(items_data) > MAX_CLOTHING_ITEMS_COUNT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Item limit reached. Maximum {MAX_CLOTHING_ITEMS_COUNT} clothing items allowed per user, "
+                   f"{MAX_CLOTHING_ITEMS_COUNT - item_count} can still be added.")
+
+    def process(args):
+        file, item_data = args
+        try:
+            return prepare_batch_item(file, item_data), None
+        except HTTPException as e:
+            return None, e.detail
+        except Exception as e:
+            logging.warning(f"Failed to process batch file {file.filename}: {e}")
+            return None, "Image processing error"
+
+    # Shared image pool; one batch occupies at most BATCH_UPLOAD_WORKERS of its slots
+    prepared = list(get_executor("image").map(process, zip(files, items_data), max_in_flight=BATCH_UPLOAD_WORKERS))
+
+    results = []
+    new_items = []
+    for index, (item_data, (file_data, error)) in enumerate(zip(items_data, prepared)):
+        if error is None:
+            try:
+                purchase_date = item_data.get("purchase_date")
+                price = item_data.get("price")
+                is_favorite = item_data.get("is_favorite", False)
+                if isinstance(is_favorite, str):
+                    is_favorite = is_favorite.lower() in ("true", "1", "yes")
+                new_item = ClothingItem(
+                    name=item_data.get("name"),
+                    category=item_data.get("category"),
+                    season=item_data.get("season"),
+                    material=item_data.get("material"),
+                    brand=item_data.get("brand"),
+                    purchase_date=datetime.strptime(
+                        purchase_date, "%Y-%m-%d").date() if purchase_date else None,
+                    price=float(price) if price not in (None, "") else None,
+                    is_favorite=bool(is_favorite),
+                    owner_id=owner_id,
+                    **file_data
+                )
+                if not new_item.name or not new_item.material:
+                    raise HTTPException(status_code=400, detail="Fields 'name' and 'material' are required")
+            except HTTPException as e:
+                error = e.detail
+            except ValueError as e:
+                error = f"Invalid value: {e}"
+
+        if error is not None:
+            results.append({"index": index, "status": "failed", "detail": error})
+            continue
+        new_items.append(new_item)
+        results.append({
+            "index": index,
+            "status": "created",
+            "item": new_item,
+            "possible_duplicates": duplicate_index.find_duplicates(db, owner_id, new_item.perceptual_hash)
+        })
+
+    # 💾 All rows of the batch in one transaction
+    try:
+        db.add_all(new_items)
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_blobs(db, {item.filename for item in new_items})
+        raise
+
+    for result in results:
+        if "item" in result:
+            item = result.pop("item")
+            duplicate_index.add(owner_id, item.id, item.perceptual_hash)
+            result["data"] = serialize_clothing_item(item)
+
+    # Files of failed items that were stored before the failure are not referenced
+    failed_files = {data["filename"] for data, error in prepared if data is not None} - {item.filename for item in new_items}
+    release_blobs(db, failed_files)
+
+    return results
+
+
 def update_clothing_item_in_db(
     db: Session,
     item_id: int,
@@ -144,29 +271,29 @@ def remove_file_by_clothing_item_id(clothing_item_id: int, is_preview: bool, db:
     else:
         target_filename = f"{base_name}_bg_removed.png"
 
-    target_path = os.path.join(UPLOAD_DIR, target_filename)
-    logging.info(f"Target path for deletion: {target_path}")
+    logging.info(f"Target file for deletion: {target_filename}")
+    storage = get_storage()
 
     # Check if the file exists and delete it
-    if os.path.exists(target_path):
-        os.remove(target_path)
+    if storage.exists(target_filename):
+        storage.delete(target_filename)
 
         # After deletion, update the filename with UUID in the database
         if is_preview:
             new_filename = f"{uuid.uuid4()}.png"
 
-            old_file_path = os.path.join(
-                UPLOAD_DIR, f"{base_name}_bg_removed.png")
-            logging.info(f"Old file path for renaming: {old_file_path}")
-            new_file_path = os.path.join(UPLOAD_DIR, new_filename)
+            old_filename = f"{base_name}_bg_removed.png"
+            logging.info(f"Old file for renaming: {old_filename}")
 
-            if os.path.exists(old_file_path):
-                os.rename(old_file_path, new_file_path)
+            if storage.exists(old_filename):
+                storage.write_stream(new_filename, BytesIO(storage.read_bytes(old_filename)))
+                storage.delete(old_filename)
+                clothing_item.image_variants = describe_variants(new_filename, generate_image_derivatives(new_filename))
 
             clothing_item.filename = new_filename
             db.commit()
 
-        return {"detail": f"File '{os.path.basename(target_path)}' was deleted, and filename updated in database to '{clothing_item.filename}'."}
+        return {"detail": f"File '{os.path.basename(target_filename)}' was deleted, and filename updated in database to '{clothing_item.filename}'."}
     else:
         raise HTTPException(status_code=404, detail="File not found.")
 
@@ -215,20 +342,55 @@ def mark_clothing_item_as_unfavorite(
 
 def get_all_combinations_for_user(
     db: Session,
-    token: str
-) -> list[dict]:
+    token: str,
+    columnar: bool = False
+) -> list[dict] | dict:
     user_id = get_current_user_id(token, db)
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    return _combinations_response(db.scalars(_user_combinations_statement(user_id)).all(), columnar)
+
+
+async def get_all_combinations_for_user_async(
+    db: AsyncSession,
+    token: str,
+    columnar: bool = False
+) -> list[dict] | dict:
+    """Async version of `get_all_combinations_for_user`."""
+    user_id = await get_current_user_id_async(token, db)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return _combinations_response((await db.scalars(_user_combinations_statement(user_id))).all(), columnar)
+
+
+def _user_combinations_statement(user_id: int):
+    # The items of all combinations are loaded with one more query instead of one per combination
+    return select(ClothingCombination).options(
+        selectinload(ClothingCombination.items)
+    ).where(ClothingCombination.owner_id == user_id).order_by(ClothingCombination.id)
+
+
+def _combinations_response(combinations: list[ClothingCombination], columnar: bool) -> list[dict] | dict:
+    if columnar:
+        # Combinations refer to their items by id, every item is sent once
+        items = {item.id: item for combo in combinations for item in combo.items}
+        return {
+            "combinations": to_columnar([{
+                "id": combo.id,
+                "uuid": combo.uuid,
+                "name": combo.name,
+                "item_ids": [item.id for item in combo.items],
+            } for combo in combinations]),
+            "items": serialize_clothing_items_columnar(sorted(items.values(), key=lambda item: item.id)),
+        }
 
-    combinations = db.query(ClothingCombination).filter_by(
-        owner_id=user_id).all()
     result = []
 
     for combo in combinations:
         items = [
             {
                 "id": item.id,
+                "uuid": item.uuid,
                 "name": item.name,
                 "category": item.category,
                 "season": item.season,
@@ -239,12 +401,14 @@ def get_all_combinations_for_user(
                 "brand": item.brand,
                 "price": item.price,
                 "is_favorite": item.is_favorite,
-                "filename": f"{SERVER_URL}/{UPLOAD_DIR}/{item.filename}"
+                "filename": build_file_url(item.filename),
+                "variants": build_variant_urls(item.filename, item.image_variants)
             }
             for item in combo.items
         ]
         result.append({
             "id": combo.id,
+            "uuid": combo.uuid,
             "name": combo.name,
             "items": items
         })
@@ -252,21 +416,113 @@ def get_all_combinations_for_user(
     return result
 
 
+def serialize_clothing_item(item: ClothingItem) -> dict:
+    """Returns the item as a dict with the image URL and the URLs of its resized variants."""
+    return {
+        **item.to_dict(),
+        "filename": build_file_url(item.filename),
+        "variants": build_variant_urls(item.filename, item.image_variants),
+        "owner_id": item.owner_id,
+    }
+
+
+def get_combinations_with_item_ids(db: Session, owner_id: int) -> list[dict]:
+    """
+    Returns the combinations of a user with only the ids of their items.
+
+    Combinations and their links are read with one join query, no item rows are loaded.
+    """
+    return _group_combination_links(db.execute(_combination_links_statement(owner_id)))
+
+
+async def get_combinations_with_item_ids_async(db: AsyncSession, owner_id: int) -> list[dict]:
+    """Async version of `get_combinations_with_item_ids`."""
+    return _group_combination_links(await db.execute(_combination_links_statement(owner_id)))
+
+
+def _combination_links_statement(owner_id: int):
+    return select(
+        ClothingCombination.id, ClothingCombination.uuid, ClothingCombination.name,
+        clothing_combination_items.c.item_id
+    ).outerjoin(
+        clothing_combination_items, clothing_combination_items.c.combination_id == ClothingCombination.id
+    ).where(
+        ClothingCombination.owner_id == owner_id
+    ).order_by(ClothingCombination.id, clothing_combination_items.c.item_id)
+
+
+def _group_combination_links(rows) -> list[dict]:
+    combinations = {}
+    for combination_id, combination_uuid, name, item_id in rows:
+        combination = combinations.setdefault(
+            combination_id, {"id": combination_id, "uuid": combination_uuid, "name": name, "items": []})
+        if item_id is not None:
+            combination["items"].append(item_id)
+    return list(combinations.values())
+
+
+def serialize_clothing_items_columnar(items: list[ClothingItem]) -> dict:
+    """
+    Returns items column by column (see `to_columnar`) with the files described once.
+
+    The "filename" column holds storage keys. If the storage has a common URL
+    prefix, the URL of a photo is `files.url_prefix + filename` and the URL of a
+    variant `files.url_prefix + <filename without extension>_<variant>.<format>`
+    for every `<variant>.<format>` of the item's "image_variants" column;
+    otherwise (presigned S3 URLs) the "url" and "variants" columns hold them.
+    """
+    result = to_columnar([item.to_dict() for item in items])
+    url_prefix = get_storage().get_url_prefix()
+    result["files"] = {
+        "url_prefix": url_prefix,
+        "variants": list(IMAGE_VARIANTS),
+        "formats": list(get_derivative_formats()),
+    }
+    if url_prefix is not None:
+        result["columns"]["image_variants"] = [parse_variants(item.image_variants) for item in items]
+    else:
+        result["columns"]["url"] = [build_file_url(item.filename) for item in items]
+        result["columns"]["variants"] = [build_variant_urls(item.filename, item.image_variants) for item in items]
+    return result
+
+
+def user_items_statement(owner_id: int):
+    """Selects the items of a user in the order of their ids."""
+    return select(ClothingItem).where(ClothingItem.owner_id == owner_id).order_by(ClothingItem.id)
+
+
 def get_all_clothing_items_for_user(
     db: Session,
-    token: str
+    token: str,
+    columnar: bool = False
 ):
     user_id = get_current_user_id(token, db)
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    return _clothing_items_response(db.scalars(user_items_statement(user_id)).all(), columnar)
 
-    items = db.query(ClothingItem).filter(
-        ClothingItem.owner_id == user_id).all()
-    for item in items:
-        item.filename = f"{SERVER_URL}/{UPLOAD_DIR}/" + item.filename
+
+async def get_all_clothing_items_for_user_async(
+    db: AsyncSession,
+    token: str,
+    columnar: bool = False
+):
+    """Async version of `get_all_clothing_items_for_user`."""
+    user_id = await get_current_user_id_async(token, db)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return _clothing_items_response((await db.scalars(user_items_statement(user_id))).all(), columnar)
+
+
+def _clothing_items_response(items: list[ClothingItem], columnar: bool) -> dict:
+    if columnar:
+        return {
+            "detail": "Clothing items fetched successfully.",
+            "data": serialize_clothing_items_columnar(items)
+        }
     result = {}
     for idx, item in enumerate(items, start=1):
-        result[f"item_{idx}"] = item
+        result[f"item_{idx}"] = serialize_clothing_item(item)
 
     return {
         "detail": "Clothing items fetched successfully.",
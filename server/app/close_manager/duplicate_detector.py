@@ -0,0 +1,164 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from app.constants import DUPLICATE_HASH_MAX_DISTANCE
+from app.model import ClothingItem, User
+
+DHASH_SIZE = 8  # 8x8 comparisons -> 64-bit hash
+
+
+def compute_perceptual_hash(image: Image.Image) -> str:
+    """
+    Computes the difference hash (dHash) of an image as 16 hex characters.
+
+    The image is reduced to a 9x8 grayscale thumbnail and every bit tells
+    whether a pixel is brighter than its right neighbour, so re-encoded,
+    resized or slightly re-lit photos of the same garment get close hashes.
+    """
+    small = image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + col]
+            right = pixels[row * (DHASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+
+    A search for hashes within distance d only visits children whose edge
+    distance is in [distance - d, distance + d], so near-duplicate lookups
+    touch a small part of the tree.
+    """
+
+    def __init__(self):
+        self.root = None  # (hash, [item ids], {edge distance: child node})
+        self.size = 0
+
+    def add(self, value: int, item_id: int):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item_id], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item_id], {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, int]]:
+        """Returns (item id, distance) pairs of all hashes within `max_distance`."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, item_ids, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                found.extend((item_id, distance) for item_id in item_ids)
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(found, key=lambda pair: pair[1])
+
+
+class DuplicateIndex:
+    """
+    Per-user BK-trees of item hashes, built lazily from the database.
+
+    Every change of a wardrobe sets `users.synchronized_at`, on whichever
+    worker it happens, so a tree is kept together with the synchronized_at it
+    was built at and rebuilt once the user's one differs. Items added on this
+    worker are put into the tree with `add`, and `advance` then moves its
+    synchronized_at forward, so uploads don't rebuild it.
+    """
+
+    def __init__(self):
+        self.trees: dict[int, tuple[Optional[datetime], BKTree]] = {}
+        self.lock = threading.Lock()
+
+    def _get_tree(self, db: Session, owner_id: int) -> BKTree:
+        # Queried outside of the lock, so lookups of other users don't wait for the database
+        synchronized_at = db.query(User.synchronized_at).filter(User.id == owner_id).scalar()
+        with self.lock:
+            cached = self.trees.get(owner_id)
+            if cached is not None and cached[0] == synchronized_at:
+                return cached[1]
+        tree = BKTree()
+        rows = db.query(ClothingItem.id, ClothingItem.perceptual_hash).filter(
+            ClothingItem.owner_id == owner_id,
+            ClothingItem.perceptual_hash.isnot(None)
+        )
+        for item_id, perceptual_hash in rows:
+            tree.add(int(perceptual_hash, 16), item_id)
+        with self.lock:
+            self.trees[owner_id] = (synchronized_at, tree)
+        return tree
+
+    def find_duplicates(
+        self,
+        db: Session,
+        owner_id: int,
+        perceptual_hash: Optional[str],
+        max_distance: int = DUPLICATE_HASH_MAX_DISTANCE
+    ) -> list[int]:
+        """Returns ids of the user's items that look like the image with the given hash."""
+        if not perceptual_hash:
+            return []
+        tree = self._get_tree(db, owner_id)
+        with self.lock:
+            return [item_id for item_id, _ in tree.search(int(perceptual_hash, 16), max_distance)]
+
+    def add(self, owner_id: int, item_id: int, perceptual_hash: Optional[str]):
+        """Adds a new item to an already built index; unbuilt indexes load it from the DB later."""
+        if not perceptual_hash:
+            return
+        with self.lock:
+            cached = self.trees.get(owner_id)
+            if cached is not None:
+                cached[1].add(int(perceptual_hash, 16), item_id)
+
+    def advance(self, owner_id: int, previous: Optional[datetime], synchronized_at: datetime):
+        """
+        Moves the tree to the synchronized_at set by a change it already contains.
+
+        The tree is dropped if it wasn't built at `previous`, the synchronized_at
+        before the change, because then it may lack changes of other workers.
+        """
+        with self.lock:
+            cached = self.trees.get(owner_id)
+            if cached is None:
+                return
+            if cached[0] == previous:
+                self.trees[owner_id] = (synchronized_at, cached[1])
+            else:
+                del self.trees[owner_id]
+
+    def invalidate(self, owner_id: int):
+        """Drops the user's index after items were deleted or their images replaced."""
+        with self.lock:
+            if self.trees.pop(owner_id, None) is not None:
+                logging.debug(f"Duplicate index of user {owner_id} invalidated")
+
+
+duplicate_index = DuplicateIndex()
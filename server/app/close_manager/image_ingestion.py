@@ -0,0 +1,103 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from colorthief import ColorThief
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps
+
+from app.constants import MAX_IMAGE_PIXELS, COLOR_SAMPLE_MAX_SIDE
+from app.close_manager.duplicate_detector import compute_perceptual_hash
+from app.storage_manager import StoredBlob, stage_upload, commit_staged_blob, discard_staged_file, get_format_extension
+
+
+@dataclass
+class IngestedImage:
+    """Result of the ingestion pipeline for one uploaded image."""
+    blob: StoredBlob
+    dominant_color: Optional[tuple[int, int, int]]
+    perceptual_hash: Optional[str]
+
+
+class _DecodedImageColorThief(ColorThief):
+    """ColorThief working on an already decoded image instead of a file."""
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+
+
+def decode_image(path: str) -> Image.Image:
+    """
+    Decodes an image file with EXIF orientation applied.
+
+    The returned image keeps the `format` Pillow detected in the file.
+
+    :raises HTTPException: 400 for images with more than MAX_IMAGE_PIXELS pixels,
+        which are rejected from the header before any pixel data is decoded.
+    """
+    try:
+        with Image.open(path) as source:
+            image_format = source.format
+            width, height = source.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise HTTPException(status_code=400, detail="Image resolution is too large.")
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    except Image.DecompressionBombError:
+        # Raised by Image.open itself for images far over Pillow's own limit
+        raise HTTPException(status_code=400, detail="Image resolution is too large.")
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    image.format = image_format
+    return image
+
+
+def extract_dominant_color(image: Image.Image) -> tuple[int, int, int]:
+    """Determines the dominant color of a decoded image."""
+    sample = image
+    if max(image.size) > COLOR_SAMPLE_MAX_SIDE:
+        sample = image.copy()
+        sample.thumbnail((COLOR_SAMPLE_MAX_SIDE, COLOR_SAMPLE_MAX_SIDE), Image.Resampling.BILINEAR)
+    return _DecodedImageColorThief(sample).get_color(quality=1)  # (R, G, B)
+
+
+def ingest_image(file: UploadFile, require_image: bool = True) -> IngestedImage:
+    """
+    Runs an uploaded image through the ingestion pipeline.
+
+    1. The upload stream is read exactly once, into a staged file, while its
+       size is checked and its SHA-256 computed.
+    2. The staged file is decoded once (EXIF orientation applied, decompression
+       bombs rejected).
+    3. The same decoded image is used for the dominant color, the perceptual
+       hash and the resized variants.
+    4. The original bytes are moved into the blob store from the staged file,
+       under the extension of the detected format rather than the client's.
+
+    :param require_image: If False, files that can't be decoded are still
+        stored, without color and hash; otherwise they are rejected with 422.
+    """
+    staged = stage_upload(file)
+    try:
+        image = decode_image(staged.temp_path)
+        dominant_color = extract_dominant_color(image)
+        perceptual_hash = compute_perceptual_hash(image)
+    except Exception as e:
+        if isinstance(e, HTTPException) or require_image:
+            discard_staged_file(staged.temp_path)
+            if isinstance(e, HTTPException):
+                raise
+            logging.warning(f"Failed to process image {file.filename}: {e}")
+            raise HTTPException(status_code=422, detail="Image processing error")
+        logging.warning(f"Storing undecodable image {file.filename}: {e}")
+        image, dominant_color, perceptual_hash = None, None, None
+
+    if image is not None:
+        staged.extension = get_format_extension(image.format, default=staged.extension)
+    try:
+        blob = commit_staged_blob(staged, image=image)
+    except BaseException:
+        discard_staged_file(staged.temp_path)
+        raise
+    return IngestedImage(blob=blob, dominant_color=dominant_color, perceptual_hash=perceptual_hash)
@@ -1,41 +1,52 @@
 import asyncio
+import json
 import os
+from datetime import datetime
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.database.database import get_db
+from app.database.async_database import get_request_db, run_db
 from PIL import Image
 from io import BytesIO
 from colorthief import ColorThief
-from app.user_manager.user_controller import get_current_user, get_current_user_id, oauth2_scheme
+from app.user_manager.user_controller import decode_token_email, get_authenticated_user, mark_user_synchronized, oauth2_scheme
+from app.user_manager.etag_controller import etag_matches, load_user_etag, load_user_etag_async, not_modified_response, set_etag_headers
+from app.user_manager.user_cache import CachedUser
 from app.close_manager.clothing_controller import *
 from app.model import *
 from app.user_manager import *
 from app.constants import SERVER_URL
+from app.executors import run_in_pool
+from app.response_encoding import encode_response, get_representation, is_columnar_layout
 
 clothing_router = APIRouter(tags=["Close Operations"])
 
-def get_dominant_color(file: UploadFile):
-    """Determines the dominant color of an image"""
-    img = Image.open(
-        file.file)  # Use file.file to access the byte stream
-    img = img.convert("RGB")
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG")
-    buffer.seek(0)
-
-    color_thief = ColorThief(buffer)
-    return color_thief.get_color(quality=1)  # (R, G, B)
-
 
 @clothing_router.get("/clothing-items")
-def get_user_clothing_items(
-    db: Session = Depends(get_db),
+async def get_user_clothing_items(
+    request: Request,
+    db: Session | AsyncSession = Depends(get_request_db),
     token: str = Depends(oauth2_scheme)
 ):
-    return get_all_clothing_items_for_user(db, token)
+    """
+    Returns all items of the user.
+
+    Supports `Accept: application/msgpack`, gzip/brotli compression and
+    `?layout=columnar` (see app/response_encoding.py).
+    """
+    etag = await run_db(db, load_user_etag, load_user_etag_async,
+                        email=decode_token_email(token), scope=f"clothing-items:{get_representation(request)}")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    content = await run_db(db, get_all_clothing_items_for_user, get_all_clothing_items_for_user_async,
+                           token=token, columnar=is_columnar_layout(request))
+    response = await run_in_pool("cpu", encode_response, request, content)
+    set_etag_headers(response, etag)
+    return response
 
 
 @clothing_router.post("/add-clothing-item", summary="Add a new clothing item")
@@ -51,7 +62,7 @@ async def add_clothing_item(
     brand: str = Form(None),
     purchase_date: str = Form(None),
     price: float = Form(None),
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
     is_favorite: bool = Form(False),
     db: Session = Depends(get_db)
 ):
@@ -71,29 +82,26 @@ async def add_clothing_item(
         - `price`: Price of the clothing item.
         - `is_favorite`: Boolean indicating whether the item is a favorite.
     - **Response**:
-        - `200 OK`: Clothing item added successfully.
+        - `200 OK`: Clothing item added successfully. `possible_duplicates` lists ids of
+          existing items whose photos look like the same garment.
         - `400 Bad Request`: Invalid color values (if provided).
         - `401 Unauthorized`: User is not authenticated.
         - `422 Unprocessable Entity`: Image processing error or missing required parameters.
     """
-    # Get the user ID via the token
-    try:
-        # Get the user ID from the token
-        owner_id = get_current_user_id(token, db)
-
-    except HTTPException as e:
-        # If an error occurs (e.g., invalid token or user not found)
-        raise e  # Simply raise the exception so FastAPI can respond to the client
+    owner_id = current_user.id
     # ✅ Checking the number of user items
-    item_count = db.query(ClothingItem).filter(
-        ClothingItem.owner_id == owner_id).count()
+    item_count = await run_in_pool("db", db.query(ClothingItem).filter(
+        ClothingItem.owner_id == owner_id).count)
     if item_count >= MAX_CLOTHING_ITEMS_COUNT:
         raise HTTPException(
             status_code=400, detail="Item limit reached. Maximum 100 clothing items allowed per user.")
+    # Store the file and decode it once for its dominant color, perceptual hash and variants;
+    # an undecodable image is accepted only if the color was given
+    ingested = await run_in_pool("image", ingest_image, file, require_image=not red or not green or not blue)
+    blob = ingested.blob
     # If color is not specified, determine it automatically
     if not red or not green or not blue:
-        # Call get_dominant_color with the file
-        red, green, blue = get_dominant_color(file)
+        red, green, blue = ingested.dominant_color
     else:
         try:
             red = int(red)
@@ -101,12 +109,14 @@ async def add_clothing_item(
             blue = int(blue)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid color values")
-    # Save the file to the server
-    filename = save_file(file)
+    # 🔍 Flag items of the user that look like the same garment
+    possible_duplicates = await run_in_pool("db", duplicate_index.find_duplicates, db, owner_id, ingested.perceptual_hash)
     # Call the function to add the item to the database
-    new_clothing_item = add_clothing_item_to_db(
+    new_clothing_item = await run_in_pool(
+        "db",
+        add_clothing_item_to_db,
         db,
-        filename,
+        blob.filename,
         name,
         category,
         season,
@@ -118,14 +128,25 @@ async def add_clothing_item(
         purchase_date,
         price,
         is_favorite,
-        owner_id
+        owner_id,
+        content_hash=blob.sha256,
+        perceptual_hash=ingested.perceptual_hash,
+        image_variants=blob.image_variants
     )
-    update_synchronized_at(token, db)
+
+    def mark_synchronized():
+        synchronized_at = mark_user_synchronized(db, current_user, "item", new_clothing_item.id, "create")
+        duplicate_index.advance(owner_id, current_user.synchronized_at, datetime.fromisoformat(synchronized_at))
+        db.refresh(new_clothing_item)
+        return synchronized_at
+
+    synchronized_at = await run_in_pool("db", mark_synchronized)
     return {
         "detail": "Clothing item added successfully.",
         "data": {
             "id": new_clothing_item.id,
-            "filename": f"{SERVER_URL}/{UPLOAD_DIR}/{new_clothing_item.filename}",
+            "filename": build_file_url(new_clothing_item.filename),
+            "variants": build_variant_urls(new_clothing_item.filename, new_clothing_item.image_variants),
             "name": new_clothing_item.name,
             "category": new_clothing_item.category,
             "season": new_clothing_item.season,
@@ -139,7 +160,51 @@ async def add_clothing_item(
             "is_favorite": new_clothing_item.is_favorite,
             "owner_id": new_clothing_item.owner_id,
         },
-        "synchronized_at": get_current_user(token, db).synchronized_at_iso
+        "possible_duplicates": possible_duplicates,
+        "synchronized_at": synchronized_at
+    }
+
+
+@clothing_router.post("/clothing-items/batch", summary="Add several clothing items at once")
+def add_clothing_items_batch_route(
+    files: List[UploadFile] = File(...),
+    items: str = Form(...),
+    current_user: CachedUser = Depends(get_authenticated_user),
+    db: Session = Depends(get_db)
+):
+    """
+    **Adds several clothing items in one request.**
+
+    - **Headers**: `Authorization: Bearer <token>`
+    - **Parameters**:
+        - `files`: Images of the clothing items.
+        - `items`: JSON list with the metadata of each item, in the same order as `files`.
+          Every entry takes the fields of `/add-clothing-item` (`name`, `category`, `season`,
+          `material`, optional `red`, `green`, `blue`, `brand`, `purchase_date`, `price`, `is_favorite`).
+    - **Response**:
+        - `200 OK`: Per-item results, each with `status` `created` (and `data`) or `failed` (and `detail`).
+        - `400 Bad Request`: Invalid JSON, files and items do not match, or the item limit would be exceeded.
+        - `401 Unauthorized`: User is not authenticated.
+    """
+    try:
+        items_data = json.loads(items)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid items JSON")
+    if not isinstance(items_data, list) or not all(isinstance(item, dict) for item in items_data):
+        raise HTTPException(status_code=400, detail="Items must be a list of objects")
+
+    results = add_clothing_items_batch(db, current_user.id, files, items_data)
+    created = sum(1 for result in results if result["status"] == "created")
+    if created:
+        synchronized_at = mark_user_synchronized(db, current_user, "item", None, "create")
+        duplicate_index.advance(current_user.id, current_user.synchronized_at, datetime.fromisoformat(synchronized_at))
+    else:
+        synchronized_at = current_user.synchronized_at_iso
+
+    return {
+        "detail": f"{created} of {len(results)} clothing items added successfully.",
+        "data": results,
+        "synchronized_at": synchronized_at
     }
 
 
@@ -158,20 +223,17 @@ async def update_clothing_item(
     purchase_date: str = Form(None),
     price: float = Form(None),
     is_favorite: bool = Form(None),
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
     db: Session = Depends(get_db)
 ):
     """
     **Updates a clothing item.**
 
     - **Headers**: `Authorization: Bearer <token>`
-    - If a new image is uploaded, the old one will be removed.
+    - If a new image is uploaded, the old one will be removed unless another item uses it.
     """
-    # Get the user ID via the token
-    current_user: User = get_current_user(token, db)
-
-    clothing_item = db.query(ClothingItem).filter(
-        ClothingItem.id == item_id).first()
+    clothing_item = await run_in_pool("db", db.query(ClothingItem).filter(
+        ClothingItem.id == item_id).first)
 
     if not clothing_item or clothing_item.owner_id != current_user.id:
         raise HTTPException(
@@ -196,29 +258,34 @@ async def update_clothing_item(
     clothing_item.price = price if price is not None else None
     clothing_item.is_favorite = is_favorite if is_favorite is not None else clothing_item.is_favorite
 
-    # 📁 Remove old file and save new one
+    # 📁 Save new file; the old one is removed below if nothing else uses it
+    old_filename = None
     if file:
         old_filename = clothing_item.filename
-        filename = save_file(file)
-        clothing_item.filename = filename
-
-        if old_filename:
-            old_file_path = os.path.join("{UPLOAD_DIR}", old_filename)
-            if os.path.exists(old_file_path):
-                try:
-                    os.remove(old_file_path)
-                except Exception as e:
-                    logging.warning(f"Failed to delete old file: {e}")
-
-    db.commit()
-    db.refresh(clothing_item)
-    update_synchronized_at(token, db)
+        ingested = await run_in_pool("image", ingest_image, file, require_image=False)
+        clothing_item.perceptual_hash = ingested.perceptual_hash
+        clothing_item.filename = ingested.blob.filename
+        clothing_item.content_hash = ingested.blob.sha256
+        clothing_item.image_variants = ingested.blob.image_variants
+        duplicate_index.invalidate(current_user.id)
+
+    def save_changes():
+        db.commit()
+        db.refresh(clothing_item)
+        if old_filename and old_filename != clothing_item.filename:
+            release_blobs(db, [old_filename])
+        synchronized_at = mark_user_synchronized(db, current_user, "item", clothing_item.id, "update")
+        db.refresh(clothing_item)
+        return synchronized_at
+
+    synchronized_at = await run_in_pool("db", save_changes)
 
     return {
         "detail": "Clothing item updated successfully.",
         "data": {
             "id": clothing_item.id,
-            "filename": f"{SERVER_URL}/{UPLOAD_DIR}/{clothing_item.filename}",
+            "filename": build_file_url(clothing_item.filename),
+            "variants": build_variant_urls(clothing_item.filename, clothing_item.image_variants),
             "name": clothing_item.name,
             "category": clothing_item.category,
             "season": clothing_item.season,
@@ -231,7 +298,7 @@ async def update_clothing_item(
             "price": clothing_item.price,
             "is_favorite": clothing_item.is_favorite,
         },
-        "synchronized_at": current_user.synchronized_at_iso
+        "synchronized_at": synchronized_at
     }
 
 
@@ -239,19 +306,18 @@ async def update_clothing_item(
 async def preview_remove_clothing_item_background(
     clothing_item_id: int,
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    current_user: CachedUser = Depends(get_authenticated_user)
 ):
-    current_user: User = get_current_user(token, db)
-
-    clothing_item = db.query(ClothingItem).filter(
+    clothing_item = await run_in_pool("db", db.query(ClothingItem).filter(
         ClothingItem.id == clothing_item_id,
         ClothingItem.owner_id == current_user.id
-    ).first()
+    ).first)
 
     if not clothing_item:
         raise HTTPException(status_code=404, detail="Clothing item not found")
 
-    new_filename, output_io = remove_background_preview(clothing_item.filename)
+    # ONNX inference is slow and memory hungry, so it runs on its own small pool
+    new_filename, output_io = await run_in_pool("ml", remove_background_preview, clothing_item.filename)
 
     # Важливо "перемотати" віртуальний файл на початок
     output_io.seek(0)
@@ -268,10 +334,8 @@ async def preview_remove_clothing_item_background(
 def toggle_favorite_item(
     item_id: int,
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    current_user: CachedUser = Depends(get_authenticated_user)
 ):
-    current_user: User = get_current_user(token, db)
-
     # Find the user's clothing item
     clothing_item = db.query(ClothingItem).filter(
         ClothingItem.id == item_id,
@@ -285,69 +349,72 @@ def toggle_favorite_item(
     # Toggle the value of is_favorite
     clothing_item.is_favorite = not clothing_item.is_favorite
     db.commit()
-    db.refresh(clothing_item)
 
-    update_synchronized_at(token, db)
+    synchronized_at = mark_user_synchronized(db, current_user, "item", clothing_item.id, "update")
+    db.refresh(clothing_item)
 
     return {
         "detail": f"Item with {item_id}{'added to' if clothing_item.is_favorite else 'removed from'} favorites",
         "data": {
             "is_favorite": clothing_item.is_favorite
         },
-        "synchronized_at": current_user.synchronized_at_iso
+        "synchronized_at": synchronized_at
     }
 
 
 @clothing_router.delete("/clothing-items/{item_id}", summary="Delete clothing item")
 async def delete_clothing_item(
     item_id: int,
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
     db: Session = Depends(get_db)
 ):
     """
     **Deletes a clothing item.**
 
     - **Headers**: `Authorization: Bearer <token>`
-    - Deletes the file from disk if it exists.
+    - Deletes the file from disk if no other item uses it.
     """
-    # Get the current user
-    current_user: User = get_current_user(token, db)
-
     # Find the clothing item
-    clothing_item = db.query(ClothingItem).filter(
-        ClothingItem.id == item_id).first()
+    clothing_item = await run_in_pool("db", db.query(ClothingItem).filter(
+        ClothingItem.id == item_id).first)
 
     if not clothing_item or clothing_item.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Clothing item not found")
 
-    # Delete associated file if it exists
-    if clothing_item.filename:
-        file_path = os.path.join("{UPLOAD_DIR}", clothing_item.filename)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                logging.warning(f"Failed to delete file: {e}")
-
-    # Delete the item from the database
-    db.delete(clothing_item)
-    db.commit()
-    update_synchronized_at(token, db)
+    def delete_item():
+        # Delete the item from the database
+        filename = clothing_item.filename
+        db.delete(clothing_item)
+        db.commit()
+        duplicate_index.invalidate(current_user.id)
+        # Delete associated file if no other item references it
+        release_blobs(db, [filename])
+        return mark_user_synchronized(db, current_user, "item", item_id, "delete")
+
+    synchronized_at = await run_in_pool("db", delete_item)
 
     return {"detail": f"Clothing item with id {item_id} deleted successfully.",
-            "synchronized_at": current_user.synchronized_at_iso}
+            "synchronized_at": synchronized_at}
 
 
 @clothing_router.get("/clothing-combinations")
-def get_user_combinations(
-    db: Session = Depends(get_db),
+async def get_user_combinations(
+    request: Request,
+    db: Session | AsyncSession = Depends(get_request_db),
     token: str = Depends(oauth2_scheme)
 ):
-    data = get_all_combinations_for_user(db, token)
-    return {
+    etag = await run_db(db, load_user_etag, load_user_etag_async,
+                        email=decode_token_email(token), scope=f"clothing-combinations:{get_representation(request)}")
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    data = await run_db(db, get_all_combinations_for_user, get_all_combinations_for_user_async,
+                        token=token, columnar=is_columnar_layout(request))
+    response = await run_in_pool("cpu", encode_response, request, {
         "detail": "Clothing combinations fetched successfully.",
         "data": data
-    }
+    })
+    set_etag_headers(response, etag)
+    return response
 
 
 class CombinationRequest(BaseModel):
@@ -360,12 +427,8 @@ def update_clothing_combination(
     combination_id: int,
     request: CombinationRequest,
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
 ):
-    current_user = get_current_user(token, db)
-    if not current_user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
     combination = db.query(ClothingCombination).filter(
         ClothingCombination.id == combination_id,
         ClothingCombination.owner_id == current_user.id
@@ -392,14 +455,13 @@ def update_clothing_combination(
         combination.items = items
 
     db.commit()
-    db.refresh(combination)
 
-    update_synchronized_at(token, db)
+    synchronized_at = mark_user_synchronized(db, current_user, "combination", combination_id, "update")
 
     return {
         "detail": "Clothing combination updated successfully.",
-        "data": {"combination_id": combination.id},
-        "synchronized_at": current_user.synchronized_at_iso
+        "data": {"combination_id": combination_id},
+        "synchronized_at": synchronized_at
     }
 
 
@@ -407,25 +469,22 @@ def update_clothing_combination(
 def create_clothing_combination(
     request: CombinationRequest,
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
 ):
-    user_id = get_current_user_id(token, db)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
     combination = create_combination_in_db(
         db=db,
         name=request.name,
         item_ids=request.item_ids,
-        owner_id=user_id
+        owner_id=current_user.id
     )
     if combination is HTTPException:
         raise combination
-    update_synchronized_at(token, db)
+    combination_id = combination.id
+    synchronized_at = mark_user_synchronized(db, current_user, "combination", combination_id, "create")
     return {
         "detail": "Clothing combination created successfully.",
-        "data": {"combination_id": combination.id},
-        "synchronized_at": get_current_user(token, db).synchronized_at_iso
+        "data": {"combination_id": combination_id},
+        "synchronized_at": synchronized_at
     }
 
 
@@ -433,12 +492,8 @@ def create_clothing_combination(
 def delete_clothing_combination(
     combination_id: int,
     db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme),
+    current_user: CachedUser = Depends(get_authenticated_user),
 ):
-    current_user = get_current_user(token, db)
-    if not current_user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
     combination = db.query(ClothingCombination).filter(
         ClothingCombination.id == combination_id,
         ClothingCombination.owner_id == current_user.id
@@ -450,9 +505,9 @@ def delete_clothing_combination(
     db.delete(combination)
     db.commit()
 
-    update_synchronized_at(token, db)
+    synchronized_at = mark_user_synchronized(db, current_user, "combination", combination_id, "delete")
 
     return {
         "detail": "Clothing combination deleted successfully.",
-        "synchronized_at": current_user.synchronized_at_iso
+        "synchronized_at": synchronized_at
     }
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -11,11 +12,116 @@ else:
     DATABASE_URL = os.getenv("DATABASE_URL")
     UPLOAD_DIR = "uploads"
 
+# "sync" runs queries on a Session in the "db" thread pool, "async" lets the read endpoints
+# query on the event loop through an AsyncSession (aiomysql, aiosqlite)
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync")
+# Derived from DATABASE_URL when unset, e.g. mysql+pymysql://... -> mysql+aiomysql://...
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# File storage: "local" keeps files in UPLOAD_DIR, "s3" uses an S3-compatible bucket (AWS, MinIO, ...)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+STORAGE_URL_EXPIRES_SECONDS = 3600  # Lifetime of presigned image URLs
+# Unreferenced uploads younger than the grace period are kept, they may belong to an upload in progress
+STORAGE_GC_GRACE_SECONDS = int(os.getenv("STORAGE_GC_GRACE_SECONDS", 24 * 60 * 60))
+STORAGE_GC_INTERVAL_SECONDS = int(os.getenv("STORAGE_GC_INTERVAL_SECONDS", 6 * 60 * 60))  # 0 disables the scheduled run
+# Expired upload sessions, tombstones, refresh tokens and TTL entries are removed this often; 0 disables it
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", 60 * 60))
+# A blob reused by an upload is kept this long even without references, until the new item is committed
+BLOB_LEASE_SECONDS = 60 * 60
 
 OPEN_WEATHER_API_KEY = os.getenv("OPEN_WEATHER_API_KEY")
 MAIL_USERNAME = os.getenv("MAIL_USERNAME")
 MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "1") == "1"
+# Outgoing emails are queued in the email_outbox table and sent by a background task
+EMAIL_OUTBOX_ENABLED = os.getenv("EMAIL_OUTBOX_ENABLED", "1") == "1"  # Run the sender in this process
+EMAIL_SMTP_POOL_SIZE = 2  # Open SMTP connections reused between sends
+EMAIL_BATCH_SIZE = 20  # Messages claimed from the outbox at once
+EMAIL_POLL_INTERVAL_SECONDS = 5
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30  # Delay before the first retry, doubled after every failure
+EMAIL_CLAIM_TIMEOUT_SECONDS = 10 * 60  # Messages of a sender that died while sending are retried after this
+EMAIL_SMTP_MAX_IDLE_SECONDS = 60  # Idle SMTP connections older than this are reopened instead of reused
+# Sent and failed messages contain verification codes and reset links; they are deleted after this
+EMAIL_RETENTION_SECONDS = 24 * 60 * 60
+EMAIL_CLEANUP_INTERVAL_SECONDS = 60 * 60
 MAX_FILE_SIZE_MB = 5
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read from an upload stream per iteration
+# Longest side in pixels of every generated image variant (None keeps the original size)
+IMAGE_VARIANTS = {"thumb": 256, "medium": 768, "original": None}
+IMAGE_VARIANT_QUALITY = 80
+MAX_IMAGE_PIXELS = 40_000_000  # Decompression bomb guard: larger images are rejected before decoding
+COLOR_SAMPLE_MAX_SIDE = 512  # Dominant color is computed on a copy downscaled to this size
+DUPLICATE_HASH_MAX_DISTANCE = 6  # Max differing bits of perceptual hashes to flag items as duplicates
+BATCH_UPLOAD_WORKERS = 4  # Images of one batch upload processed at the same time
+# Worker threads of the named executor pools (see app/executors.py)
+EXECUTOR_POOL_SIZES = {
+    "image": int(os.getenv("EXECUTOR_IMAGE_WORKERS", os.cpu_count() or 2)),
+    "ml": int(os.getenv("EXECUTOR_ML_WORKERS", 1)),
+    "cpu": int(os.getenv("EXECUTOR_CPU_WORKERS", 2)),
+    "db": int(os.getenv("EXECUTOR_DB_WORKERS", 16)),
+    "http": int(os.getenv("EXECUTOR_HTTP_WORKERS", 8)),
+    "upload": int(os.getenv("EXECUTOR_UPLOAD_WORKERS", 8)),
+    "password": int(os.getenv("EXECUTOR_PASSWORD_WORKERS", os.cpu_count() or 2)),
+}
+EXECUTOR_MAX_QUEUED = int(os.getenv("EXECUTOR_MAX_QUEUED", 64))  # Tasks waiting per pool before new ones get 503
+# Token monitoring sends as "Authorization: Bearer <token>" to read /metrics/*; unset disables the endpoints
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# bcrypt work factor of new password hashes; older hashes are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 4 if os.getenv("TESTING") == "1" else 12))
+# Short-lived values (verification codes, reset tokens): "database" is shared by all workers,
+# "memory" keeps them in the process (single worker only)
+TTL_STORE_BACKEND = os.getenv("TTL_STORE_BACKEND", "database")
+TTL_STORE_MAX_ENTRIES = 10_000  # Limit of the in-memory backend
+VERIFICATION_CODE_TTL_SECONDS = 15 * 60
+PASSWORD_RESET_TOKEN_TTL_SECONDS = 60 * 60
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 30))  # 0 disables the current-user cache
+USER_CACHE_MAX_ENTRIES = 10_000
+# Token bucket rate limits: "METHOD /path" -> {"ip" or "user": (capacity, seconds to refill it)}.
+# A client may send `capacity` requests at once and then one more every seconds/capacity.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "0" if os.getenv("TESTING") == "1" else "1") == "1"
+# "memory" counts requests per worker process, "database" shares the buckets between all workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_BUCKETS = 100_000  # Limit of the in-memory backend
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "0") == "1"  # Behind a reverse proxy
+RATE_LIMITS = {
+    "POST /login_with_email": {"ip": (10, 60)},
+    "POST /token": {"ip": (10, 60)},
+    "POST /register": {"ip": (10, 60 * 60)},
+    "POST /forgot-password": {"ip": (5, 15 * 60)},
+    "POST /recommendations": {"user": (30, 60), "ip": (60, 60)},
+    "GET /clothing-items/{clothing_item_id}/preview-remove-background": {"user": (10, 60), "ip": (20, 60)},
+}
+# Delta sync returns rows changed this long before `since` too, to cover writes that raced the previous sync
+SYNC_DELTA_OVERLAP_SECONDS = 5
+SYNC_TOMBSTONE_RETENTION_DAYS = 90  # Clients that didn't sync for longer get a full sync
+# Part of the ETags of read endpoints: bump it when their JSON changes, so clients don't keep old responses
+RESPONSE_SCHEMA_VERSION = 1
+# Resumable uploads keep their part files on local disk, so all requests of a session must reach the same host
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join(tempfile.gettempdir(), "clothes-advisor-upload-sessions"))
+UPLOAD_SESSION_TTL_SECONDS = 24 * 60 * 60  # Unfinished sessions and their files are removed after this
+UPLOAD_SESSION_MAX_OPEN = 5  # Open upload sessions per user
+# Sync and listing responses are compressed from this size on (see app/response_encoding.py)
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5  # 0-11, higher levels cost much more CPU for little gain
+# Change feed of connected devices: "memory" reaches devices connected to this process,
+# "database" relays events between worker processes through the change_events table
+CHANGE_FEED_BACKEND = os.getenv("CHANGE_FEED_BACKEND", "memory")
+CHANGE_FEED_QUEUE_SIZE = 100  # Undelivered events per connection before the device is told to resync
+CHANGE_FEED_POLL_INTERVAL_SECONDS = 1.0  # How often the database backend looks for events of other workers
+# Events that commit out of id order within this window are still relayed
+CHANGE_FEED_POLL_OVERLAP_SECONDS = 30.0
+CHANGE_FEED_RETENTION_SECONDS = 5 * 60  # Relayed events are deleted after this
+CHANGE_FEED_TICKET_TTL_SECONDS = 60  # One-time tickets for opening the change feed from a browser
 MAX_CLOTHING_ITEMS_COUNT = 100
 MAX_CLOTHING_COMBINATIONS_COUNT = 50
\ No newline at end of file
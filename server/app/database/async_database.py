@@ -0,0 +1,110 @@
+"""
+Async database mode.
+
+With DATABASE_MODE=async the read endpoints (wardrobe listings, the
+server-to-local sync) get an `AsyncSession` and query on the event loop, so
+a worker serves many concurrent requests without a thread per query. With
+DATABASE_MODE=sync (the default) they get a `Session` and run their queries
+in the "db" thread pool. Writes always use the sync `Session`.
+
+Controllers that support both modes come in pairs, e.g.
+`get_all_clothing_items_for_user` and `get_all_clothing_items_for_user_async`,
+built on the same `select()` statements and taking the session as `db`;
+`run_db` calls the one that matches the session.
+"""
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, TypeVar, Union
+
+from fastapi import Depends
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.constants import ASYNC_DATABASE_URL, DATABASE_MODE, DATABASE_URL
+from app.executors import run_in_pool
+from .database import SessionLocal, get_db
+
+T = TypeVar("T")
+
+DATABASE_MODES = ("sync", "async")
+# Async driver of each database, used when ASYNC_DATABASE_URL is not set
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+if DATABASE_MODE not in DATABASE_MODES:
+    raise ValueError(f"❌ Unsupported database mode: '{DATABASE_MODE}'")
+
+
+def to_async_url(url: str) -> str:
+    """Returns the URL with the async driver of its database, e.g. mysql+pymysql://... -> mysql+aiomysql://..."""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"❌ No async driver for database '{parsed.get_backend_name()}'")
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+@lru_cache(maxsize=1)
+def get_async_engine() -> AsyncEngine:
+    """Returns the async engine, created on first use so the sync mode doesn't need the async drivers."""
+    return create_async_engine(ASYNC_DATABASE_URL or to_async_url(DATABASE_URL), pool_size=10, max_overflow=20)
+
+
+@lru_cache(maxsize=1)
+def get_async_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+async def dispose_async_engine():
+    """Closes the connections of the async engine if it was created."""
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Dependency for an async database session."""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+async def get_request_db() -> AsyncIterator[Union[Session, AsyncSession]]:
+    """Dependency for the session of the configured DATABASE_MODE."""
+    if DATABASE_MODE == "async":
+        async for db in get_async_db():
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        # Closing may roll back on the connection, which blocks like any sync query
+        await run_in_pool("db", db.close)
+
+
+async def get_read_db(db: Session = Depends(get_db)) -> AsyncIterator[Union[Session, AsyncSession]]:
+    """
+    Dependency for the reads of an endpoint that also writes through `get_db`.
+
+    In sync mode it is that same `Session`, so the request holds one
+    connection; in async mode an `AsyncSession` as from `get_request_db`.
+    """
+    if DATABASE_MODE == "async":
+        async for read_db in get_async_db():
+            yield read_db
+        return
+    yield db
+
+
+async def run_db(
+    db: Union[Session, AsyncSession],
+    sync_fn: Callable[..., T],
+    async_fn: Callable[..., Awaitable[T]],
+    *args,
+    **kwargs
+) -> T:
+    """Calls `async_fn(..., db=db)` for an AsyncSession and `sync_fn(..., db=db)` in the "db" pool for a Session."""
+    if isinstance(db, AsyncSession):
+        return await async_fn(*args, db=db, **kwargs)
+    return await run_in_pool("db", sync_fn, *args, db=db, **kwargs)
@@ -7,6 +7,7 @@ from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 from .base import CA_Base
+from .schema_upgrade import upgrade_schema
 from app.constants import DATABASE_URL
 # Load environment variables from the .env file
 
@@ -34,6 +35,8 @@ print("✅ Registered tables:", CA_Base.metadata.tables.keys())
 
 # Create tables if they do not already exist
 CA_Base.metadata.create_all(bind=engine)
+# Add columns and indexes introduced after the tables were created
+upgrade_schema(engine)
 
 # Check for new tables created by create_all
 new_tables = set(CA_Base.metadata.tables.keys()) - set(existing_tables)
@@ -0,0 +1,162 @@
+"""
+Shows the query plans of the owner-scoped wardrobe queries before and after
+the schema upgrade that added the composite indexes.
+
+A temporary SQLite database is created with the schema as it was before
+(no composite indexes, no primary key on clothing_combination_items), filled
+with generated wardrobes, and every query is explained and timed. Then
+`upgrade_schema` brings the database to the current schema, the same way it
+does on startup, and the queries are explained and timed again.
+
+Usage:
+    python -m app.database.query_plans [--users 200] [--items 100] [--repeat 50]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+import app.model  # noqa: F401 - registers the tables in CA_Base.metadata
+from .base import CA_Base
+from .schema_upgrade import upgrade_schema
+
+# Indexes added by the schema upgrade, dropped to recreate the schema as it was before
+COMPOSITE_INDEXES = [
+    "ix_clothing_items_owner_id_category",
+    "ix_clothing_items_owner_id_updated_at",
+    "ix_clothing_combinations_owner_id_updated_at",
+    "ix_clothing_combination_items_item_id_combination_id",
+]
+
+# The queries the controllers run on every listing, sync and stats request
+QUERIES = {
+    "items of a user": "SELECT * FROM clothing_items WHERE owner_id = :owner_id ORDER BY id",
+    "item by owner and id": "SELECT * FROM clothing_items WHERE owner_id = :owner_id AND id = :item_id",
+    "items of a category": "SELECT * FROM clothing_items WHERE owner_id = :owner_id AND category = :category",
+    "category stats": "SELECT category, COUNT(*) FROM clothing_items WHERE owner_id = :owner_id GROUP BY category",
+    "changed items": (
+        "SELECT * FROM clothing_items WHERE owner_id = :owner_id AND updated_at > :since ORDER BY id"),
+    "combinations of a user": "SELECT * FROM clothing_combinations WHERE owner_id = :owner_id ORDER BY id",
+    "links of a combination": (
+        "SELECT item_id FROM clothing_combination_items WHERE combination_id = :combination_id"),
+    "combinations of an item": (
+        "SELECT combination_id FROM clothing_combination_items WHERE item_id = :item_id"),
+    "user by email": "SELECT id FROM users WHERE email = :email",
+}
+
+CATEGORIES = ["tshirt", "pants", "jacket", "dress", "shoes", "coat", "hoodie", "jeans"]
+
+
+def create_legacy_schema(engine: Engine):
+    """Creates the tables as they were before the composite indexes and the primary key of the links."""
+    CA_Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for name in COMPOSITE_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        # CREATE TABLE ... AS SELECT copies the columns without keys
+        connection.execute(text("ALTER TABLE clothing_combination_items RENAME TO clothing_combination_items_new"))
+        connection.execute(text(
+            "CREATE TABLE clothing_combination_items AS SELECT * FROM clothing_combination_items_new"))
+        connection.execute(text("DROP TABLE clothing_combination_items_new"))
+
+
+def fill_wardrobes(engine: Engine, users: int, items_per_user: int, combinations_per_user: int = 20):
+    rng = random.Random(42)
+    now = datetime(2025, 5, 1)
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (id, email, password, is_email_verified) VALUES (:id, :email, 'x', 1)"),
+            [{"id": user_id, "email": f"user{user_id}@example.com"} for user_id in range(1, users + 1)]
+        )
+        item_rows, combination_rows, link_rows = [], [], []
+        item_id = 0
+        for user_id in range(1, users + 1):
+            first_item = item_id + 1
+            for _ in range(items_per_user):
+                item_id += 1
+                item_rows.append({
+                    "id": item_id, "uuid": f"item-{item_id}", "owner_id": user_id, "name": f"Item {item_id}",
+                    "filename": f"{item_id}.png", "category": rng.choice(CATEGORIES), "season": "summer",
+                    "material": "cotton", "updated_at": now - timedelta(minutes=rng.randrange(100_000)),
+                })
+            for _ in range(combinations_per_user):
+                combination_id = len(combination_rows) + 1
+                combination_rows.append({
+                    "id": combination_id, "uuid": f"combination-{combination_id}", "owner_id": user_id,
+                    "name": f"Combination {combination_id}", "updated_at": now,
+                })
+                for linked_id in rng.sample(range(first_item, item_id + 1), min(4, items_per_user)):
+                    link_rows.append({"combination_id": combination_id, "item_id": linked_id})
+        connection.execute(text(
+            "INSERT INTO clothing_items (id, uuid, owner_id, name, filename, category, season, material, "
+            "is_favorite, updated_at) VALUES (:id, :uuid, :owner_id, :name, :filename, :category, :season, "
+            ":material, 0, :updated_at)"), item_rows)
+        connection.execute(text(
+            "INSERT INTO clothing_combinations (id, uuid, owner_id, name, updated_at) "
+            "VALUES (:id, :uuid, :owner_id, :name, :updated_at)"), combination_rows)
+        connection.execute(text(
+            "INSERT INTO clothing_combination_items (combination_id, item_id) VALUES (:combination_id, :item_id)"),
+            link_rows)
+        connection.execute(text("ANALYZE"))
+    return item_id
+
+
+def explain(engine: Engine, params: dict, repeat: int) -> dict[str, tuple[str, float]]:
+    """Returns the plan and the average time in milliseconds of every query in QUERIES."""
+    results = {}
+    with engine.connect() as connection:
+        for name, sql in QUERIES.items():
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                connection.execute(text(sql), params).all()
+            elapsed = (time.perf_counter() - started) * 1000 / repeat
+            results[name] = ("; ".join(row[-1] for row in plan), elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares query plans before and after the schema upgrade.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--items", type=int, default=100, help="clothing items per user")
+    parser.add_argument("--repeat", type=int, default=50, help="runs of every query for the timing")
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        create_legacy_schema(engine)
+        items = fill_wardrobes(engine, args.users, args.items)
+        user_id = args.users // 2
+        params = {
+            "owner_id": user_id, "item_id": user_id * args.items, "category": "jacket",
+            "since": datetime(2025, 4, 30), "combination_id": user_id * 20, "email": f"user{user_id}@example.com",
+        }
+        print(f"{args.users} users, {items} clothing items\n")
+
+        before = explain(engine, params, args.repeat)
+        upgrade_schema(engine)
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+        after = explain(engine, params, args.repeat)
+
+        for name in QUERIES:
+            (plan_before, time_before), (plan_after, time_after) = before[name], after[name]
+            print(f"{name}:")
+            print(f"  before {time_before:8.3f} ms  {plan_before}")
+            print(f"  after  {time_after:8.3f} ms  {plan_after}")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
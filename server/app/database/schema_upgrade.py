@@ -0,0 +1,219 @@
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from .base import CA_Base
+
+# Unique constraints that were removed from the models, as table -> list of column sets.
+# create_all() never drops anything, so existing databases are cleaned up here.
+OBSOLETE_UNIQUE_COLUMNS = {
+    # Content-addressed uploads let several items share one file
+    "clothing_items": [["filename"]],
+}
+
+# MySQL named lock that lets one worker at a time upgrade the schema
+SCHEMA_UPGRADE_LOCK = "closet_assistant_schema_upgrade"
+SCHEMA_UPGRADE_LOCK_TIMEOUT_SECONDS = 600
+
+# Tables that only hold short-lived data; they are recreated when their columns changed
+DISPOSABLE_TABLES = {
+    # Float columns became doubles together with the addition of full_at and version
+    "rate_limit_buckets": ["full_at", "version"],
+}
+
+# Tables whose rows have a client-visible uuid and updated_at for delta sync
+SYNC_TABLES = ["clothing_items", "clothing_combinations"]
+
+
+def recreate_disposable_tables(engine: Engine):
+    """Drops and recreates tables of DISPOSABLE_TABLES that lack one of the listed columns."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table_name, columns in DISPOSABLE_TABLES.items():
+        if table_name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table_name)}
+        if set(columns) <= existing_columns:
+            continue
+        table = CA_Base.metadata.tables[table_name]
+        table.drop(bind=engine)
+        table.create(bind=engine)
+        logging.info(f"🛠️ Recreated table {table_name}")
+
+
+def add_missing_columns(engine: Engine):
+    """Adds columns that exist in the models but not yet in already created tables."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in CA_Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            with engine.begin() as connection:
+                connection.execute(text(ddl))
+            logging.info(f"🛠️ Added column {table.name}.{column.name}")
+
+
+def fill_missing_sync_columns(engine: Engine):
+    """Gives rows created before delta sync a uuid and an updated_at."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with engine.begin() as connection:
+        for table_name in SYNC_TABLES:
+            ids = connection.execute(text(f"SELECT id FROM {table_name} WHERE uuid IS NULL")).scalars().all()
+            if ids:
+                connection.execute(
+                    text(f"UPDATE {table_name} SET uuid = :uuid WHERE id = :id"),
+                    [{"id": row_id, "uuid": str(uuid.uuid4())} for row_id in ids]
+                )
+                logging.info(f"🛠️ Generated uuids for {len(ids)} rows of {table_name}")
+            connection.execute(
+                text(f"UPDATE {table_name} SET updated_at = :now WHERE updated_at IS NULL"), {"now": now})
+
+
+def create_missing_indexes(engine: Engine):
+    """Creates indexes declared in the models that are missing in existing tables."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in CA_Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        reflected = inspector.get_indexes(table.name)
+        existing_indexes = {index["name"] for index in reflected}
+        # Column lists that are already indexed under another name, e.g. the unique key MySQL
+        # created for `unique=True` before the column was declared with a named index
+        existing_columns = {(tuple(index["column_names"]), bool(index.get("unique"))) for index in reflected}
+        existing_columns.update(
+            (tuple(constraint["column_names"]), True) for constraint in inspector.get_unique_constraints(table.name))
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if (tuple(column.name for column in index.columns), bool(index.unique)) in existing_columns:
+                continue
+            index.create(bind=engine)
+            logging.info(f"🛠️ Created index {index.name}")
+
+
+def _delete_rows_violating_primary_key(engine: Engine, table_name: str, columns: list[str]) -> int:
+    """Deletes rows with a NULL key column and all but one row of every duplicate key."""
+    column_list = ", ".join(columns)
+    key_matches = " AND ".join(f"{column} = :{column}" for column in columns)
+    with engine.begin() as connection:
+        removed = connection.execute(text(
+            f"DELETE FROM {table_name} WHERE " + " OR ".join(f"{column} IS NULL" for column in columns)
+        )).rowcount
+        duplicates = connection.execute(text(
+            f"SELECT {column_list}, COUNT(*) FROM {table_name} GROUP BY {column_list} HAVING COUNT(*) > 1"
+        )).all()
+        for *key, count in duplicates:
+            removed += connection.execute(
+                text(f"DELETE FROM {table_name} WHERE {key_matches} LIMIT {count - 1}"), dict(zip(columns, key))
+            ).rowcount
+    return removed
+
+
+def add_missing_primary_keys(engine: Engine):
+    """
+    Gives tables created without a primary key the one declared in the model.
+
+    On MySQL duplicate and incomplete rows are deleted and the key is added
+    with one ALTER TABLE. SQLite can't add a primary key to an existing table,
+    so there the table is rebuilt in one transaction: the old one is renamed,
+    the new one created and the distinct rows copied over.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in CA_Base.metadata.sorted_tables:
+        columns = [column.name for column in table.primary_key.columns]
+        if table.name not in existing_tables or not columns:
+            continue
+        if inspector.get_pk_constraint(table.name).get("constrained_columns"):
+            continue
+        if engine.dialect.name == "mysql":
+            removed = _delete_rows_violating_primary_key(engine, table.name, columns)
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD PRIMARY KEY ({', '.join(columns)})"))
+        else:
+            old_name = f"{table.name}_without_pk"
+            column_list = ", ".join(column.name for column in table.columns)
+            not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+            with engine.begin() as connection:
+                total = connection.execute(text(f"SELECT COUNT(*) FROM {table.name}")).scalar()
+                connection.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+                table.create(bind=connection)
+                removed = total - connection.execute(text(
+                    f"INSERT INTO {table.name} ({column_list}) "
+                    f"SELECT DISTINCT {column_list} FROM {old_name} WHERE {not_null}"
+                )).rowcount
+                connection.execute(text(f"DROP TABLE {old_name}"))
+        logging.info(f"🛠️ Added primary key ({', '.join(columns)}) to {table.name}")
+        if removed:
+            logging.warning(f"⚠️ Dropped {removed} duplicate or incomplete rows of {table.name}")
+
+
+def drop_obsolete_unique_constraints(engine: Engine):
+    """Drops unique indexes listed in OBSOLETE_UNIQUE_COLUMNS."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table_name, column_sets in OBSOLETE_UNIQUE_COLUMNS.items():
+        if table_name not in existing_tables:
+            continue
+        for index in inspector.get_indexes(table_name):
+            if not index.get("unique") or index["column_names"] not in column_sets:
+                continue
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table_name} DROP INDEX {index['name']}"))
+                logging.info(f"🛠️ Dropped unique index {table_name}.{index['name']}")
+            except Exception as e:
+                logging.warning(f"Could not drop unique index {table_name}.{index['name']}: {e}")
+
+
+@contextmanager
+def schema_upgrade_lock(engine: Engine):
+    """
+    Lets one worker at a time upgrade a MySQL database.
+
+    Workers that start together wait for the first one, and then find the
+    schema already upgraded. SQLite needs no lock: it's used by one process.
+
+    :raises RuntimeError: if the lock isn't acquired within SCHEMA_UPGRADE_LOCK_TIMEOUT_SECONDS.
+    """
+    if engine.dialect.name != "mysql":
+        yield
+        return
+    with engine.connect() as connection:
+        acquired = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"), {
+            "name": SCHEMA_UPGRADE_LOCK, "timeout": SCHEMA_UPGRADE_LOCK_TIMEOUT_SECONDS}).scalar()
+        if acquired != 1:
+            raise RuntimeError("Timed out waiting for another worker to upgrade the schema")
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SCHEMA_UPGRADE_LOCK})
+
+
+def upgrade_schema(engine: Engine):
+    """Brings an existing database in line with the models without losing data."""
+    try:
+        with schema_upgrade_lock(engine):
+            recreate_disposable_tables(engine)
+            add_missing_columns(engine)
+            fill_missing_sync_columns(engine)
+            drop_obsolete_unique_constraints(engine)
+            add_missing_primary_keys(engine)
+            create_missing_indexes(engine)
+    except Exception as e:
+        logging.error(f"❌ Schema upgrade failed: {e}")
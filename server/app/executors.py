@@ -0,0 +1,166 @@
+"""
+Named, size-bounded thread pools for blocking work.
+
+Async route handlers must not block the event loop, so CPU-bound work (image
+decoding, background removal, scoring) and blocking I/O (ORM queries, storage,
+outbound HTTP) is sent to one of the pools below with `run_in_pool`. Each pool
+has a fixed number of workers and a limited number of queued tasks; when a pool
+is saturated new tasks are rejected with `ExecutorSaturatedError`, which the
+app turns into `503 Service Unavailable` instead of letting requests pile up.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from app.constants import EXECUTOR_POOL_SIZES, EXECUTOR_MAX_QUEUED
+
+T = TypeVar("T")
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """Raised when a pool already has the maximum number of running and queued tasks."""
+
+    def __init__(self, pool_name: str):
+        super().__init__(f"Executor pool '{pool_name}' is saturated")
+        self.pool_name = pool_name
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a bounded queue and usage metrics.
+
+    At most `max_workers` tasks run at a time and at most `max_queued` more
+    wait for a worker.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queued: int = EXECUTOR_MAX_QUEUED):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"pool-{name}")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.active = 0
+        self.queued = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _run(self, submitted_at: float, fn: Callable[..., T], args, kwargs) -> T:
+        started_at = time.perf_counter()
+        wait = started_at - submitted_at
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.total_run_seconds += time.perf_counter() - started_at
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+            self.slots.release()
+
+    def submit(self, fn: Callable[..., T], *args, block: bool = False, **kwargs) -> Future:
+        """
+        Schedules `fn(*args, **kwargs)` on the pool.
+
+        :param block: Wait for a free slot instead of failing when the pool is saturated.
+        :raises ExecutorSaturatedError: If the pool is saturated and `block` is False.
+        """
+        if not self.slots.acquire(blocking=block):
+            with self.lock:
+                self.rejected += 1
+            logging.warning(f"⚠️ Executor pool '{self.name}' is saturated, task rejected")
+            raise ExecutorSaturatedError(self.name)
+        with self.lock:
+            self.submitted += 1
+            self.queued += 1
+        try:
+            return self.executor.submit(self._run, time.perf_counter(), fn, args, kwargs)
+        except BaseException:
+            with self.lock:
+                self.queued -= 1
+            self.slots.release()
+            raise
+
+    def map(self, fn: Callable[..., T], iterable: Iterable, max_in_flight: Optional[int] = None) -> Iterator[T]:
+        """
+        Like `Executor.map`, but waits for free slots instead of rejecting tasks.
+
+        :param max_in_flight: Limit on tasks of this call that are scheduled at once,
+            so a large job doesn't take every slot of a shared pool.
+        """
+        max_in_flight = max_in_flight or self.max_workers
+        pending = deque()
+        for args in iterable:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(self.submit(fn, args, block=True))
+        while pending:
+            yield pending.popleft().result()
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Runs `fn` on the pool and awaits its result without blocking the event loop."""
+        context = contextvars.copy_context()
+        future = self.submit(context.run, functools.partial(fn, *args, **kwargs))
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "active": self.active,
+                "queued": self.queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_seconds / finished * 1000, 3) if finished else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_run_ms": round(self.total_run_seconds / finished * 1000, 3) if finished else 0.0,
+            }
+
+
+# "image": Pillow/ColorThief decoding and variants, "ml": rembg (ONNX) background removal,
+# "cpu": pure-Python scoring and response encoding, "db": ORM queries and storage I/O, "http": outbound HTTP calls,
+# "upload": chunks of resumable uploads written to their part files,
+# "password": bcrypt hashing (bcrypt releases the GIL, so threads use every core)
+EXECUTORS = {name: BoundedExecutor(name, size) for name, size in EXECUTOR_POOL_SIZES.items()}
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    try:
+        return EXECUTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown executor pool: {name}")
+
+
+async def run_in_pool(name: str, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Runs a blocking function on the named pool from async code."""
+    return await get_executor(name).run(fn, *args, **kwargs)
+
+
+def get_executor_metrics() -> dict:
+    return {name: executor.metrics() for name, executor in EXECUTORS.items()}
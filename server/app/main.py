@@ -1,7 +1,9 @@
+import asyncio
 from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from app.routes import router
 from app.user_manager.routes import user_manager_router  # Import routes
@@ -9,8 +11,19 @@ from app.close_manager.routes import clothing_router
 from app.recommendation_manager.routes import recommendation_router
 from app.stats_manager.routes import stats_router
 from app.seeding_manager import seed
+from app.storage_manager.garbage_collector import run_garbage_collection_periodically
+from app.maintenance import run_maintenance_periodically
+from app.executors import ExecutorSaturatedError
+from app.rate_limiter import RateLimitMiddleware
+from app.change_feed import get_change_feed_backend
+from app.user_manager.email_outbox import email_sender
+from app.constants import (
+    EMAIL_OUTBOX_ENABLED, MAINTENANCE_INTERVAL_SECONDS, RATE_LIMIT_ENABLED, STORAGE_BACKEND,
+    STORAGE_GC_INTERVAL_SECONDS, UPLOAD_DIR,
+)
 # from app.photo_manager.routes import photo_router  # Import routes
 from .database.database import engine
+from .database.async_database import dispose_async_engine
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 load_dotenv()
@@ -28,12 +41,42 @@ try:
         except Exception as e:
             print(f"❌ Database connection error during startup: {e}")
 
+        # Scheduled cleanup of uploads that no item references anymore
+        gc_task = None
+        if STORAGE_GC_INTERVAL_SECONDS > 0:
+            gc_task = asyncio.create_task(run_garbage_collection_periodically())
+        # Scheduled removal of expired sessions, tombstones and tokens
+        maintenance_task = None
+        if MAINTENANCE_INTERVAL_SECONDS > 0:
+            maintenance_task = asyncio.create_task(run_maintenance_periodically())
+        # Delivery of queued emails
+        email_task = None
+        if EMAIL_OUTBOX_ENABLED:
+            email_task = asyncio.create_task(email_sender.run_forever())
+
+        # Relay of change events published by other worker processes
+        change_feed_task = asyncio.create_task(get_change_feed_backend().run())
+
         yield  # App is running
 
+        change_feed_task.cancel()
+        await dispose_async_engine()
+
+        if gc_task:
+            gc_task.cancel()
+        if maintenance_task:
+            maintenance_task.cancel()
+        if email_task:
+            email_task.cancel()
+
        
 
     app = FastAPI(lifespan=lifespan, debug=True)
 
+    # Throttle expensive endpoints (added before CORS, so 429 responses get CORS headers too)
+    if RATE_LIMIT_ENABLED:
+        app.add_middleware(RateLimitMiddleware)
+
     # Allow requests from React (localhost:3000)
     app.add_middleware(
         CORSMiddleware,
@@ -44,6 +87,16 @@ try:
     )
 
     logging.basicConfig(level=logging.DEBUG)
+
+    # A saturated executor pool means the server is overloaded: ask the client to retry
+    @app.exception_handler(ExecutorSaturatedError)
+    async def executor_saturated_handler(request: Request, exc: ExecutorSaturatedError):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please try again later."},
+            headers={"Retry-After": "1"}
+        )
+
     app.include_router(router)
 
     # Add routes from the user_manager module
@@ -51,8 +104,10 @@ try:
     app.include_router(clothing_router)
     app.include_router(recommendation_router)
     app.include_router(stats_router)
-    app.mount(
-        "/uploads", StaticFiles(directory=os.path.abspath("uploads")), name="uploads")
+    # Files in S3-compatible storage are fetched by clients through presigned URLs
+    if STORAGE_BACKEND == "local":
+        app.mount(
+            f"/{UPLOAD_DIR}", StaticFiles(directory=os.path.abspath(UPLOAD_DIR)), name="uploads")
 
     @app.get("/", tags=["Ping"])
     def read_root():
@@ -0,0 +1,60 @@
+"""
+Periodic removal of rows that are no longer needed: expired upload sessions,
+sync tombstones older than the retention, refresh tokens that can't be used
+anymore and expired entries of the TTL store.
+
+Every step runs with its own database session, and a failing step is logged
+without keeping the others from running.
+
+Usage:
+    python -m app.maintenance
+"""
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from app.constants import MAINTENANCE_INTERVAL_SECONDS
+from app.executors import run_in_pool
+from app.ttl_store import get_ttl_store
+from app.user_manager.sync_controller import remove_old_tombstones
+from app.user_manager.token_controller import remove_stale_refresh_tokens
+from app.user_manager.upload_session_controller import remove_expired_upload_sessions
+
+# Name of a step -> function deleting its rows and returning how many it deleted
+MAINTENANCE_STEPS: dict[str, Callable[[Session], int]] = {
+    "upload sessions": remove_expired_upload_sessions,
+    "sync tombstones": remove_old_tombstones,
+    "refresh tokens": remove_stale_refresh_tokens,
+    "TTL store entries": lambda db: get_ttl_store().remove_expired(),
+}
+
+
+def run_maintenance() -> dict[str, int]:
+    """Runs every step of MAINTENANCE_STEPS and returns the number of removed rows per step that succeeded."""
+    from app.database.database import SessionLocal
+    removed = {}
+    for name, step in MAINTENANCE_STEPS.items():
+        try:
+            with SessionLocal() as db:
+                removed[name] = step(db)
+        except Exception as e:
+            logging.error(f"❌ Maintenance step '{name}' failed: {e}")
+    return removed
+
+
+async def run_maintenance_periodically(interval_seconds: int = MAINTENANCE_INTERVAL_SECONDS):
+    """Background task that runs the maintenance every `interval_seconds`."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_pool("db", run_maintenance)
+        except Exception as e:
+            logging.error(f"❌ Maintenance failed: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for name, count in run_maintenance().items():
+        print(f"✅ Removed {count} {name}")
@@ -1,3 +1,10 @@
 from .user import User
 from .clothing_combination import ClothingCombination
-from .сlothing_item import ClothingItem, CategoryEnum, SeasonEnum
\ No newline at end of file
+from .сlothing_item import ClothingItem, CategoryEnum, SeasonEnum
+from .refresh_token import RefreshToken
+from .ttl_entry import TTLEntry
+from .email_outbox import OutboxEmail
+from .rate_limit_bucket import RateLimitBucket
+from .sync_tombstone import SyncTombstone
+from .upload_session import UploadSession, UploadSessionFile
+from .change_event import ChangeEvent
\ No newline at end of file
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Float, Integer, String, Text
+from app.database.base import CA_Base
+
+
+class ChangeEvent(CA_Base):
+    """Event of the database backend of the change feed (app/change_feed.py)."""
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    origin = Column(String(36), nullable=False)  # Worker process that published the event
+    payload = Column(Text, nullable=False)
+    created_at = Column(Float, index=True, nullable=False)  # Unix time
@@ -1,17 +1,28 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table
+from uuid import uuid4
+from sqlalchemy import Column, Index, Integer, String, ForeignKey, Table
+from sqlalchemy.dialects.mysql import DATETIME
 from sqlalchemy.orm import relationship
 from app.database.base import CA_Base
+from .sync_tombstone import sync_timestamp
 clothing_combination_items = Table(
     "clothing_combination_items",
     CA_Base.metadata,
-    Column("combination_id", Integer, ForeignKey("clothing_combinations.id")),
-    Column("item_id", Integer, ForeignKey("clothing_items.id"))
+    Column("combination_id", Integer, ForeignKey("clothing_combinations.id"), primary_key=True),
+    Column("item_id", Integer, ForeignKey("clothing_items.id"), primary_key=True),
+    # The primary key serves lookups by combination, this one lookups by item
+    Index("ix_clothing_combination_items_item_id_combination_id", "item_id", "combination_id"),
 )
 
 class ClothingCombination(CA_Base):
     __tablename__ = "clothing_combinations"
+    __table_args__ = (
+        Index("ix_clothing_combinations_owner_id_uuid", "owner_id", "uuid", unique=True),
+        Index("ix_clothing_combinations_owner_id_updated_at", "owner_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    uuid = Column(String(36), default=lambda: str(uuid4()))  # стабільний ідентифікатор для синхронізації
+    updated_at = Column(DATETIME(fsp=6), default=sync_timestamp, onupdate=sync_timestamp, index=True)
     name = Column(String(100), nullable=False)  # Наприклад: "Зимова прогулянка", "Офіс"
 
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text
+from app.database.base import CA_Base
+
+
+class OutboxEmail(CA_Base):
+    """Email waiting to be sent by the background sender (app/user_manager/email_outbox.py)."""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    subtype = Column(String(10), nullable=False, default="html")
+    status = Column(String(10), nullable=False, default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # The sender looks for due messages on every poll
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Double, Integer, String
+from app.database.base import CA_Base
+
+
+class RateLimitBucket(CA_Base):
+    """Token bucket of the database backend of the rate limiter (app/rate_limiter.py)."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String(255), primary_key=True)
+    # Double precision: a single-precision Unix time is only accurate to about two minutes
+    tokens = Column(Double, nullable=False)
+    updated_at = Column(Double, nullable=False)  # Unix time of the last refill
+    full_at = Column(Double, index=True, nullable=False)  # Unix time when the bucket is full again
+    version = Column(Integer, nullable=False, default=0)  # Incremented by every take
@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, event
+from sqlalchemy.dialects.mysql import DATETIME
+from sqlalchemy.orm import Session
+from app.database.base import CA_Base
+
+
+def sync_timestamp() -> datetime:
+    # Stored without time zone, like users.synchronized_at
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SyncTombstone(CA_Base):
+    """Record of a deleted item or combination, so delta sync can tell clients to delete it too."""
+    __tablename__ = "sync_tombstones"
+    __table_args__ = (
+        Index("ix_sync_tombstones_owner_id_deleted_at", "owner_id", "deleted_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    entity = Column(String(20), nullable=False)  # "item" або "combination"
+    uuid = Column(String(36), nullable=False)
+    deleted_at = Column(DATETIME(fsp=6), default=sync_timestamp, nullable=False)
+
+
+SYNC_ENTITIES = {"clothing_items": "item", "clothing_combinations": "combination"}
+
+
+@event.listens_for(Session, "before_flush")
+def track_sync_changes(session: Session, flush_context, instances):
+    """
+    Keeps the delta sync metadata of items and combinations up to date for every write.
+
+    Changed rows get a new `updated_at`, even if only their combination links
+    changed (no UPDATE of the row is emitted then), and deleted rows leave a tombstone.
+    """
+    now = sync_timestamp()
+    for obj in session.dirty:
+        entity = SYNC_ENTITIES.get(getattr(obj, "__tablename__", None))
+        if entity and session.is_modified(obj):
+            obj.updated_at = now
+    for obj in session.deleted:
+        entity = SYNC_ENTITIES.get(getattr(obj, "__tablename__", None))
+        if entity and obj.uuid:
+            session.add(SyncTombstone(owner_id=obj.owner_id, entity=entity, uuid=obj.uuid, deleted_at=now))
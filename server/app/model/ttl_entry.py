@@ -0,0 +1,11 @@
+from sqlalchemy import Column, DateTime, String, Text
+from app.database.base import CA_Base
+
+
+class TTLEntry(CA_Base):
+    """Entry of the database backend of the TTL key-value store (app/ttl_store.py)."""
+    __tablename__ = "ttl_entries"
+
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
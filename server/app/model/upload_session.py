@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from app.database.base import CA_Base
+
+
+class UploadSession(CA_Base):
+    """Resumable upload of the photos of one sync (app/user_manager/upload_session_controller.py)."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(36), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = Column(DateTime, index=True, nullable=False)
+
+
+class UploadSessionFile(CA_Base):
+    """One file of an upload session; its bytes are appended to a part file on disk."""
+    __tablename__ = "upload_session_files"
+
+    session_id = Column(String(36), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    file_index = Column(Integer, primary_key=True)
+    filename = Column(String(255), nullable=True)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    # Bytes of the part file that were acknowledged, the offset of the next chunk
+    received = Column(Integer, nullable=False, default=0)
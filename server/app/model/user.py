@@ -7,11 +7,13 @@ class User(CA_Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String(255), unique=True, nullable=False)
+    email = Column(String(255), unique=True, index=True, nullable=False)  # унікальний індекс ix_users_email
     password = Column(String(255), unique=False, nullable=False)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))  # Date and time of creation
     synchronized_at  = Column(DATETIME(fsp=6), default=datetime.now(timezone.utc))  # Date and time of creation first
     is_email_verified = Column(Boolean, default=False)  
+    # Час відкликання всіх токенів (зміна пароля чи email); старіші токени закривають стрічку змін
+    tokens_revoked_at = Column(DATETIME(fsp=6), nullable=True)
     
 
     combinations = relationship("ClothingCombination", back_populates="owner")
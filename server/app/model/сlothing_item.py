@@ -1,8 +1,11 @@
 import logging
+from uuid import uuid4
 from fastapi import HTTPException
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+from sqlalchemy import Boolean, Column, Index, Integer, String, ForeignKey
+from sqlalchemy.dialects.mysql import DATETIME
 from sqlalchemy.orm import relationship
 from app.database.base import CA_Base
+from .sync_tombstone import sync_timestamp
 
 from sqlalchemy import Column, Integer, String, ForeignKey, Date, Float
 from sqlalchemy.orm import relationship
@@ -50,9 +53,21 @@ class CategoryEnum(str, Enum):
 
 class ClothingItem(CA_Base):
     __tablename__ = "clothing_items"
+    __table_args__ = (
+        Index("ix_clothing_items_owner_id_uuid", "owner_id", "uuid", unique=True),
+        # Almost every query filters by owner: category filters and stats, delta sync. InnoDB appends the
+        # primary key to secondary indexes, so they serve listings and lookups by owner and id as well
+        Index("ix_clothing_items_owner_id_category", "owner_id", "category"),
+        Index("ix_clothing_items_owner_id_updated_at", "owner_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String(255), unique=True, nullable=False)  # шлях до фото
+    uuid = Column(String(36), default=lambda: str(uuid4()))  # стабільний ідентифікатор для синхронізації
+    updated_at = Column(DATETIME(fsp=6), default=sync_timestamp, onupdate=sync_timestamp, index=True)
+    filename = Column(String(255), index=True, nullable=False)  # шлях до фото (спільний для однакових файлів)
+    content_hash = Column(String(64), index=True, nullable=True)  # SHA-256 вмісту файлу
+    perceptual_hash = Column(String(16), nullable=True)  # dHash фото для пошуку схожих речей
+    image_variants = Column(String(255), nullable=True)  # згенеровані варіанти фото, напр. "thumb.webp,medium.webp"
     name = Column(String(100), nullable=False)  # назва одягу
     category = Column(SqlEnum(CategoryEnum), nullable=False)  # категорія (головний убір тощо)
     season = Column(SqlEnum(SeasonEnum), nullable=False)  # сезонність
@@ -90,6 +105,7 @@ class ClothingItem(CA_Base):
     def to_dict(self):
         return {
             "id": self.id,
+            "uuid": self.uuid,
             "name": self.name,
             "category": self.category.value,  # Якщо це enum, потрібно додавати `.value`
             "season": self.season.value,
@@ -101,7 +117,8 @@ class ClothingItem(CA_Base):
             "red": self.red,
             "green": self.green,
             "blue": self.blue,
-            "purchase_date": self.purchase_date.strftime('%Y-%m-%d') if self.purchase_date else None
+            "purchase_date": self.purchase_date.strftime('%Y-%m-%d') if self.purchase_date else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
     
     def evaluate_color_match(self, other_color: tuple[int, int, int], palette_type: str):
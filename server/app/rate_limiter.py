@@ -0,0 +1,233 @@
+"""
+Token bucket rate limiting of expensive endpoints (bcrypt, SMTP, ONNX, weather API).
+
+Every rule in RATE_LIMITS gives a client a bucket of `capacity` tokens per
+client IP and/or per user, refilled evenly over the given number of seconds.
+Each request takes one token; a request that finds the bucket empty gets
+`429 Too Many Requests` with a `Retry-After` header before any handler runs.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import math
+import re
+import threading
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from starlette.routing import compile_path
+
+from app.constants import (
+    RATE_LIMITS, RATE_LIMIT_BACKEND, RATE_LIMIT_MAX_BUCKETS, RATE_LIMIT_TRUST_FORWARDED_FOR,
+)
+from app.executors import run_in_pool
+
+
+class RateLimitBackend(ABC):
+    # Backends that do blocking I/O are called from the "db" executor pool
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, capacity: int, refill_per_second: float, now: Optional[float] = None) -> float:
+        """
+        Takes one token from the bucket `key`.
+
+        :return: 0 if the request is allowed, otherwise seconds until a token is available.
+        """
+
+
+def _refill(tokens: float, updated_at: float, capacity: int, refill_per_second: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * refill_per_second)
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Buckets of the current process; the least recently used ones are dropped above `max_buckets`."""
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, refill_per_second: float, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            tokens = capacity if bucket is None else _refill(*bucket, capacity, refill_per_second, now)
+            if tokens < 1:
+                # Denied requests don't change the bucket
+                return (1 - tokens) / refill_per_second
+            self.buckets[key] = (tokens - 1, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                # A dropped bucket is treated as full, which only errs in favour of the client
+                self.buckets.popitem(last=False)
+            return 0.0
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    """Buckets in the `rate_limit_buckets` table, shared by every worker process."""
+    blocking = True
+    max_retries = 5
+
+    def __init__(self, session_factory=None):
+        if session_factory is None:
+            from app.database.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+
+    def take(self, key: str, capacity: int, refill_per_second: float, now: Optional[float] = None) -> float:
+        from app.model import RateLimitBucket
+        now = time.time() if now is None else now
+        with self.session_factory() as db:
+            for _ in range(self.max_retries):
+                # FOR UPDATE serializes takes on MySQL; the version check covers databases without row locks
+                bucket = db.query(RateLimitBucket.tokens, RateLimitBucket.updated_at, RateLimitBucket.version).filter(
+                    RateLimitBucket.key == key).with_for_update().first()
+                if bucket is None:
+                    # Buckets that are full again carry no information; each one has its own refill time
+                    db.query(RateLimitBucket).filter(
+                        RateLimitBucket.full_at < now
+                    ).delete(synchronize_session=False)
+                    db.add(RateLimitBucket(key=key, tokens=capacity - 1, updated_at=now,
+                                           full_at=now + 1 / refill_per_second, version=0))
+                    try:
+                        db.commit()
+                        return 0.0
+                    except IntegrityError:
+                        # Another worker created the bucket first
+                        db.rollback()
+                        continue
+
+                tokens = _refill(bucket.tokens, bucket.updated_at, capacity, refill_per_second, now)
+                if tokens < 1:
+                    db.rollback()
+                    return (1 - tokens) / refill_per_second
+                updated = db.query(RateLimitBucket).filter(
+                    RateLimitBucket.key == key,
+                    RateLimitBucket.version == bucket.version
+                ).update({
+                    RateLimitBucket.tokens: tokens - 1,
+                    RateLimitBucket.updated_at: now,
+                    RateLimitBucket.full_at: now + (capacity - tokens + 1) / refill_per_second,
+                    RateLimitBucket.version: bucket.version + 1,
+                }, synchronize_session=False)
+                db.commit()
+                if updated:
+                    return 0.0
+        logging.warning(f"⚠️ Rate limit bucket {key} is heavily contended, request allowed")
+        return 0.0
+
+
+RATE_LIMIT_BACKENDS = {
+    "memory": MemoryRateLimitBackend,
+    "database": DatabaseRateLimitBackend,
+}
+
+
+def create_rate_limit_backend(name: str) -> RateLimitBackend:
+    backend_class = RATE_LIMIT_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"❌ Unsupported rate limit backend: '{name}'")
+    logging.info(f"Using '{name}' rate limit backend")
+    return backend_class()
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    name: str
+    method: str
+    path_regex: re.Pattern
+    limits: dict[str, tuple[int, int]]  # "ip" or "user" -> (capacity, seconds to refill it)
+
+
+def compile_rules(rules: dict[str, dict[str, tuple[int, int]]]) -> list[RateLimitRule]:
+    compiled = []
+    for name, limits in rules.items():
+        method, path = name.split(" ", 1)
+        for scope in limits:
+            if scope not in ("ip", "user"):
+                raise ValueError(f"❌ Unsupported rate limit scope '{scope}' in rule '{name}'")
+        path_regex, _, _ = compile_path(path)
+        compiled.append(RateLimitRule(name, method.upper(), path_regex, limits))
+    return compiled
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that applies the token bucket rules to matching requests."""
+
+    def __init__(
+        self,
+        app,
+        rules: Optional[dict[str, dict[str, tuple[int, int]]]] = None,
+        backend: Optional[RateLimitBackend] = None,
+        trust_forwarded_for: bool = RATE_LIMIT_TRUST_FORWARDED_FOR,
+    ):
+        self.app = app
+        self.rules = compile_rules(RATE_LIMITS if rules is None else rules)
+        self.backend = backend or create_rate_limit_backend(RATE_LIMIT_BACKEND)
+        self.trust_forwarded_for = trust_forwarded_for
+
+    def _match(self, scope) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.method == scope["method"] and rule.path_regex.match(scope["path"]):
+                return rule
+        return None
+
+    def _client_ip(self, headers: dict[bytes, bytes], scope) -> str:
+        if self.trust_forwarded_for and b"x-forwarded-for" in headers:
+            return headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    def _user(headers: dict[bytes, bytes]) -> Optional[str]:
+        from app.user_manager.user_controller import decode_token_email
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return decode_token_email(token)
+        except HTTPException:
+            # The handler rejects the request anyway, the IP limit still applies
+            return None
+
+    async def _take(self, key: str, capacity: int, period_seconds: int) -> float:
+        refill_per_second = capacity / period_seconds
+        if self.backend.blocking:
+            return await run_in_pool("db", self.backend.take, key, capacity, refill_per_second)
+        return self.backend.take(key, capacity, refill_per_second)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rule = self._match(scope)
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        identities = {"ip": self._client_ip(headers, scope)}
+        if "user" in rule.limits:
+            identities["user"] = self._user(headers)
+
+        retry_after = 0.0
+        for limit_scope, (capacity, period_seconds) in rule.limits.items():
+            identity = identities[limit_scope]
+            if identity is None:
+                continue
+            retry_after = max(retry_after, await self._take(
+                f"{rule.name}|{limit_scope}|{identity}", capacity, period_seconds))
+
+        if retry_after > 0:
+            logging.warning(f"⚠️ Rate limit of '{rule.name}' exceeded by {identities}")
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests, please try again later."},
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
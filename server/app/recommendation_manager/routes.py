@@ -1,4 +1,3 @@
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 import logging
@@ -11,7 +10,7 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import requests
 from sqlalchemy.orm import Session
-from app.user_manager import get_current_user, oauth2_scheme
+from app.user_manager import CachedUser, get_authenticated_user
 from app.database.database import get_db
 from app.model.сlothing_item import ClothingItem
 from app.recommendation_manager.recommendation_strategies import (
@@ -24,7 +23,9 @@ from app.recommendation_manager.recommendation_strategies import (
     ColorWeatherStrategy,
     AverageRecommendationStrategy,
 )
-from app.constants import SERVER_URL, UPLOAD_DIR, OPEN_WEATHER_API_KEY
+from app.storage_manager import build_file_url
+from app.constants import OPEN_WEATHER_API_KEY
+from app.executors import run_in_pool
 UNFAVORITE_NERF_COEF = 0.8
 recommendation_router = APIRouter(tags=["Recommendations"])
 
@@ -87,7 +88,7 @@ class RecommendationRequest(BaseModel):
 @recommendation_router.post("/recommendations")
 async def get_recommendations(
     data: RecommendationRequest,  # = Body(...)
-    token: str = Depends(oauth2_scheme),
+    user: CachedUser = Depends(get_authenticated_user),
     db: Session = Depends(get_db),
 ):
     lat, lon, target_time = data.lat, data.lon, data.target_time
@@ -99,10 +100,6 @@ async def get_recommendations(
     start_total = time.perf_counter()
     logging.info("Starting recommendation process...")
 
-    user = get_current_user(token, db)
-    if user is None or isinstance(user, JSONResponse):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
     def parse_color_component(value: Optional[str]) -> Optional[int]:
         try:
             return int(value) if value else None
@@ -113,11 +110,11 @@ async def get_recommendations(
         green), parse_color_component(blue)
     other_color = (r, g, b) if None not in (r, g, b) else None
     location = True if lat and lon else False
-    temp, weather, icon, code = get_weather_at_time_by_coords(
+    temp, weather, icon, code = await run_in_pool("http", get_weather_at_time_by_coords,
         lat, lon, target_time) if location and target_time else (None, None, None, None)
 
-    items = db.query(ClothingItem).filter(
-        ClothingItem.owner_id == user.id).all()
+    items = await run_in_pool("db", db.query(ClothingItem).filter(
+        ClothingItem.owner_id == user.id).all)
     if not items:
         return {"detail": "No clothing items found for user.", "data": {}}
 
@@ -178,16 +175,13 @@ async def get_recommendations(
             return item.id, {
                 "name": item.name,
                 "category": item.category.value,
-                "image": f"{SERVER_URL}/{UPLOAD_DIR}/{item.filename}",
+                "image": build_file_url(item.filename),
                 "is_favorite": f"{item.is_favorite}",
                 **item_results
             }
 
-        # Parallel evaluation of items
-        with ThreadPoolExecutor() as executor:
-            futures = executor.map(evaluate_item, items)
-
-        results = {item_id: result for item_id, result in futures}
+        # Scoring is CPU-bound, so it runs off the event loop
+        results = dict(await run_in_pool("cpu", lambda: [evaluate_item(item) for item in items]))
         formatted_json = json.dumps(results, indent=4, ensure_ascii=False)
         logging.info(f"📦 Evaluated items:\n{formatted_json}")
         # grouping categories
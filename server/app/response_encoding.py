@@ -0,0 +1,114 @@
+"""
+Content negotiation of the wardrobe sync and listing responses.
+
+- `Accept: application/msgpack` returns MessagePack instead of JSON.
+- `Accept-Encoding: br` or `gzip` compresses bodies of at least
+  RESPONSE_COMPRESSION_MIN_BYTES (brotli is preferred).
+- `?layout=columnar` returns lists of rows column by column, so the keys are
+  sent once per response instead of once per row.
+
+msgpack and brotli are optional; without them the server answers with JSON or
+gzip, which every client accepts.
+"""
+import gzip
+import json
+from typing import Optional
+
+from fastapi import Request, Response
+
+from app.constants import RESPONSE_BROTLI_QUALITY, RESPONSE_COMPRESSION_MIN_BYTES, RESPONSE_GZIP_LEVEL
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+# Representations differ by these headers, which caches must take into account
+VARY = "Accept, Accept-Encoding"
+
+
+def parse_quality_values(header: Optional[str]) -> dict[str, float]:
+    """Parses `Accept`-style headers, e.g. "br;q=1.0, gzip;q=0.5" -> {"br": 1.0, "gzip": 0.5}."""
+    values = {}
+    for part in (header or "").split(","):
+        name, *params = [piece.strip() for piece in part.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        values[name.lower()] = quality
+    return values
+
+
+def negotiate_media_type(request: Request) -> str:
+    """Returns MSGPACK_MEDIA_TYPE if the client prefers it to JSON and msgpack is installed."""
+    accepted = parse_quality_values(request.headers.get("accept"))
+    msgpack_quality = max(accepted.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    if msgpack is None or msgpack_quality <= 0:
+        return JSON_MEDIA_TYPE
+    json_quality = max(accepted.get(JSON_MEDIA_TYPE, 0.0), accepted.get("application/*", 0.0), accepted.get("*/*", 0.0))
+    return MSGPACK_MEDIA_TYPE if msgpack_quality >= json_quality else JSON_MEDIA_TYPE
+
+
+def negotiate_content_encoding(request: Request) -> Optional[str]:
+    """Returns "br", "gzip" or None (identity) according to `Accept-Encoding`."""
+    accepted = parse_quality_values(request.headers.get("accept-encoding"))
+    if brotli is not None and accepted.get("br", 0.0) > 0:
+        return "br"
+    if accepted.get("gzip", 0.0) > 0:
+        return "gzip"
+    return None
+
+
+def is_columnar_layout(request: Request) -> bool:
+    return request.query_params.get("layout") == "columnar"
+
+
+def get_representation(request: Request) -> str:
+    """Identifies the negotiated format, for ETags that differ between representations."""
+    return f"{negotiate_media_type(request)}:{'columnar' if is_columnar_layout(request) else 'rows'}"
+
+
+def to_columnar(rows: list[dict]) -> dict:
+    """Turns rows with the same keys into {"count": n, "columns": {key: [values of the rows]}}."""
+    keys = list(rows[0]) if rows else []
+    return {"count": len(rows), "columns": {key: [row.get(key) for row in rows] for key in keys}}
+
+
+def encode_response(request: Request, content, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """
+    Serializes `content` in the negotiated format and compresses it.
+
+    `content` must only contain JSON types (str enums are fine). Serializing
+    and compressing large wardrobes takes a while, so async handlers call it
+    in the "cpu" pool.
+    """
+    media_type = negotiate_media_type(request)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = msgpack.packb(content, use_bin_type=True)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    headers = {**(headers or {}), "Vary": VARY}
+    encoding = negotiate_content_encoding(request) if len(body) >= RESPONSE_COMPRESSION_MIN_BYTES else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
@@ -1,5 +1,38 @@
-from fastapi import APIRouter
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.constants import METRICS_TOKEN
+from app.executors import get_executor_metrics
 
 router = APIRouter()
+metrics_scheme = HTTPBearer(auto_error=False)
+
+
+def require_metrics_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(metrics_scheme)):
+    """
+    Lets only monitoring with METRICS_TOKEN read the metrics.
+
+    :raises HTTPException: 404 if METRICS_TOKEN is not set, 401 for a missing or wrong token.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials, METRICS_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+
+
+@router.get("/metrics/executors", tags=["Metrics"], summary="Usage of the executor pools",
+            dependencies=[Depends(require_metrics_token)])
+def executor_metrics():
+    """
+    **Returns the usage of the named executor pools.**
 
+    Requires `Authorization: Bearer <METRICS_TOKEN>`; without METRICS_TOKEN
+    configured the endpoint doesn't exist (404).
 
+    - For every pool: worker and queue limits, running and queued tasks,
+      submitted/completed/failed/rejected counters and average wait and run times.
+    """
+    return {"data": get_executor_metrics()}
@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from app.user_manager.user_controller import hash_password
 from app.model import *
+from app.storage_manager import get_storage
 from concurrent.futures import ThreadPoolExecutor
 
 def seed_users(db: Session):
@@ -296,11 +297,10 @@ def seed_clothing_items(db: Session):
         "https://aspolo.ua/image/cache/catalog/obuv19/muzhskie-vysokie-krossovki-adidas-forum-mid-refined-zheltye-810895-1-800x533.jpg"
     ]
 
-    uploads_dir = os.path.join(os.getcwd(), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    def download_image(image_url, dest_file):
-        if os.path.exists(dest_file):
-            print(f"📁 Image {os.path.basename(dest_file)} already exists. Skipping download.")
+    storage = get_storage()
+    def download_image(image_url, filename):
+        if storage.exists(filename):
+            print(f"📁 Image {filename} already exists. Skipping download.")
             return
 
         try:
@@ -308,11 +308,11 @@ def seed_clothing_items(db: Session):
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                             "(KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
             }
-            response = requests.get(image_url, headers=headers)
-            response.raise_for_status()
-            with open(dest_file, "wb") as f:
-                f.write(response.content)
-            print(f"📥 Downloaded image: {os.path.basename(dest_file)}")
+            with requests.get(image_url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                storage.write_stream(filename, response.raw)
+            print(f"📥 Downloaded image: {filename}")
         except Exception as e:
             print(f"❌ Failed to download {image_url}: {e}")
     # 📌 Завантажуємо зображення в паралельному режимі
@@ -320,8 +320,7 @@ def seed_clothing_items(db: Session):
         futures = []
         for idx, item_data in enumerate(items_data):
             image_url = image_urls[idx]
-            dest_file = os.path.join(uploads_dir, item_data["filename"])
-            futures.append(executor.submit(download_image, image_url, dest_file))
+            futures.append(executor.submit(download_image, image_url, item_data["filename"]))
         for future in futures:
             future.result()  # чекаємо завершення всіх
     for idx, item_data in enumerate(items_data):
@@ -373,7 +372,7 @@ def seed_clothing_combinations(db: Session):
         # Додаємо речі по item_ids
         for item_id in combo_data["item_ids"]:
             item = db.query(ClothingItem).filter_by(id=item_id).first()
-            if item:
+            if item and item not in combination.items:
                 combination.items.append(item)
 
         db.add(combination)
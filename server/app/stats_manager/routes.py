@@ -5,12 +5,12 @@ from sqlalchemy import text
 
 from app.stats_manager.stats_controller import get_clothing_stats_by_category
 from app.database.database import get_db
-from app.user_manager import get_current_user_id, oauth2_scheme
+from app.user_manager import CachedUser, get_authenticated_user
 
 stats_router = APIRouter(tags=["Stats"])
 @stats_router.get("/stats/category")
-def get_category_stats(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    owner_id = get_current_user_id(token, db)
+def get_category_stats(current_user: CachedUser = Depends(get_authenticated_user), db: Session = Depends(get_db)):
+    owner_id = current_user.id
     try:
         result = db.execute(
             text("CALL get_category_stats_by_owner(:owner_id)"),
@@ -1,25 +1,18 @@
-from fastapi import HTTPException
-from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import date
 from app.model import ClothingItem, SeasonEnum, CategoryEnum
-from app.user_manager.user_controller import get_current_user
 
-def get_clothing_stats_by_category(db: Session, token: str):
+def get_clothing_stats_by_category(db: Session, owner_id: int):
     """
     Returns clothing statistics by categories:
     - item count
     - average age (in days) if purchase date is available
 
     :param db: SQLAlchemy session
-    :param token: User's JWT token
+    :param owner_id: ID of the user whose items are counted
     :return: List of dictionaries: [{"category": "outerwear", "count": 3, "average_age_days": 285.2}, ...]
     """
-
-    user = get_current_user(token, db)
-    if user is None or type(user) is JSONResponse:
-        raise HTTPException(status_code=401, detail="Not authenticated")
     today = date.today()
 
     # Subquery for average age using DATEDIFF for MySQL
@@ -29,7 +22,7 @@ def get_clothing_stats_by_category(db: Session, token: str):
             func.avg(func.datediff(today, ClothingItem.purchase_date)).label("average_age_days")
         )
         .filter(
-            ClothingItem.owner_id == user.id,
+            ClothingItem.owner_id == owner_id,
             ClothingItem.purchase_date.isnot(None)
         )
         .group_by(ClothingItem.category)
@@ -47,7 +40,7 @@ def get_clothing_stats_by_category(db: Session, token: str):
             avg_age_subquery,
             ClothingItem.category == avg_age_subquery.c.category
         )
-        .filter(ClothingItem.owner_id == user.id)
+        .filter(ClothingItem.owner_id == owner_id)
         .group_by(ClothingItem.category)
         .all()
     )
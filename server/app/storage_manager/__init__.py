@@ -0,0 +1,4 @@
+from .storage_backends import *
+from .upload_controller import *
+from .image_controller import *
+from .blob_store import *
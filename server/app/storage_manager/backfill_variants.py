@@ -0,0 +1,52 @@
+"""
+Records the derivatives of clothing items stored before derivatives were
+tracked, generating the ones that are missing.
+
+Items whose `image_variants` is NULL advertise no variants until this ran.
+
+Usage:
+    python -m app.storage_manager.backfill_variants
+"""
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.model import ClothingItem
+from .image_controller import describe_variants, find_stored_variants, generate_image_derivatives
+from .storage_backends import get_storage
+
+
+def backfill_image_variants(db: Session) -> int:
+    """
+    Fills `image_variants` of every item that has none recorded.
+
+    Derivatives that already exist are kept; for files without any they are
+    generated from the stored original. Missing originals are recorded with
+    no variants.
+
+    :return: Number of distinct files that were processed.
+    """
+    filenames = [
+        filename for (filename,) in
+        db.query(ClothingItem.filename).filter(ClothingItem.image_variants.is_(None)).distinct()
+    ]
+    storage = get_storage()
+    for filename in filenames:
+        variant_filenames = find_stored_variants(filename)
+        if not variant_filenames and storage.exists(filename):
+            variant_filenames = generate_image_derivatives(filename)
+        image_variants = describe_variants(filename, variant_filenames)
+        db.query(ClothingItem).filter(
+            ClothingItem.filename == filename, ClothingItem.image_variants.is_(None)
+        ).update({ClothingItem.image_variants: image_variants}, synchronize_session=False)
+        db.commit()
+        logging.info(f"Recorded variants of {filename}: {image_variants or 'none'}")
+    return len(filenames)
+
+
+if __name__ == "__main__":
+    from app.database.database import SessionLocal
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        count = backfill_image_variants(session)
+    print(f"✅ Recorded variants of {count} files.")
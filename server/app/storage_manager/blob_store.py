@@ -0,0 +1,138 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import UploadFile
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from app.constants import BLOB_LEASE_SECONDS, IMAGE_VARIANTS
+from app.model import ClothingItem
+from app.ttl_store import get_ttl_store
+from .upload_controller import StagedUpload, stage_upload, publish_staged_file, discard_staged_file
+from .image_controller import (
+    describe_variants, find_stored_variants, generate_image_derivatives, get_derivative_formats, get_variant_filename
+)
+from .storage_backends import get_storage
+
+
+@dataclass
+class StoredBlob:
+    """A file in the content-addressed store."""
+    filename: str
+    sha256: str
+    size: int
+    is_new: bool
+    # Derivatives that exist, in the form of `ClothingItem.image_variants`
+    image_variants: str = ""
+
+
+def get_blob_filename(sha256: str, extension: str) -> str:
+    """
+    Returns the content-addressed storage key of a file.
+
+    Files are sharded by the first two bytes of the hash to keep directories
+    small, e.g. `3f/a1/3fa1...e9.jpg`.
+    """
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}"
+
+
+def _lease_key(filename: str) -> str:
+    # Keyed by the name without extension, so the derived files of the blob match it too
+    return f"blob_lease:{os.path.splitext(filename)[0]}"
+
+
+def lease_blob(filename: str):
+    """Protects a blob from `release_blobs` and the garbage collector for BLOB_LEASE_SECONDS."""
+    get_ttl_store().set(_lease_key(filename), "1", BLOB_LEASE_SECONDS)
+
+
+def is_blob_leased(filename: str) -> bool:
+    """Checks whether an upload reused the blob recently; `filename` may be the blob or its base name."""
+    return get_ttl_store().get(_lease_key(filename)) is not None
+
+
+def commit_staged_blob(staged: StagedUpload, image: Optional[Image.Image] = None) -> StoredBlob:
+    """
+    Moves a staged upload into the blob store.
+
+    If a blob with the same content already exists the staged copy is dropped,
+    so storing identical bytes again only costs the metadata update.
+
+    :param image: The staged file already decoded; variants are generated from
+        it instead of decoding the file again.
+    """
+    storage = get_storage()
+    filename = get_blob_filename(staged.sha256, staged.extension)
+    reused = storage.exists(filename)
+    if reused:
+        # Reusing a blob leases it, so a request that drops its last reference meanwhile keeps the
+        # file (see `release_blobs`); the second check covers a removal that started before the lease
+        lease_blob(filename)
+        reused = storage.exists(filename)
+    if reused:
+        discard_staged_file(staged.temp_path)
+        logging.debug(f"Blob {filename} already stored, upload deduplicated")
+        return StoredBlob(filename=filename, sha256=staged.sha256, size=staged.size, is_new=False,
+                          image_variants=describe_variants(filename, find_stored_variants(filename)))
+
+    # Variants are generated from the local staged copy before it is moved away
+    generated = generate_image_derivatives(filename, image=image, source_path=staged.temp_path)
+    publish_staged_file(staged, filename, storage)
+    return StoredBlob(filename=filename, sha256=staged.sha256, size=staged.size, is_new=True,
+                      image_variants=describe_variants(filename, generated))
+
+
+def store_upload(file: UploadFile) -> StoredBlob:
+    """Streams an upload into the blob store, see `commit_staged_blob`."""
+    return commit_staged_blob(stage_upload(file))
+
+
+def count_blob_references(db: Session, filename: str) -> int:
+    """Returns how many clothing items reference the file."""
+    return db.query(ClothingItem).filter(ClothingItem.filename == filename).count()
+
+
+def remove_blob_files(filename: str):
+    """Removes a stored file together with all its generated variants."""
+    paths = [filename] + [
+        get_variant_filename(filename, variant, image_format)
+        for variant in IMAGE_VARIANTS
+        for image_format in get_derivative_formats()
+    ]
+    storage = get_storage()
+    for path in paths:
+        try:
+            storage.delete(path)
+        except Exception as e:
+            logging.warning(f"Failed to delete file {path}: {e}")
+
+
+def release_blobs(db: Session, filenames) -> list[str]:
+    """
+    Deletes the given files when no clothing item references them anymore.
+
+    Must be called after the change that dropped the references was committed.
+
+    :return: Names of the files that were removed.
+    """
+    candidates = {filename for filename in filenames if filename}
+    if not candidates:
+        return []
+
+    still_referenced = {
+        filename for (filename,) in db.query(ClothingItem.filename)
+        .filter(ClothingItem.filename.in_(candidates))
+        .distinct()
+    }
+    removed = []
+    for filename in candidates - still_referenced:
+        if is_blob_leased(filename):
+            # An upload reuses the blob and its item is not committed yet; the garbage collector removes it later
+            logging.debug(f"Kept unreferenced file {filename}, it is leased by an upload")
+            continue
+        remove_blob_files(filename)
+        removed.append(filename)
+        logging.info(f"Removed unreferenced file {filename}")
+    return removed
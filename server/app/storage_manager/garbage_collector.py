@@ -0,0 +1,148 @@
+"""
+Deletes uploaded files that no clothing item references anymore.
+
+Usage:
+    python -m app.storage_manager.garbage_collector [--grace-hours 24] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.constants import IMAGE_VARIANTS, STORAGE_GC_GRACE_SECONDS, STORAGE_GC_INTERVAL_SECONDS
+from app.model import ClothingItem
+from .blob_store import is_blob_leased
+from .storage_backends import StorageBackend, get_storage
+
+# Files derived from an original: `<base>_<variant>.<format>` and the background-removal preview
+DERIVED_FILE_PATTERN = re.compile(
+    r"^(?P<base>.+)_(?:" + "|".join(map(re.escape, IMAGE_VARIANTS)) + r"|bg_removed)\.[a-z0-9]+$"
+)
+
+
+@dataclass
+class GarbageCollectionReport:
+    scanned_files: int = 0
+    deleted_files: int = 0
+    reclaimed_bytes: int = 0
+    dry_run: bool = False
+    deleted_keys: list[str] = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            "scanned_files": self.scanned_files,
+            "deleted_files": self.deleted_files,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "dry_run": self.dry_run,
+        }
+
+
+def load_referenced_filenames(db: Session) -> set[str]:
+    """Loads the filenames of all clothing items in one query."""
+    query = db.query(ClothingItem.filename).distinct().execution_options(yield_per=1000)
+    return {filename for (filename,) in query}
+
+
+def is_referenced(key: str, referenced: set[str], referenced_bases: set[str]) -> bool:
+    """Checks whether a stored file is an item image or derived from one."""
+    if key in referenced:
+        return True
+    match = DERIVED_FILE_PATTERN.match(key)
+    return bool(match) and match.group("base") in referenced_bases
+
+
+def get_base_key(key: str) -> str:
+    """Returns the key of the original a stored file belongs to, without extension."""
+    match = DERIVED_FILE_PATTERN.match(key)
+    return match.group("base") if match else os.path.splitext(key)[0]
+
+
+def collect_garbage(
+    db: Session,
+    storage: Optional[StorageBackend] = None,
+    grace_seconds: int = STORAGE_GC_GRACE_SECONDS,
+    dry_run: bool = False,
+) -> GarbageCollectionReport:
+    """
+    Streams through the storage and deletes files that are not referenced.
+
+    Files modified within the grace period or leased by an upload (see
+    `lease_blob`) are skipped, because their item rows may not be committed yet. Stale temporary upload files are removed as well.
+    """
+    storage = storage or get_storage()
+    referenced = load_referenced_filenames(db)
+    referenced_bases = {os.path.splitext(filename)[0] for filename in referenced}
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    report = GarbageCollectionReport(dry_run=dry_run)
+
+    for stored_object in storage.list_objects():
+        report.scanned_files += 1
+        if stored_object.modified_at > cutoff:
+            continue
+        if is_referenced(stored_object.key, referenced, referenced_bases):
+            continue
+        if is_blob_leased(get_base_key(stored_object.key)):
+            continue
+
+        if not dry_run:
+            try:
+                storage.delete(stored_object.key)
+            except Exception as e:
+                logging.warning(f"Failed to delete unreferenced file {stored_object.key}: {e}")
+                continue
+        report.deleted_files += 1
+        report.reclaimed_bytes += stored_object.size
+        report.deleted_keys.append(stored_object.key)
+
+    logging.info(
+        f"🧹 Storage GC{' (dry run)' if dry_run else ''}: scanned {report.scanned_files} files, "
+        f"deleted {report.deleted_files}, reclaimed {report.reclaimed_bytes} bytes"
+    )
+    return report
+
+
+def run_garbage_collection(grace_seconds: int = STORAGE_GC_GRACE_SECONDS, dry_run: bool = False) -> GarbageCollectionReport:
+    """Runs `collect_garbage` with its own database session."""
+    from app.database.database import SessionLocal
+    db = SessionLocal()
+    try:
+        return collect_garbage(db, grace_seconds=grace_seconds, dry_run=dry_run)
+    finally:
+        db.close()
+
+
+async def run_garbage_collection_periodically(interval_seconds: int = STORAGE_GC_INTERVAL_SECONDS):
+    """Background task that runs the garbage collector every `interval_seconds`."""
+    from app.executors import run_in_pool
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_pool("db", run_garbage_collection)
+        except Exception as e:
+            logging.error(f"❌ Storage garbage collection failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete uploaded files that no clothing item references.")
+    parser.add_argument("--grace-hours", type=float, default=STORAGE_GC_GRACE_SECONDS / 3600,
+                        help="Keep unreferenced files younger than this")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    args = parser.parse_args()
+
+    report = run_garbage_collection(grace_seconds=int(args.grace_hours * 3600), dry_run=args.dry_run)
+    for key in report.deleted_keys:
+        print(f"{'Would delete' if args.dry_run else 'Deleted'}: {key}")
+    print(f"✅ Scanned {report.scanned_files} files, "
+          f"{'would reclaim' if args.dry_run else 'reclaimed'} {report.reclaimed_bytes} bytes "
+          f"from {report.deleted_files} files.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
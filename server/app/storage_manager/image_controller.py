@@ -0,0 +1,117 @@
+from io import BytesIO
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+
+from PIL import Image, ImageOps, features
+
+from app.constants import IMAGE_VARIANTS, IMAGE_VARIANT_QUALITY
+from .storage_backends import get_storage
+
+
+@lru_cache(maxsize=1)
+def get_derivative_formats() -> tuple[str, ...]:
+    """Returns the image formats derivatives are encoded in, AVIF only if Pillow supports it."""
+    formats = ["webp"]
+    if features.check("avif"):
+        formats.append("avif")
+    return tuple(formats)
+
+
+def get_variant_filename(filename: str, variant: str, image_format: str) -> str:
+    """Returns the filename of a derivative, e.g. `abc.jpg` -> `abc_thumb.webp`."""
+    base_name = os.path.splitext(filename)[0]
+    return f"{base_name}_{variant}.{image_format}"
+
+
+def build_file_url(filename: str) -> str:
+    """Returns the URL clients fetch a stored file from (presigned for S3 storage)."""
+    return get_storage().get_url(filename)
+
+
+def describe_variants(filename: str, variant_filenames: list[str]) -> str:
+    """
+    Returns the derivatives of an image in the form items store them, e.g.
+    `abc_thumb.webp` -> `thumb.webp`, comma-separated.
+    """
+    prefix = f"{os.path.splitext(filename)[0]}_"
+    return ",".join(name[len(prefix):] for name in variant_filenames if name.startswith(prefix))
+
+
+def parse_variants(image_variants: Optional[str]) -> list[str]:
+    """Splits the stored derivatives of an item (see `describe_variants`); None means none are known."""
+    return image_variants.split(",") if image_variants else []
+
+
+def find_stored_variants(filename: str) -> list[str]:
+    """Returns the names of the derivatives of an image that exist in the storage."""
+    storage = get_storage()
+    variant_filenames = [
+        get_variant_filename(filename, variant, image_format)
+        for variant in IMAGE_VARIANTS
+        for image_format in get_derivative_formats()
+    ]
+    return [variant_filename for variant_filename in variant_filenames if storage.exists(variant_filename)]
+
+
+def build_variant_urls(filename: str, image_variants: Optional[str]) -> dict[str, dict[str, str]]:
+    """
+    Returns the URLs of the stored derivatives of an image, grouped by variant.
+
+    Only derivatives listed in `image_variants` are included, so images whose
+    derivatives were never generated get an empty dict and clients fall back
+    to the original.
+
+    Example: {"thumb": {"webp": ".../abc_thumb.webp", "avif": ".../abc_thumb.avif"}, ...}
+    """
+    urls = {}
+    for key in parse_variants(image_variants):
+        variant, _, image_format = key.partition(".")
+        urls.setdefault(variant, {})[image_format] = build_file_url(get_variant_filename(filename, variant, image_format))
+    return urls
+
+
+def generate_image_derivatives(
+    filename: str,
+    image: Image.Image | None = None,
+    source_path: Optional[str] = None,
+) -> list[str]:
+    """
+    Generates thumbnail, medium and original-size variants of an uploaded image
+    and writes them to the storage next to the original.
+
+    :param filename: Storage key of the original file.
+    :param image: Already decoded image.
+    :param source_path: Local copy of the original (e.g. a staged upload), used
+        when `image` is omitted. The original is read from the storage otherwise.
+    :return: Names of the generated files. Errors are logged and produce an
+        empty list, so a broken image never fails the request that uploaded it.
+    """
+    generated = []
+    try:
+        if image is None:
+            source_file = source_path or BytesIO(get_storage().read_bytes(filename))
+            with Image.open(source_file) as source:
+                image = ImageOps.exif_transpose(source)
+                image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        for variant, max_side in IMAGE_VARIANTS.items():
+            resized = image
+            if max_side is not None and max(image.size) > max_side:
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+            for image_format in get_derivative_formats():
+                variant_filename = get_variant_filename(filename, variant, image_format)
+                buffer = BytesIO()
+                resized.save(buffer, format=image_format.upper(), quality=IMAGE_VARIANT_QUALITY)
+                buffer.seek(0)
+                get_storage().write_stream(variant_filename, buffer)
+                generated.append(variant_filename)
+    except Exception as e:
+        logging.warning(f"Failed to generate derivatives for {filename}: {e}")
+
+    return generated
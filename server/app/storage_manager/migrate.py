@@ -0,0 +1,81 @@
+"""
+Copies all uploaded files from one storage backend to another.
+
+Usage:
+    python -m app.storage_manager.migrate --source local --target s3 [--overwrite]
+"""
+import argparse
+import io
+import logging
+from typing import Iterator
+
+from .storage_backends import StorageBackend, create_storage_backend
+
+
+class ChunkStreamReader(io.RawIOBase):
+    """Exposes an iterator of byte chunks as a readable file object."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def migrate_storage(source: StorageBackend, target: StorageBackend, overwrite: bool = False) -> dict:
+    """
+    Streams every file of `source` into `target`.
+
+    :param overwrite: Copy files that already exist in the target as well.
+    :return: Counts of copied and skipped files and the number of copied bytes.
+    """
+    copied, skipped, copied_bytes = 0, 0, 0
+    for stored_object in source.list_objects():
+        # Temporary upload files are not part of the storage content
+        if stored_object.key.rsplit("/", 1)[-1].startswith("."):
+            continue
+        if not overwrite and target.exists(stored_object.key):
+            skipped += 1
+            continue
+
+        target.write_stream(stored_object.key, io.BufferedReader(ChunkStreamReader(source.open_read(stored_object.key))))
+        copied += 1
+        copied_bytes += stored_object.size
+        logging.info(f"Copied {stored_object.key} ({stored_object.size} bytes)")
+
+    return {"copied": copied, "skipped": skipped, "copied_bytes": copied_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy uploaded files between storage backends.")
+    parser.add_argument("--source", required=True, help="Source backend: local or s3")
+    parser.add_argument("--target", required=True, help="Target backend: local or s3")
+    parser.add_argument("--overwrite", action="store_true", help="Overwrite files that already exist in the target")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("Source and target backends must differ")
+
+    result = migrate_storage(
+        create_storage_backend(args.source),
+        create_storage_backend(args.target),
+        overwrite=args.overwrite,
+    )
+    print(f"✅ Copied {result['copied']} files ({result['copied_bytes']} bytes), skipped {result['skipped']}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,241 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+import logging
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, Optional
+
+from app.constants import (
+    UPLOAD_DIR, SERVER_URL, UPLOAD_CHUNK_SIZE, STORAGE_BACKEND, STORAGE_URL_EXPIRES_SECONDS,
+    S3_BUCKET, S3_ENDPOINT_URL, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_REGION,
+)
+
+
+@dataclass
+class StoredObject:
+    """Metadata of a file in a storage backend."""
+    key: str
+    size: int
+    modified_at: datetime
+
+
+class StorageBackend(ABC):
+    """
+    Storage for uploaded files, addressed by keys relative to the storage root
+    (e.g. `3f/a1/3fa1...e9.jpg`).
+    """
+
+    @abstractmethod
+    def get_staging_dir(self) -> str:
+        """Local directory where uploads are staged before `put_file`."""
+
+    @abstractmethod
+    def put_file(self, key: str, local_path: str):
+        """Moves a local file into the storage. The local file is consumed."""
+
+    @abstractmethod
+    def write_stream(self, key: str, source: BinaryIO):
+        """Writes a binary stream to the storage without loading it into memory."""
+
+    @abstractmethod
+    def open_read(self, key: str) -> Iterator[bytes]:
+        """Yields the content of a stored file in chunks."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Deletes a stored file, ignoring keys that do not exist."""
+
+    @abstractmethod
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        """Iterates over all stored files lazily."""
+
+    @abstractmethod
+    def get_url(self, key: str) -> str:
+        """Returns a URL clients can fetch the file from directly."""
+
+    def get_url_prefix(self) -> Optional[str]:
+        """Returns the prefix that gives the URL of every key, or None if URLs are signed per key."""
+        return None
+
+    def read_bytes(self, key: str) -> bytes:
+        return b"".join(self.open_read(key))
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files on the local disk, served by the `/uploads` StaticFiles mount."""
+
+    def __init__(self, root: str = UPLOAD_DIR, base_url: Optional[str] = None):
+        self.root = root
+        self.base_url = base_url or f"{SERVER_URL}/{root.strip('/')}"
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get_staging_dir(self) -> str:
+        # Same filesystem as the final location, so `put_file` is an atomic rename
+        return self.root
+
+    def put_file(self, key: str, local_path: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or self.root, exist_ok=True)
+        os.replace(local_path, path)
+
+    def write_stream(self, key: str, source: BinaryIO):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix=".write-", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                shutil.copyfileobj(source, temp_file, UPLOAD_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open_read(self, key: str) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as file:
+            while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                    if not key.startswith(prefix):
+                        continue
+                    stat = entry.stat()
+                    yield StoredObject(
+                        key=key,
+                        size=stat.st_size,
+                        modified_at=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+                    )
+
+    def get_url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def get_url_prefix(self) -> Optional[str]:
+        return f"{self.base_url}/"
+
+
+class S3StorageBackend(StorageBackend):
+    """Files in an S3-compatible bucket (AWS S3, MinIO, ...)."""
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        access_key_id: Optional[str] = S3_ACCESS_KEY_ID,
+        secret_access_key: Optional[str] = S3_SECRET_ACCESS_KEY,
+        region: str = S3_REGION,
+        url_expires_seconds: int = STORAGE_URL_EXPIRES_SECONDS,
+    ):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package") from e
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET to be set")
+
+        self.bucket = bucket
+        self.url_expires_seconds = url_expires_seconds
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            region_name=region,
+        )
+        self.staging_dir = os.path.join(tempfile.gettempdir(), "clothes-advisor-uploads")
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def get_staging_dir(self) -> str:
+        return self.staging_dir
+
+    def put_file(self, key: str, local_path: str):
+        try:
+            # upload_file switches to multipart uploads for large files
+            self.client.upload_file(local_path, self.bucket, key)
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    def write_stream(self, key: str, source: BinaryIO):
+        self.client.upload_fileobj(source, self.bucket, key)
+
+    def open_read(self, key: str) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        try:
+            yield from body.iter_chunks(UPLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield StoredObject(key=obj["Key"], size=obj["Size"], modified_at=obj["LastModified"])
+
+    def get_url(self, key: str) -> str:
+        # Presigning is a local HMAC computation, no request to the storage is made
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.url_expires_seconds,
+        )
+
+
+STORAGE_BACKENDS = {
+    "local": LocalStorageBackend,
+    "s3": S3StorageBackend,
+}
+
+
+def create_storage_backend(name: str) -> StorageBackend:
+    """Creates a storage backend by its name ("local" or "s3")."""
+    backend_class = STORAGE_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"❌ Unsupported storage backend: '{name}'")
+    logging.info(f"Using '{name}' storage backend")
+    return backend_class()
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> StorageBackend:
+    """Returns the storage backend configured by STORAGE_BACKEND."""
+    return create_storage_backend(STORAGE_BACKEND)
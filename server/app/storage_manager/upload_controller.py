@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from app.constants import MAX_FILE_SIZE_BYTES, MAX_FILE_SIZE_MB, UPLOAD_CHUNK_SIZE
+from .storage_backends import StorageBackend, get_storage
+
+
+@dataclass
+class StagedUpload:
+    """An upload that was streamed to a temporary file but is not yet published."""
+    temp_path: str
+    sha256: str
+    size: int
+    extension: str
+
+
+# Extensions end up in storage keys, so anything else falls back to the default
+_EXTENSION_PATTERN = re.compile(r"[a-z0-9]{1,5}")
+
+# One extension per format, so the same bytes always get the same blob key
+_FORMAT_EXTENSIONS = {"JPEG": "jpg", "MPO": "jpg", "TIFF": "tif"}
+
+
+def get_file_extension(filename: Optional[str], default: str = "jpg") -> str:
+    """
+    Returns the lower-cased extension of the uploaded filename (without the dot).
+
+    Only used for files Pillow can't decode; extensions that aren't 1-5
+    letters or digits are replaced with `default`.
+    """
+    if not filename or "." not in filename:
+        return default
+    extension = filename.rsplit(".", 1)[-1].lower()
+    return extension if _EXTENSION_PATTERN.fullmatch(extension) else default
+
+
+def get_format_extension(image_format: Optional[str], default: str = "jpg") -> str:
+    """Returns the extension for an image format detected by Pillow, e.g. `jpg` for `JPEG`."""
+    if not image_format:
+        return default
+    extension = _FORMAT_EXTENSIONS.get(image_format, image_format.lower())
+    return extension if _EXTENSION_PATTERN.fullmatch(extension) else default
+
+
+def _file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=400, detail=f"File size more than {MAX_FILE_SIZE_MB} MB.")
+
+
+def stream_to_temp_file(
+    source: BinaryIO,
+    directory: Optional[str] = None,
+    max_bytes: int = MAX_FILE_SIZE_BYTES,
+    extension: str = "jpg",
+) -> StagedUpload:
+    """
+    Copies a binary stream into a temporary file chunk by chunk.
+
+    The content is hashed while it is written and the copy is aborted as soon
+    as more than `max_bytes` were read, so an upload is never held in memory
+    as a whole.
+
+    :param source: Readable binary stream.
+    :param directory: Directory for the temporary file, the staging directory of
+        the storage backend by default. For local storage it is on the same
+        filesystem as the final location, so publishing is an atomic rename.
+    :param max_bytes: Maximum allowed size of the stream.
+    :param extension: Extension of the final file.
+    :raises HTTPException: 400 if the stream is larger than `max_bytes`.
+    """
+    directory = directory or get_storage().get_staging_dir()
+    os.makedirs(directory, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _file_too_large()
+                hasher.update(chunk)
+                temp_file.write(chunk)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+    except BaseException:
+        discard_staged_file(temp_path)
+        raise
+
+    logging.debug(f"Staged upload {temp_path} ({size} bytes)")
+    return StagedUpload(temp_path=temp_path, sha256=hasher.hexdigest(), size=size, extension=extension)
+
+
+def stage_upload(file: UploadFile, directory: Optional[str] = None, max_bytes: int = MAX_FILE_SIZE_BYTES) -> StagedUpload:
+    """Streams an `UploadFile` into a temporary file, see `stream_to_temp_file`."""
+    # Reject early when the multipart parser already knows the size
+    if getattr(file, "size", None) is not None and file.size > max_bytes:
+        raise _file_too_large()
+    return stream_to_temp_file(
+        file.file,
+        directory=directory,
+        max_bytes=max_bytes,
+        extension=get_file_extension(file.filename),
+    )
+
+
+def publish_staged_file(staged: StagedUpload, filename: str, storage: Optional[StorageBackend] = None) -> str:
+    """Moves a staged upload into the storage under its final name and returns that name."""
+    (storage or get_storage()).put_file(filename, staged.temp_path)
+    return filename
+
+
+def discard_staged_file(temp_path: str):
+    """Removes a temporary upload file, ignoring files that are already gone."""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Failed to remove temporary upload {temp_path}: {e}")
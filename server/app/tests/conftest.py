@@ -1,5 +1,8 @@
 # tests/conftest.py
+import io
+import uuid
 import pytest
+from PIL import Image
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -12,3 +15,27 @@ def setup_database():
     yield
     print("🧹 Closing DB connection after all tests")
     connection.close()
+
+
+def create_test_user(prefix: str = "test") -> tuple[str, dict]:
+    """Створює окремого користувача, щоб інші тести не змінювали його гардероб."""
+    from app.database.database import SessionLocal
+    from app.model import User
+    from app.user_manager.user_controller import create_access_token, hash_password
+    email = f"{prefix}-{uuid.uuid4().hex[:8]}@example.com"
+    with SessionLocal() as db:
+        db.add(User(email=email, password=hash_password("pass"), is_email_verified=True))
+        db.commit()
+    return email, {"Authorization": f"Bearer {create_access_token({'sub': email})}"}
+
+
+def make_image(color, size: int = 64) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def auth_token():
+    """Заголовки авторизації нового користувача."""
+    return create_test_user()[1]
@@ -0,0 +1,67 @@
+import io
+import json
+from fastapi.testclient import TestClient
+from app.main import app
+from app.tests.conftest import make_image
+
+client = TestClient(app)
+
+
+def test_batch_upload_returns_per_item_results(auth_token):
+    items = [
+        {"name": "Red Shirt", "category": "tshirt", "season": "summer", "material": "Cotton"},
+        {"name": "Blue Jeans", "category": "jeans", "season": "autumn", "material": "Denim",
+         "red": 10, "green": 20, "blue": 200, "purchase_date": "2024-03-01", "price": 59.9},
+        {"name": "Broken", "category": "not_a_category", "season": "summer", "material": "Cotton"},
+    ]
+    files = [
+        ("files", ("red.jpg", io.BytesIO(make_image((220, 20, 20))), "image/jpeg")),
+        ("files", ("blue.jpg", io.BytesIO(make_image((10, 20, 200))), "image/jpeg")),
+        ("files", ("broken.jpg", io.BytesIO(make_image((0, 0, 0))), "image/jpeg")),
+    ]
+
+    response = client.post(
+        "/clothing-items/batch",
+        data={"items": json.dumps(items)},
+        files=files,
+        headers=auth_token
+    )
+
+    assert response.status_code == 200, response.text
+    results = response.json()["data"]
+    assert [result["status"] for result in results] == ["created", "created", "failed"]
+    # Колір визначається автоматично, якщо його не передано
+    assert results[0]["data"]["red"] > 150
+    assert results[1]["data"]["blue"] == 200
+    assert results[1]["data"]["purchase_date"] == "2024-03-01"
+    assert "Invalid category" in results[2]["detail"]
+
+
+def test_batch_upload_rejects_mismatched_files(auth_token):
+    response = client.post(
+        "/clothing-items/batch",
+        data={"items": json.dumps([])},
+        files=[("files", ("red.jpg", io.BytesIO(make_image((220, 20, 20))), "image/jpeg"))],
+        headers=auth_token
+    )
+    assert response.status_code == 400
+
+
+def test_batch_upload_flags_possible_duplicates(auth_token):
+    image = make_image((30, 160, 60))
+    items = [{"name": "Green Hoodie", "category": "hoodie", "season": "spring", "material": "Cotton"}]
+
+    first = client.post(
+        "/clothing-items/batch",
+        data={"items": json.dumps(items)},
+        files=[("files", ("green.jpg", io.BytesIO(image), "image/jpeg"))],
+        headers=auth_token
+    ).json()["data"][0]
+    second = client.post(
+        "/clothing-items/batch",
+        data={"items": json.dumps(items)},
+        files=[("files", ("green_again.jpg", io.BytesIO(image), "image/jpeg"))],
+        headers=auth_token
+    ).json()["data"][0]
+
+    assert first["data"]["id"] in second["possible_duplicates"]
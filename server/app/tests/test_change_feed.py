@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from datetime import timedelta
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from app.main import app
+from app.change_feed import ChangeFeed, DatabaseChangeFeedBackend, RESYNC_EVENT, Subscription, build_change_event
+from app.database.database import SessionLocal
+from app.model import ChangeEvent
+from app.tests.conftest import create_test_user
+from app.user_manager.user_controller import create_access_token
+
+client = TestClient(app)
+
+
+def test_devices_receive_changes(auth_token):
+    with client.websocket_connect("/changes", headers=auth_token) as websocket:
+        hello = websocket.receive_json()
+        assert hello["op"] == "subscribed"
+
+        response = client.post("/clothing-combinations", json={"name": "Empty", "item_ids": []}, headers=auth_token)
+        assert response.status_code == 200
+        combination_id = response.json()["data"]["combination_id"]
+        assert websocket.receive_json() == build_change_event(
+            "combination", combination_id, "create", response.json()["synchronized_at"])
+
+        response = client.delete(f"/clothing-combinations/{combination_id}", headers=auth_token)
+        event = websocket.receive_json()
+        assert (event["entity"], event["id"], event["op"]) == ("combination", combination_id, "delete")
+        assert event["synchronized_at"] == response.json()["synchronized_at"]
+
+
+def test_change_feed_requires_token():
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/changes", headers={"Authorization": "Bearer invalid"}) as websocket:
+            websocket.receive_json()
+
+
+def test_ticket_opens_change_feed_once(auth_token):
+    response = client.post("/changes/ticket", headers=auth_token)
+    assert response.status_code == 200
+    ticket = response.json()["ticket"]
+
+    with client.websocket_connect(f"/changes?ticket={ticket}") as websocket:
+        assert websocket.receive_json()["op"] == "subscribed"
+
+    # Квиток одноразовий
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/changes?ticket={ticket}") as websocket:
+            websocket.receive_json()
+
+
+def test_change_feed_closes_when_token_expires():
+    email, _ = create_test_user("feed")
+    token = create_access_token({"sub": email}, expires_delta=timedelta(seconds=1))
+    with client.websocket_connect("/changes", headers={"Authorization": f"Bearer {token}"}) as websocket:
+        assert websocket.receive_json()["op"] == "subscribed"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
+
+
+def test_change_feed_closes_after_password_change(auth_token):
+    with client.websocket_connect("/changes", headers=auth_token) as websocket:
+        assert websocket.receive_json()["op"] == "subscribed"
+        response = client.put("/change-password", data={"old_password": "pass", "new_password": "new-pass"},
+                              headers=auth_token)
+        assert response.status_code == 200, response.text
+        # Токени відкликано, тож стрічка закривається замість надсилання події
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
+
+
+def test_database_backend_relays_events_between_workers():
+    async def scenario():
+        publisher_feed, subscriber_feed = ChangeFeed(), ChangeFeed()
+        publisher = DatabaseChangeFeedBackend(publisher_feed)
+        subscriber = DatabaseChangeFeedBackend(subscriber_feed)
+        # Перше опитування лише запам'ятовує останню подію
+        publisher.poll()
+        subscriber.poll()
+
+        local = publisher_feed.subscribe(1)
+        remote = subscriber_feed.subscribe(1)
+        other_user = subscriber_feed.subscribe(2)
+        event = build_change_event("item", 5, "update", "2025-01-01T00:00:00")
+        publisher.publish(1, event)
+        assert publisher.poll() == 0  # Власні події не доставляються вдруге
+        assert subscriber.poll() == 1
+
+        await asyncio.sleep(0)
+        assert await asyncio.wait_for(local.get(), 1) == event
+        assert await asyncio.wait_for(remote.get(), 1) == event
+        assert other_user.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_gets_resync():
+    async def scenario():
+        subscription = Subscription(1, queue_size=2)
+        for i in range(3):
+            subscription.put(build_change_event("item", i, "update", None))
+        assert await subscription.get() == RESYNC_EVENT
+        assert subscription.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_database_backend_relays_events_committed_out_of_order():
+    with SessionLocal() as db:
+        last_id = db.query(ChangeEvent.id).order_by(ChangeEvent.id.desc()).limit(1).scalar() or 0
+
+    def insert_event(event_id: int, entity_id: int):
+        with SessionLocal() as db:
+            db.add(ChangeEvent(id=event_id, user_id=1, origin="other-worker", created_at=time.time(),
+                               payload=json.dumps(build_change_event("item", entity_id, "update", None))))
+            db.commit()
+
+    async def scenario():
+        feed = ChangeFeed()
+        backend = DatabaseChangeFeedBackend(feed)
+        backend.poll()
+        subscription = feed.subscribe(1)
+
+        # Подія з більшим id зафіксована раніше за подію з меншим
+        insert_event(last_id + 2, 2)
+        assert backend.poll() == 1
+        insert_event(last_id + 1, 1)
+        assert backend.poll() == 1
+        assert backend.poll() == 0
+
+        await asyncio.sleep(0)
+        assert [(await subscription.get())["id"] for _ in range(2)] == [2, 1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,192 @@
+import io
+import json
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database.database import SessionLocal
+from app.constants import SYNC_TOMBSTONE_RETENTION_DAYS
+from app.model import ClothingCombination, ClothingItem, SyncTombstone, User
+from app.tests.conftest import make_image
+from app.user_manager.sync_controller import remove_old_tombstones
+from app.user_manager.user_controller import create_access_token
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def no_overlap(monkeypatch):
+    # Без перекриття вікна, щоб перевіряти точний набір змін
+    monkeypatch.setattr("app.user_manager.sync_controller.SYNC_DELTA_OVERLAP_SECONDS", 0)
+
+
+def sync(headers, since=None, changes=None, files=None):
+    data = {"changes": json.dumps(changes or {})}
+    if since:
+        data["since"] = since
+    response = client.post("/synchronize/changes", data=data, files=files, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_delta_sync_returns_only_changes(auth_token):
+    shirt, pants, combo = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    first = sync(auth_token, changes={
+        "clothing_items": [
+            {"uuid": shirt, "name": "Shirt", "category": "tshirt", "season": "summer",
+             "material": "Cotton", "purchase_date": "2024-05-01", "file_index": 0},
+            {"uuid": pants, "name": "Pants", "category": "pants", "season": "summer",
+             "material": "Denim", "file_index": 1},
+        ],
+        "clothing_combinations": [{"uuid": combo, "name": "Summer", "item_uuids": [shirt, pants]}],
+    }, files=[
+        ("files", ("shirt.jpg", io.BytesIO(make_image((200, 10, 10))), "image/jpeg")),
+        ("files", ("pants.jpg", io.BytesIO(make_image((10, 10, 200))), "image/jpeg")),
+    ])
+    assert first["is_full"] is True
+    assert {item["uuid"] for item in first["data"]["items"]} == {shirt, pants}
+    assert first["data"]["combinations"][0]["item_uuids"] == [shirt, pants]
+
+    # Без змін сервер нічого не повертає
+    unchanged = sync(auth_token, since=first["synchronized_at"])
+    assert unchanged["is_full"] is False
+    assert unchanged["data"]["items"] == [] and unchanged["data"]["combinations"] == []
+
+    # Інший пристрій змінює одну річ і видаляє іншу
+    second = sync(auth_token, since=first["synchronized_at"], changes={
+        "clothing_items": [{"uuid": shirt, "name": "Red Shirt"}],
+        "deleted_clothing_items": [pants],
+    })
+    assert [item["name"] for item in second["data"]["items"]] == ["Red Shirt"]
+    assert second["data"]["deleted"]["items"] == [pants]
+    # Комбінація втратила видалену річ, але залишилася
+    assert second["data"]["combinations"][0]["item_uuids"] == [shirt]
+
+    with SessionLocal() as db:
+        item = db.query(ClothingItem).filter(ClothingItem.uuid == shirt).one()
+        assert item.material == "Cotton" and item.purchase_date.isoformat() == "2024-05-01"
+        assert db.query(ClothingItem).filter(ClothingItem.uuid == pants).first() is None
+        assert db.query(ClothingCombination).filter(ClothingCombination.uuid == combo).one() is not None
+
+
+def test_delta_sync_does_not_recreate_deleted_rows(auth_token):
+    hat = str(uuid.uuid4())
+    created = sync(auth_token, changes={"clothing_items": [
+        {"uuid": hat, "name": "Hat", "category": "hat", "season": "winter", "material": "Wool", "file_index": 0}
+    ]}, files=[("files", ("hat.jpg", io.BytesIO(make_image((0, 0, 0))), "image/jpeg"))])
+    sync(auth_token, since=created["synchronized_at"], changes={"deleted_clothing_items": [hat]})
+
+    # Пристрій, що ще не бачив видалення, надсилає зміну цієї речі
+    stale = sync(auth_token, since=created["synchronized_at"], changes={
+        "clothing_items": [{"uuid": hat, "name": "Warm Hat"}]
+    })
+    assert stale["data"]["items"] == []
+    assert stale["data"]["deleted"]["items"] == [hat]
+
+
+def test_old_tombstones_are_removed_by_garbage_collection(auth_token):
+    hat = str(uuid.uuid4())
+    created = sync(auth_token, changes={"clothing_items": [
+        {"uuid": hat, "name": "Hat", "category": "hat", "season": "winter", "material": "Wool", "file_index": 0}
+    ]}, files=[("files", ("hat.jpg", io.BytesIO(make_image((1, 1, 1))), "image/jpeg"))])
+    deleted = sync(auth_token, since=created["synchronized_at"], changes={"deleted_clothing_items": [hat]})
+    # Курсор узято до читання змін, тож він не раніше за збережений час синхронізації
+    with SessionLocal() as db:
+        tombstone = db.query(SyncTombstone).filter(SyncTombstone.uuid == hat).one()
+        stored = db.query(User.synchronized_at).filter(User.id == tombstone.owner_id).scalar()
+        assert datetime.fromisoformat(deleted["synchronized_at"]) >= stored
+
+        old = datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+        db.query(SyncTombstone).filter(SyncTombstone.uuid == hat).update({SyncTombstone.deleted_at: old})
+        db.commit()
+        assert remove_old_tombstones(db) >= 1
+        assert db.query(SyncTombstone).filter(SyncTombstone.uuid == hat).first() is None
+
+    # Клієнт, що не синхронізувався довше за зберігання, отримує все заново
+    stale = sync(auth_token, since=old.isoformat())
+    assert stale["is_full"] is True and stale["data"]["items"] == []
+
+
+def test_delta_sync_rejects_new_item_without_file(auth_token):
+    response = client.post("/synchronize/changes", data={"changes": json.dumps({"clothing_items": [
+        {"uuid": str(uuid.uuid4()), "name": "Coat", "category": "coat", "season": "winter", "material": "Wool"}
+    ]})}, headers=auth_token)
+
+    assert response.status_code == 400
+
+
+def test_only_missing_files_are_uploaded(auth_token):
+    import hashlib
+    photo = make_image((30, 160, 30))
+    photo_hash = hashlib.sha256(photo).hexdigest()
+    unknown_hash = hashlib.sha256(b"not uploaded").hexdigest()
+
+    response = client.post("/synchronize/missing-files", json={"content_hashes": [photo_hash, unknown_hash]}, headers=auth_token)
+    assert response.status_code == 200
+    assert response.json()["data"]["missing_content_hashes"] == [photo_hash, unknown_hash]
+
+    scarf = str(uuid.uuid4())
+    created = sync(auth_token, changes={"clothing_items": [
+        {"uuid": scarf, "name": "Scarf", "category": "scarf", "season": "winter", "material": "Wool", "file_index": 0}
+    ]}, files=[("files", ("scarf.jpg", io.BytesIO(photo), "image/jpeg"))])
+
+    response = client.post("/synchronize/missing-files", json={"content_hashes": [photo_hash.upper(), unknown_hash]}, headers=auth_token)
+    assert response.json()["data"]["missing_content_hashes"] == [unknown_hash]
+
+    # Нова річ посилається на вже завантажене фото без повторного завантаження
+    gloves = str(uuid.uuid4())
+    second = sync(auth_token, since=created["synchronized_at"], changes={"clothing_items": [
+        {"uuid": gloves, "name": "Gloves", "category": "gloves", "season": "winter", "material": "Wool",
+         "content_hash": photo_hash}
+    ]})
+    scarf_item = created["data"]["items"][0]
+    gloves_item = next(item for item in second["data"]["items"] if item["uuid"] == gloves)
+    assert gloves_item["filename"] == scarf_item["filename"]
+
+    response = client.post("/synchronize/changes", data={"changes": json.dumps({"clothing_items": [
+        {"uuid": str(uuid.uuid4()), "name": "Belt", "category": "belt", "season": "summer", "material": "Leather",
+         "content_hash": unknown_hash}
+    ]})}, headers=auth_token)
+    assert response.status_code == 409
+    assert response.json()["detail"]["missing_content_hashes"] == [unknown_hash]
+
+
+def test_content_hashes_of_other_users_are_reported_missing(auth_token):
+    import hashlib
+    photo = make_image((90, 90, 10))
+    sync(auth_token, changes={"clothing_items": [
+        {"uuid": str(uuid.uuid4()), "name": "Bag", "category": "bag", "season": "summer", "material": "Leather", "file_index": 0}
+    ]}, files=[("files", ("bag.jpg", io.BytesIO(photo), "image/jpeg"))])
+
+    other_user = {"Authorization": f"Bearer {create_access_token({'sub': 'charlie@example.com'})}"}
+    content_hash = hashlib.sha256(photo).hexdigest()
+    response = client.post("/synchronize/missing-files", json={"content_hashes": [content_hash]}, headers=other_user)
+
+    assert response.json()["data"]["missing_content_hashes"] == [content_hash]
+
+
+def test_full_sync_uploads_only_new_photos(auth_token):
+    import hashlib
+    old_photo, new_photo = make_image((5, 5, 5)), make_image((250, 250, 250))
+    created = sync(auth_token, changes={"clothing_items": [
+        {"uuid": str(uuid.uuid4()), "name": "Boots", "category": "boots", "season": "winter", "material": "Leather", "file_index": 0}
+    ]}, files=[("files", ("boots.jpg", io.BytesIO(old_photo), "image/jpeg"))])
+    boots = created["data"]["items"][0]
+
+    items = [
+        {**boots, "content_hash": hashlib.sha256(old_photo).hexdigest()},
+        {"id": 100, "name": "Socks", "category": "socks", "season": "winter", "material": "Wool", "file_index": 0},
+    ]
+    response = client.post("/synchronize", data={
+        "clothing_items": json.dumps(items),
+        "clothing_combinations": json.dumps([{"id": 1, "name": "Warm", "item_ids": [boots["id"], 100]}]),
+        "is_server_to_local": False,
+    }, files=[("files", ("socks.jpg", io.BytesIO(new_photo), "image/jpeg"))], headers=auth_token)
+    assert response.status_code == 200, response.text
+
+    data = response.json()["data"]
+    assert [item["name"] for item in data["items"]] == ["Boots", "Socks"]
+    # Річ, що не змінилася, зберегла свій ідентифікатор і файл
+    assert data["items"][0]["id"] == boots["id"] and data["items"][0]["uuid"] == boots["uuid"]
+    assert data["combinations"][0]["items"] == [item["id"] for item in data["items"]]
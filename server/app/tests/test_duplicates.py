@@ -0,0 +1,96 @@
+import io
+import random
+import uuid
+from datetime import datetime
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
+from app.close_manager.duplicate_detector import BKTree, DuplicateIndex, compute_perceptual_hash, hamming_distance
+from app.database.database import SessionLocal
+from app.main import app
+from app.model import ClothingItem, User
+from app.tests.conftest import create_test_user
+
+client = TestClient(app)
+
+
+def make_photo(seed: int) -> Image.Image:
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (400, 300), (rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randint(0, 350), rnd.randint(0, 250)
+        draw.rectangle([x, y, x + rnd.randint(20, 120), y + rnd.randint(20, 120)],
+                       fill=(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    return img
+
+
+def test_perceptual_hash_survives_resize_and_recompression():
+    original = make_photo(1)
+    buffer = io.BytesIO()
+    original.resize((200, 150)).save(buffer, format="JPEG", quality=60)
+    buffer.seek(0)
+    recompressed = Image.open(buffer)
+
+    same = hamming_distance(int(compute_perceptual_hash(original), 16), int(compute_perceptual_hash(recompressed), 16))
+    different = hamming_distance(int(compute_perceptual_hash(original), 16), int(compute_perceptual_hash(make_photo(2)), 16))
+
+    assert same <= 6
+    assert different > 6
+
+
+def test_bk_tree_finds_hashes_within_distance():
+    tree = BKTree()
+    rnd = random.Random(0)
+    values = [rnd.getrandbits(64) for _ in range(500)]
+    for item_id, value in enumerate(values):
+        tree.add(value, item_id)
+
+    query = values[42] ^ 0b101  # 2 bits differ
+    found = tree.search(query, max_distance=3)
+
+    expected = sorted(
+        ((item_id, hamming_distance(query, value)) for item_id, value in enumerate(values)
+         if hamming_distance(query, value) <= 3),
+        key=lambda pair: pair[1])
+    assert found == expected
+    assert found[0] == (42, 2)
+
+
+def test_duplicate_index_sees_changes_of_other_workers():
+    email, _ = create_test_user("duplicates")
+    perceptual_hash = compute_perceptual_hash(make_photo(3))
+    index = DuplicateIndex()
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.email == email).one()
+        assert index.find_duplicates(db, user.id, perceptual_hash) == []
+
+        # Інший воркер додає річ і оновлює synchronized_at, локальний індекс про це не знає
+        item = ClothingItem(name="Shirt", category="tshirt", season="summer", material="Cotton",
+                            filename=f"{uuid.uuid4().hex}.jpg", owner_id=user.id, perceptual_hash=perceptual_hash)
+        db.add(item)
+        user.synchronized_at = datetime.utcnow()
+        db.commit()
+
+        assert index.find_duplicates(db, user.id, perceptual_hash) == [item.id]
+
+
+def test_uploads_do_not_rebuild_the_duplicate_index(auth_token, monkeypatch):
+    from app.close_manager import duplicate_detector
+    builds = []
+
+    class CountingBKTree(BKTree):
+        def __init__(self):
+            super().__init__()
+            builds.append(self)
+
+    monkeypatch.setattr(duplicate_detector, "BKTree", CountingBKTree)
+    for seed in range(4):
+        buffer = io.BytesIO()
+        make_photo(10 + seed).save(buffer, format="JPEG")
+        response = client.post("/add-clothing-item", data={
+            "name": f"Item {seed}", "category": "tshirt", "season": "summer", "material": "Cotton",
+        }, files={"file": (f"{seed}.jpg", buffer.getvalue(), "image/jpeg")}, headers=auth_token)
+        assert response.status_code == 200, response.text
+
+    # Дерево будується один раз, наступні завантаження лише додають до нього хеші
+    assert len(builds) == 1
@@ -0,0 +1,161 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.database.database import SessionLocal
+from app.model import OutboxEmail, User
+from app.tests.conftest import create_test_user
+from app.ttl_store import get_ttl_store
+from app.user_manager.email_outbox import EmailSender, SMTPConnectionPool, enqueue_email_sync, remove_old_emails
+from app.user_manager.mail_controller import get_verification_code_key, send_verification_code, verify_code
+
+
+class RecordingHandler:
+    def __init__(self, reject: str = None):
+        self.messages = []
+        self.sessions = set()
+        self.reject = reject
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == self.reject:
+            return "550 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append(envelope.rcpt_tos[0])
+        return "250 Message accepted"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    # Листи, що лишилися від інших тестів, не мають потрапити в цей сервер
+    with SessionLocal() as db:
+        db.query(OutboxEmail).filter(OutboxEmail.status != "sent").update(
+            {OutboxEmail.status: "failed"}, synchronize_session=False)
+        db.commit()
+
+    handler = RecordingHandler(reject="rejected@example.com")
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+def make_sender(port: int, max_idle_seconds: float = 60) -> tuple[EmailSender, SMTPConnectionPool]:
+    pool = SMTPConnectionPool(hostname="127.0.0.1", port=port, username=None, password=None,
+                              start_tls=False, size=1, max_idle_seconds=max_idle_seconds)
+    return EmailSender(pool, batch_size=10), pool
+
+
+def test_outbox_sends_batch_over_one_connection(smtp_server):
+    handler, port = smtp_server
+    ids = [enqueue_email_sync(f"user{i}@example.com", "Тест", "<p>Привіт</p>") for i in range(3)]
+    sender, pool = make_sender(port)
+
+    async def send():
+        try:
+            return await sender.send_pending_batch()
+        finally:
+            await pool.close()
+
+    assert asyncio.run(send()) == 3
+    assert sorted(handler.messages) == [f"user{i}@example.com" for i in range(3)]
+    # Всі листи надіслано через одне SMTP-з'єднання
+    assert pool.opened_connections == 1
+    assert len(handler.sessions) == 1
+
+    with SessionLocal() as db:
+        emails = db.query(OutboxEmail).filter(OutboxEmail.id.in_(ids)).all()
+        assert all(email.status == "sent" and email.attempts == 1 for email in emails)
+        # Тіло надісланого листа (коди, посилання) не зберігається
+        assert all(email.body == "" for email in emails)
+
+
+def test_outbox_retries_rejected_email_later(smtp_server):
+    handler, port = smtp_server
+    email_id = enqueue_email_sync("rejected@example.com", "Тест", "<p>Привіт</p>")
+    sender, pool = make_sender(port)
+
+    async def send():
+        try:
+            return await sender.send_pending_batch()
+        finally:
+            await pool.close()
+
+    assert asyncio.run(send()) == 0
+    assert handler.messages == []
+
+    with SessionLocal() as db:
+        email = db.get(OutboxEmail, email_id)
+        assert email.status == "pending"
+        assert email.attempts == 1
+        assert "550" in email.last_error
+        assert email.next_attempt_at > datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # Повторна спроба ще не настала, тому лист не вибирається знову
+    sender, pool = make_sender(port)
+    assert asyncio.run(send()) == 0
+
+
+def test_outbox_reopens_stale_connections(smtp_server):
+    handler, port = smtp_server
+    sender, pool = make_sender(port, max_idle_seconds=0)
+
+    async def send_twice():
+        try:
+            enqueue_email_sync("first@example.com", "Тест", "<p>1</p>")
+            assert await sender.send_pending_batch() == 1
+            # Сервер закрив з'єднання, поки воно простоювало
+            client, _ = pool.idle[0]
+            client.close()
+            enqueue_email_sync("second@example.com", "Тест", "<p>2</p>")
+            return await sender.send_pending_batch()
+        finally:
+            await pool.close()
+
+    assert asyncio.run(send_twice()) == 1
+    assert handler.messages == ["first@example.com", "second@example.com"]
+    assert pool.opened_connections == 2
+
+
+def test_old_emails_are_removed(smtp_server):
+    email_id = enqueue_email_sync("old@example.com", "Тест", "<p>Код 123456</p>")
+    with SessionLocal() as db:
+        db.query(OutboxEmail).filter(OutboxEmail.id == email_id).update({
+            OutboxEmail.status: "failed",
+            OutboxEmail.created_at: datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=2),
+        }, synchronize_session=False)
+        db.commit()
+
+    assert remove_old_emails(retention_seconds=24 * 60 * 60) >= 1
+    with SessionLocal() as db:
+        assert db.get(OutboxEmail, email_id) is None
+
+
+def test_verification_code_is_consumed_once():
+    email, _ = create_test_user("verify")
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.email == email).one()
+        user.is_email_verified = False
+        db.commit()
+        user_id = user.id
+
+    asyncio.run(send_verification_code(email, user_id))
+    code = get_ttl_store().get(get_verification_code_key(user_id))
+    with SessionLocal() as db:
+        assert asyncio.run(verify_code(user_id, "wrong", db)) is False
+        assert asyncio.run(verify_code(user_id, code, db)) is True
+        # Код одноразовий
+        assert asyncio.run(verify_code(user_id, code, db)) is False
+        assert db.query(User.is_email_verified).filter(User.id == user_id).scalar() is True
@@ -0,0 +1,54 @@
+import json
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.tests.conftest import create_test_user
+
+client = TestClient(app)
+
+
+def server_to_local(headers):
+    return client.post("/synchronize", data={"clothing_items": "[]", "clothing_combinations": "[]"}, headers=headers)
+
+
+@pytest.mark.parametrize("path", ["/clothing-items", "/clothing-combinations", "/profile"])
+def test_repeated_read_is_not_modified(auth_token, path):
+    first = client.get(path, headers=auth_token)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    second = client.get(path, headers={**auth_token, "If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert second.content == b""
+
+    # Інший ETag не збігається
+    assert client.get(path, headers={**auth_token, "If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_etag_changes_after_mutation(auth_token):
+    items_etag = client.get("/clothing-items", headers=auth_token).headers["ETag"]
+    sync_etag = server_to_local(auth_token).headers["ETag"]
+    assert server_to_local({**auth_token, "If-None-Match": sync_etag}).status_code == 304
+
+    response = client.post("/synchronize/changes", data={"changes": json.dumps({"clothing_combinations": [
+        {"uuid": str(uuid.uuid4()), "name": "Empty", "item_uuids": []}
+    ]})}, headers=auth_token)
+    assert response.status_code == 200, response.text
+
+    # Після зміни гардеробу клієнт отримує нові дані
+    items = client.get("/clothing-items", headers={**auth_token, "If-None-Match": items_etag})
+    assert items.status_code == 200
+    assert items.headers["ETag"] != items_etag
+
+    combos = server_to_local({**auth_token, "If-None-Match": sync_etag})
+    assert combos.status_code == 200
+    assert len(combos.json()["data"]["combinations"]) == 1
+
+
+def test_etags_differ_between_users(auth_token):
+    _, other_token = create_test_user("etag")
+
+    etag = client.get("/clothing-items", headers=auth_token).headers["ETag"]
+    assert client.get("/clothing-items", headers={**other_token, "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,47 @@
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from app.executors import BoundedExecutor, ExecutorSaturatedError
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_bounded_executor_rejects_when_saturated():
+    executor = BoundedExecutor("test", max_workers=1, max_queued=1)
+    release = threading.Event()
+
+    running = executor.submit(release.wait)
+    queued = executor.submit(release.wait)
+    with pytest.raises(ExecutorSaturatedError):
+        executor.submit(release.wait)
+
+    release.set()
+    running.result(timeout=5)
+    queued.result(timeout=5)
+    metrics = executor.metrics()
+    assert metrics["completed"] == 2
+    assert metrics["rejected"] == 1
+    assert metrics["active"] == 0 and metrics["queued"] == 0
+
+    # Звільнені слоти можна використовувати знову
+    assert executor.submit(lambda: 42).result(timeout=5) == 42
+
+
+def test_bounded_executor_map_keeps_order_and_waits_for_slots():
+    executor = BoundedExecutor("test_map", max_workers=2, max_queued=0)
+
+    assert list(executor.map(lambda x: x * x, range(10), max_in_flight=2)) == [x * x for x in range(10)]
+    assert executor.metrics()["rejected"] == 0
+
+
+def test_executor_metrics_endpoint(monkeypatch):
+    assert client.get("/metrics/executors").status_code == 404  # Без METRICS_TOKEN метрик немає
+
+    monkeypatch.setattr("app.routes.METRICS_TOKEN", "metrics-secret")
+    assert client.get("/metrics/executors").status_code == 401
+    assert client.get("/metrics/executors", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics/executors", headers={"Authorization": "Bearer metrics-secret"})
+
+    assert response.status_code == 200
+    assert {"image", "ml", "cpu", "db", "http"} <= response.json()["data"].keys()
@@ -0,0 +1,17 @@
+from app import maintenance
+
+
+def test_failing_step_does_not_stop_the_others(monkeypatch):
+    def broken(db):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(maintenance, "MAINTENANCE_STEPS", {
+        "broken": broken,
+        "counted": lambda db: 3,
+    })
+    # Помилка одного кроку лише логується, наступні кроки виконуються
+    assert maintenance.run_maintenance() == {"counted": 3}
+
+
+def test_maintenance_runs_every_step():
+    assert set(maintenance.run_maintenance()) == set(maintenance.MAINTENANCE_STEPS)
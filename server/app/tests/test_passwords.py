@@ -0,0 +1,40 @@
+from fastapi.testclient import TestClient
+from app.constants import BCRYPT_ROUNDS
+from app.database.database import SessionLocal
+from app.main import app
+from app.model import User
+from app.user_manager.user_controller import hash_password, password_needs_rehash, verify_password
+
+client = TestClient(app)
+
+
+def test_hash_password_uses_configured_rounds():
+    hashed = hash_password("secret")
+
+    assert hashed.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+    assert verify_password("secret", hashed)
+    assert not password_needs_rehash(hashed)
+    assert password_needs_rehash(hash_password("secret", rounds=BCRYPT_ROUNDS + 1))
+
+
+def test_login_rehashes_outdated_password_hash():
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == "test@gmail.com").first()
+        user.password = hash_password("pass", rounds=BCRYPT_ROUNDS + 1)
+        db.commit()
+
+        response = client.post("/login_with_email", data={"email": "test@gmail.com", "password": "pass"})
+        assert response.status_code == 200
+
+        db.refresh(user)
+        # Хеш оновлено до поточної вартості, пароль не змінився
+        assert not password_needs_rehash(user.password)
+        assert verify_password("pass", user.password)
+    finally:
+        db.close()
+
+
+def test_login_with_wrong_password_is_rejected():
+    response = client.post("/login_with_email", data={"email": "test@gmail.com", "password": "wrong"})
+    assert response.status_code == 404
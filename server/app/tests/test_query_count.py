@@ -0,0 +1,77 @@
+import uuid
+from contextlib import contextmanager
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.main import app
+from app.database.database import SessionLocal, engine
+from app.model import ClothingCombination, ClothingItem, User
+from app.user_manager.user_controller import create_access_token, hash_password
+
+client = TestClient(app)
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+
+
+def make_wardrobe(combination_count: int) -> dict:
+    """Створює користувача з `combination_count` комбінаціями по дві речі."""
+    email = f"queries-{uuid.uuid4().hex[:8]}@example.com"
+    with SessionLocal() as db:
+        user = User(email=email, password=hash_password("pass"), is_email_verified=True)
+        db.add(user)
+        db.flush()
+        for i in range(combination_count):
+            items = [ClothingItem(name=f"Item {i}-{j}", category="tshirt", season="summer", material="Cotton",
+                                  filename=f"{uuid.uuid4().hex}.jpg", owner_id=user.id) for j in range(2)]
+            db.add(ClothingCombination(name=f"Combo {i}", owner_id=user.id, items=items))
+        db.commit()
+    return {"Authorization": f"Bearer {create_access_token({'sub': email})}"}
+
+
+def query_count(method: str, path: str, headers: dict, **kwargs) -> int:
+    # Перший запит заповнює кеш користувача, рахуємо другий
+    client.request(method, path, headers=headers, **kwargs)
+    with count_queries() as statements:
+        response = client.request(method, path, headers=headers, **kwargs)
+    assert response.status_code == 200, response.text
+    return len(statements)
+
+
+def assert_constant_query_count(method: str, path: str, **kwargs):
+    small, large = make_wardrobe(2), make_wardrobe(12)
+    assert query_count(method, path, small, **kwargs) == query_count(method, path, large, **kwargs)
+
+
+def test_combination_listing_has_no_n_plus_one():
+    assert_constant_query_count("GET", "/clothing-combinations")
+    assert_constant_query_count("GET", "/clothing-combinations?layout=columnar")
+
+
+def test_server_to_local_sync_has_no_n_plus_one():
+    data = {"clothing_items": "[]", "clothing_combinations": "[]"}
+    assert_constant_query_count("POST", "/synchronize", data=data)
+    assert_constant_query_count("POST", "/synchronize?layout=columnar", data=data)
+
+
+def test_delta_sync_has_no_n_plus_one():
+    assert_constant_query_count("POST", "/synchronize/changes", data={"changes": "{}"})
+
+
+def test_server_to_local_sync_lists_item_ids():
+    headers = make_wardrobe(3)
+    data = client.post("/synchronize", data={"clothing_items": "[]", "clothing_combinations": "[]"},
+                       headers=headers).json()["data"]
+    item_ids = [item["id"] for item in data["items"]]
+    assert [combination["items"] for combination in data["combinations"]] == [
+        item_ids[0:2], item_ids[2:4], item_ids[4:6]]
@@ -0,0 +1,92 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.database.database import SessionLocal
+from app.model import RateLimitBucket
+from app.rate_limiter import DatabaseRateLimitBackend, MemoryRateLimitBackend, RateLimitMiddleware
+from app.user_manager.user_controller import create_access_token
+
+
+def make_client(backend) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, backend=backend, rules={
+        "POST /login": {"ip": (2, 60)},
+        "GET /items/{item_id}/preview": {"user": (1, 60)},
+    })
+
+    @app.post("/login")
+    def login():
+        return {"detail": "ok"}
+
+    @app.get("/items/{item_id}/preview")
+    def preview(item_id: int):
+        return {"detail": "ok"}
+
+    @app.get("/items")
+    def items():
+        return {"detail": "ok"}
+
+    return TestClient(app)
+
+
+@pytest.fixture(params=["memory", "database"])
+def backend(request):
+    if request.param == "memory":
+        yield MemoryRateLimitBackend()
+        return
+    # Бакети зберігаються в тестовій БД, тому кожен тест починає з порожньої таблиці
+    clear_buckets()
+    yield DatabaseRateLimitBackend()
+    clear_buckets()
+
+
+def clear_buckets():
+    with SessionLocal() as db:
+        db.query(RateLimitBucket).delete()
+        db.commit()
+
+
+def test_rate_limit_per_ip(backend):
+    client = make_client(backend)
+
+    assert client.post("/login").status_code == 200
+    assert client.post("/login").status_code == 200
+    response = client.post("/login")
+    assert response.status_code == 429
+    # Один токен відновлюється за 30 секунд
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+
+    # Маршрути без правила не обмежуються
+    for _ in range(5):
+        assert client.get("/items").status_code == 200
+
+
+def test_rate_limit_per_user(backend):
+    client = make_client(backend)
+    alice = {"Authorization": f"Bearer {create_access_token({'sub': 'alice@example.com'})}"}
+    bob = {"Authorization": f"Bearer {create_access_token({'sub': 'bob@example.com'})}"}
+
+    assert client.get("/items/1/preview", headers=alice).status_code == 200
+    assert client.get("/items/2/preview", headers=alice).status_code == 429
+    # Інший користувач з тієї ж IP має власний ліміт
+    assert client.get("/items/1/preview", headers=bob).status_code == 200
+
+
+def test_token_bucket_refills(backend):
+    key = f"refill-{type(backend).__name__}"
+    assert backend.take(key, capacity=2, refill_per_second=1, now=1000.0) == 0
+    assert backend.take(key, capacity=2, refill_per_second=1, now=1000.0) == 0
+    assert backend.take(key, capacity=2, refill_per_second=1, now=1000.5) == pytest.approx(0.5)
+    assert backend.take(key, capacity=2, refill_per_second=1, now=1001.0) == 0
+
+
+def test_new_bucket_keeps_buckets_of_longer_windows():
+    clear_buckets()
+    backend = DatabaseRateLimitBackend()
+    # Бакет з вікном на годину ще не відновився через 2 хвилини
+    assert backend.take("POST /register|ip|1", capacity=2, refill_per_second=2 / 3600, now=1_790_000_000.0) == 0
+    assert backend.take("POST /register|ip|1", capacity=2, refill_per_second=2 / 3600, now=1_790_000_000.0) == 0
+    # Створення бакета з хвилинним вікном не видаляє його
+    assert backend.take("POST /login|ip|1", capacity=5, refill_per_second=5 / 60, now=1_790_000_120.0) == 0
+    assert backend.take("POST /register|ip|1", capacity=2, refill_per_second=2 / 3600, now=1_790_000_120.0) > 0
+    clear_buckets()
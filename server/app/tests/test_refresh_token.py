@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from app.database.database import SessionLocal
+from app.main import app
+from app.model import RefreshToken
+from app.user_manager.token_controller import hash_refresh_token, remove_stale_refresh_tokens
+
+client = TestClient(app)
+
+
+def login() -> dict:
+    response = client.post("/login_with_email", data={"email": "charlie@example.com", "password": "pass"})
+    assert response.status_code == 200, f"Error obtaining token: {response.json()}"
+    return response.json()["data"]
+
+
+def test_refresh_token_is_stored_hashed_and_rotated():
+    tokens = login()
+    assert tokens["refresh_token"]
+
+    db = SessionLocal()
+    try:
+        stored = db.query(RefreshToken).filter(
+            RefreshToken.token_hash == hash_refresh_token(tokens["refresh_token"])).first()
+        assert stored is not None
+        # Сам токен у базі не зберігається
+        assert db.query(RefreshToken).filter(RefreshToken.token_hash == tokens["refresh_token"]).first() is None
+    finally:
+        db.close()
+
+    response = client.post("/token/refresh", data={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    refreshed = response.json()["data"]
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+
+    # Новий access token працює
+    headers = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert client.get("/profile", headers=headers).status_code == 200
+
+
+def test_reused_refresh_token_revokes_the_family():
+    tokens = login()
+    rotated = client.post("/token/refresh", data={"refresh_token": tokens["refresh_token"]}).json()["data"]
+
+    # Повторне використання старого токена відкликає всю сім'ю
+    reused = client.post("/token/refresh", data={"refresh_token": tokens["refresh_token"]})
+    assert reused.status_code == 401
+    assert client.post("/token/refresh", data={"refresh_token": rotated["refresh_token"]}).status_code == 401
+
+
+def test_revoked_refresh_token_cannot_be_used():
+    tokens = login()
+
+    assert client.post("/token/revoke", data={"refresh_token": tokens["refresh_token"]}).status_code == 200
+    assert client.post("/token/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert client.post("/token/refresh", data={"refresh_token": "unknown"}).status_code == 401
+
+
+def test_stale_refresh_tokens_are_removed():
+    active = login()
+    rotated = client.post("/token/refresh", data={"refresh_token": active["refresh_token"]}).json()["data"]
+    logged_out = login()
+    assert client.post("/token/revoke", data={"refresh_token": logged_out["refresh_token"]}).status_code == 200
+    expired = login()
+
+    db = SessionLocal()
+    try:
+        db.query(RefreshToken).filter(
+            RefreshToken.token_hash == hash_refresh_token(expired["refresh_token"])
+        ).update({RefreshToken.expires_at: datetime.utcnow() - timedelta(days=1)})
+        db.commit()
+
+        assert remove_stale_refresh_tokens(db) >= 2
+        remaining = {token_hash for (token_hash,) in db.query(RefreshToken.token_hash)}
+    finally:
+        db.close()
+    assert hash_refresh_token(expired["refresh_token"]) not in remaining
+    assert hash_refresh_token(logged_out["refresh_token"]) not in remaining
+    # Відкликаний токен активної сім'ї лишається, щоб його повторне використання відкликало сім'ю
+    assert hash_refresh_token(active["refresh_token"]) in remaining
+    assert hash_refresh_token(rotated["refresh_token"]) in remaining
@@ -0,0 +1,86 @@
+import gzip
+import io
+import json
+import uuid
+import brotli
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.tests.conftest import make_image
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def wardrobe(auth_token):
+    items = []
+    files = []
+    for i in range(12):
+        files.append(("files", (f"{i}.jpg", io.BytesIO(make_image((i * 20, 10, 10), size=16)), "image/jpeg")))
+        items.append({"uuid": str(uuid.uuid4()), "name": f"Item {i}", "category": "tshirt", "season": "summer",
+                      "material": "Cotton", "file_index": i})
+    response = client.post("/synchronize/changes", data={"changes": json.dumps({
+        "clothing_items": items,
+        "clothing_combinations": [{"uuid": str(uuid.uuid4()), "name": "Combo", "item_uuids": [items[0]["uuid"]]}],
+    })}, files=files, headers=auth_token)
+    assert response.status_code == 200, response.text
+    return auth_token
+
+
+def get_raw(path, headers):
+    # Без автоматичного розпакування, щоб перевірити стиснене тіло
+    with client.stream("GET", path, headers=headers) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_json_is_compressed_when_accepted(wardrobe):
+    plain = client.get("/clothing-items", headers={**wardrobe, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+
+    response, body = get_raw("/clothing-items", {**wardrobe, "Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == plain.json()
+
+    response, body = get_raw("/clothing-items", {**wardrobe, "Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert json.loads(brotli.decompress(body)) == plain.json()
+    assert len(body) < len(plain.content)
+
+
+def test_msgpack_columnar_items(wardrobe):
+    rows = client.get("/clothing-items", headers=wardrobe).json()["data"]
+    response = client.get("/clothing-items?layout=columnar",
+                          headers={**wardrobe, "Accept": "application/msgpack"})
+    assert response.headers["Content-Type"] == "application/msgpack"
+    data = msgpack.unpackb(response.content)["data"]
+
+    assert data["count"] == len(rows) == 12
+    columns = data["columns"]
+    assert columns["name"] == [row["name"] for row in rows.values()]
+    # URL надсилається один раз як префікс
+    urls = [data["files"]["url_prefix"] + filename for filename in columns["filename"]]
+    assert urls == [row["filename"] for row in rows.values()]
+    assert "url" not in columns
+
+
+def test_sync_endpoints_support_columnar_layout(wardrobe):
+    changes = client.post("/synchronize/changes?layout=columnar", data={"changes": "{}"}, headers=wardrobe).json()
+    assert changes["data"]["items"]["count"] == 12
+    assert changes["data"]["combinations"]["count"] == 1
+
+    full = client.post("/synchronize?layout=columnar", data={"clothing_items": "[]", "clothing_combinations": "[]"},
+                       headers={**wardrobe, "Accept": "application/x-msgpack"})
+    data = msgpack.unpackb(full.content)["data"]
+    assert data["items"]["count"] == 12
+    assert data["combinations"]["columns"]["items"] == [[data["items"]["columns"]["id"][0]]]
+
+    combos = client.get("/clothing-combinations?layout=columnar", headers=wardrobe).json()["data"]
+    assert combos["combinations"]["columns"]["item_ids"] == [[combos["items"]["columns"]["id"][0]]]
+    assert combos["items"]["count"] == 1
+
+
+def test_etag_depends_on_representation(wardrobe):
+    etag = client.get("/clothing-items", headers=wardrobe).headers["ETag"]
+    response = client.get("/clothing-items", headers={**wardrobe, "Accept": "application/msgpack", "If-None-Match": etag})
+    assert response.status_code == 200
@@ -0,0 +1,52 @@
+from sqlalchemy import create_engine, inspect, text
+from app.database.query_plans import COMPOSITE_INDEXES, create_legacy_schema
+from app.database.schema_upgrade import upgrade_schema
+
+
+def make_legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    create_legacy_schema(engine)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, email, password) VALUES (1, 'legacy@example.com', 'x')"))
+        connection.execute(text("INSERT INTO clothing_combinations (id, uuid, name, owner_id) VALUES (1, 'c1', 'Combo', 1)"))
+        for item_id in (1, 2):
+            connection.execute(text(
+                "INSERT INTO clothing_items (id, uuid, owner_id, name, filename, category, season, material, is_favorite) "
+                f"VALUES ({item_id}, 'i{item_id}', 1, 'Item', '{item_id}.jpg', 'tshirt', 'summer', 'Cotton', 0)"))
+        # Без первинного ключа зв'язки могли дублюватися
+        connection.execute(text(
+            "INSERT INTO clothing_combination_items (combination_id, item_id) VALUES (1, 1), (1, 1), (1, 2)"))
+    return engine
+
+
+def test_upgrade_adds_primary_key_and_composite_indexes(tmp_path):
+    engine = make_legacy_engine(tmp_path)
+    assert inspect(engine).get_pk_constraint("clothing_combination_items")["constrained_columns"] == []
+
+    upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint("clothing_combination_items")["constrained_columns"] == ["combination_id", "item_id"]
+    indexes = {index["name"] for table in ("clothing_items", "clothing_combinations", "clothing_combination_items")
+               for index in inspector.get_indexes(table)}
+    assert set(COMPOSITE_INDEXES) <= indexes
+    with engine.connect() as connection:
+        links = connection.execute(text(
+            "SELECT combination_id, item_id FROM clothing_combination_items ORDER BY item_id")).all()
+    assert [tuple(link) for link in links] == [(1, 1), (1, 2)]
+    engine.dispose()
+
+
+def test_upgrade_keeps_existing_unique_index_on_email(tmp_path):
+    engine = make_legacy_engine(tmp_path)
+    # Схема до явного індексу: унікальне обмеження на email під іншою назвою
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_users_email"))
+        connection.execute(text("CREATE UNIQUE INDEX email ON users (email)"))
+
+    upgrade_schema(engine)
+
+    email_indexes = [index for index in inspect(engine).get_indexes("users") if index["column_names"] == ["email"]]
+    assert [(index["name"], index["unique"]) for index in email_indexes] == [("email", 1)]
+    engine.dispose()
+
@@ -0,0 +1,170 @@
+import io
+import pytest
+from fastapi.testclient import TestClient
+from app.constants import IMAGE_VARIANTS
+from app.main import app
+from app.model import ClothingItem
+from app.storage_manager.migrate import migrate_storage
+from app.storage_manager.storage_backends import LocalStorageBackend, S3StorageBackend
+from app.tests.conftest import make_image
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def s3_backend():
+    # Локальний S3-сумісний сервер замість MinIO
+    boto3 = pytest.importorskip("boto3")
+    moto_server = pytest.importorskip("moto.server")
+
+    server = moto_server.ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+    boto3.client(
+        "s3", endpoint_url=endpoint_url, region_name="us-east-1",
+        aws_access_key_id="test", aws_secret_access_key="test",
+    ).create_bucket(Bucket="test-bucket")
+
+    yield S3StorageBackend(
+        bucket="test-bucket",
+        endpoint_url=endpoint_url,
+        access_key_id="test",
+        secret_access_key="test",
+    )
+    server.stop()
+
+
+def check_backend_roundtrip(storage):
+    content = b"image bytes" * 10_000
+    storage.write_stream("ab/cd/file.jpg", io.BytesIO(content))
+
+    assert storage.exists("ab/cd/file.jpg")
+    assert not storage.exists("ab/cd/missing.jpg")
+    assert storage.read_bytes("ab/cd/file.jpg") == content
+    assert [(obj.key, obj.size) for obj in storage.list_objects("ab/")] == [("ab/cd/file.jpg", len(content))]
+    assert "ab/cd/file.jpg" in storage.get_url("ab/cd/file.jpg")
+
+    storage.delete("ab/cd/file.jpg")
+    assert not storage.exists("ab/cd/file.jpg")
+
+
+def test_local_backend(tmp_path):
+    check_backend_roundtrip(LocalStorageBackend(root=str(tmp_path), base_url="http://testserver/uploads"))
+
+
+def test_s3_backend(s3_backend):
+    check_backend_roundtrip(s3_backend)
+    # Presigned URL lets clients fetch the file directly from the bucket
+    assert "Signature" in s3_backend.get_url("any.jpg") or "X-Amz-Signature" in s3_backend.get_url("any.jpg")
+
+
+def test_migrate_local_to_s3(tmp_path, s3_backend):
+    local = LocalStorageBackend(root=str(tmp_path), base_url="http://testserver/uploads")
+    local.write_stream("1.jpg", io.BytesIO(b"first"))
+    local.write_stream("ab/cd/abcd.jpg", io.BytesIO(b"second"))
+
+    result = migrate_storage(local, s3_backend)
+    assert result == {"copied": 2, "skipped": 0, "copied_bytes": 11}
+    assert s3_backend.read_bytes("ab/cd/abcd.jpg") == b"second"
+
+    # Repeated migration skips files that are already in the target
+    assert migrate_storage(local, s3_backend)["skipped"] == 2
+
+
+def test_garbage_collector_keeps_referenced_files(tmp_path):
+    import os
+    import time
+    from app.database.database import SessionLocal
+    from app.storage_manager.garbage_collector import collect_garbage
+
+    db = SessionLocal()
+    referenced = db.query(ClothingItem).first().filename
+    base = os.path.splitext(referenced)[0]
+    storage = LocalStorageBackend(root=str(tmp_path), base_url="http://testserver/uploads")
+    storage.write_stream(referenced, io.BytesIO(b"referenced"))
+    storage.write_stream(f"{base}_thumb.webp", io.BytesIO(b"variant"))
+    storage.write_stream("ff/ff/orphan.jpg", io.BytesIO(b"orphan"))
+    storage.write_stream("ff/ff/orphan_thumb.webp", io.BytesIO(b"orphan variant"))
+
+    # Нові файли захищені пільговим періодом
+    assert collect_garbage(db, storage, grace_seconds=3600).deleted_files == 0
+
+    old = time.time() - 7200
+    for stored_object in storage.list_objects():
+        os.utime(os.path.join(str(tmp_path), stored_object.key), (old, old))
+
+    report = collect_garbage(db, storage, grace_seconds=3600)
+    db.close()
+
+    assert sorted(report.deleted_keys) == ["ff/ff/orphan.jpg", "ff/ff/orphan_thumb.webp"]
+    assert report.reclaimed_bytes == len(b"orphan") + len(b"orphan variant")
+    assert storage.exists(referenced)
+    assert storage.exists(f"{base}_thumb.webp")
+
+
+def test_leased_blob_survives_release_and_garbage_collection(tmp_path, monkeypatch):
+    import os
+    import time
+    import uuid
+    from app.database.database import SessionLocal
+    from app.storage_manager import blob_store
+    from app.storage_manager.blob_store import lease_blob, release_blobs
+    from app.storage_manager.garbage_collector import collect_garbage
+
+    storage = LocalStorageBackend(root=str(tmp_path), base_url="http://testserver/uploads")
+    monkeypatch.setattr(blob_store, "get_storage", lambda: storage)
+    filename = f"aa/bb/{uuid.uuid4().hex}.jpg"
+    storage.write_stream(filename, io.BytesIO(b"shared"))
+    storage.write_stream(filename.replace(".jpg", "_thumb.webp"), io.BytesIO(b"variant"))
+    old = time.time() - 7200
+    for stored_object in storage.list_objects():
+        os.utime(os.path.join(str(tmp_path), stored_object.key), (old, old))
+
+    # Завантаження повторно використало файл, а його речі ще не збережені
+    lease_blob(filename)
+    with SessionLocal() as db:
+        assert release_blobs(db, [filename]) == []
+        assert collect_garbage(db, storage, grace_seconds=3600).deleted_files == 0
+    assert storage.exists(filename)
+
+
+def test_items_advertise_only_stored_variants(auth_token):
+    form = {"name": "Shirt", "category": "tshirt", "season": "summer", "material": "Cotton"}
+    response = client.post("/add-clothing-item", data=form, headers=auth_token,
+                           files={"file": ("shirt.jpg", make_image((30, 140, 90)), "image/jpeg")})
+    assert response.status_code == 200, response.text
+    assert set(response.json()["data"]["variants"]) == set(IMAGE_VARIANTS)
+
+    # Файл, який не вдалося декодувати, зберігається без варіантів, тож їх URL не видаються
+    response = client.post("/add-clothing-item", data={**form, "red": 1, "green": 2, "blue": 3}, headers=auth_token,
+                           files={"file": ("broken.jpg", b"not an image at all", "image/jpeg")})
+    assert response.status_code == 200, response.text
+    assert response.json()["data"]["variants"] == {}
+
+
+def test_backfill_records_variants_of_old_items():
+    import uuid
+    from app.database.database import SessionLocal
+    from app.storage_manager import get_storage, get_variant_filename
+    from app.storage_manager.backfill_variants import backfill_image_variants
+
+    filename = f"cc/dd/{uuid.uuid4().hex}.jpg"
+    get_storage().write_stream(filename, io.BytesIO(make_image((200, 40, 40))))
+    with SessionLocal() as db:
+        owner_id = db.query(ClothingItem).first().owner_id
+        # Річ, збережена до того, як варіанти почали записуватися
+        item = ClothingItem(filename=filename, name="Old", category="tshirt", season="summer",
+                            material="Cotton", owner_id=owner_id)
+        db.add(item)
+        db.commit()
+
+        assert backfill_image_variants(db) >= 1
+        db.refresh(item)
+        variants = item.image_variants.split(",")
+        assert {key.split(".")[0] for key in variants} == set(IMAGE_VARIANTS)
+        for key in variants:
+            variant, image_format = key.split(".")
+            assert get_storage().exists(get_variant_filename(filename, variant, image_format))
+        db.delete(item)
+        db.commit()
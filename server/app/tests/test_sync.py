@@ -126,7 +126,7 @@ def test_sync_data_with_files(db_session: Session, auth_token):
     user_id = user.id
 
     # Перевіряємо, що збережено 1 річ і 1 комбінацію
-    items = db_session.query(ClothingItem).filter_by(owner_id=user_id).all()
+    items = db_session.query(ClothingItem).filter_by(owner_id=user_id).order_by(ClothingItem.id).all()
     combos = db_session.query(ClothingCombination).filter_by(owner_id=user_id).all()
 
     
@@ -142,11 +142,49 @@ def test_sync_data_with_files(db_session: Session, auth_token):
     # Перевірка, що файл існує на сервері
     saved_filename = items[0].filename  
 
-    # Витягуємо лише ім’я файлу
+    # Файли зберігаються у підкаталогах за хешем вмісту
     import os
     from urllib.parse import urlparse
 
-    filename_only = os.path.basename(urlparse(saved_filename).path)
-    local_path = os.path.join("uploads_tests", filename_only)
-
-    assert os.path.exists(local_path), f"File {local_path} not found on server"
\ No newline at end of file
+    relative_path = urlparse(saved_filename).path
+    local_path = os.path.join("uploads_tests", relative_path)
+
+    assert os.path.exists(local_path), f"File {local_path} not found on server"
+
+def test_sync_query_count_does_not_grow_with_wardrobe():
+    import uuid
+    from fastapi import UploadFile
+    from sqlalchemy import event
+    from app.user_manager.user_controller import create_access_token, hash_password, synchronize_user_data
+
+    def run_sync(count: int) -> int:
+        email = f"bulk-{uuid.uuid4().hex[:8]}@example.com"
+        with SessionLocal() as db:
+            db.add(User(email=email, password=hash_password("pass"), is_email_verified=True))
+            db.commit()
+        token = create_access_token({"sub": email})
+        items = [{"id": i, "name": f"Item {i}", "category": "tshirt", "season": "summer",
+                  "material": "Cotton", "purchase_date": "2024-01-01"} for i in range(count)]
+        combos = [{"id": i, "name": f"Combo {i}", "item_ids": [i]} for i in range(count)]
+        files = [UploadFile(file=io.BytesIO(f"image {email} {i}".encode()), filename=f"{i}.jpg") for i in range(count)]
+
+        statements = []
+        def count_statement(*args):
+            statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            with SessionLocal() as db:
+                response = synchronize_user_data(token, json.dumps(items), json.dumps(combos), db, files)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        assert response.status_code == 200
+
+        with SessionLocal() as db:
+            user = db.query(User).filter_by(email=email).one()
+            assert db.query(ClothingItem).filter_by(owner_id=user.id).count() == count
+            combo = db.query(ClothingCombination).filter_by(owner_id=user.id, name="Combo 1").one()
+            assert [item.name for item in combo.items] == ["Item 1"]
+        return len(statements)
+
+    # Кількість запитів не залежить від кількості речей
+    assert run_sync(2) == run_sync(10)
@@ -0,0 +1,88 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.ttl_store import DatabaseTTLStore, MemoryTTLStore
+from app.user_manager.user_controller import create_password_reset_token
+
+client = TestClient(app)
+
+
+@pytest.fixture(params=["memory", "database"])
+def store(request):
+    return MemoryTTLStore(max_entries=3) if request.param == "memory" else DatabaseTTLStore()
+
+
+def test_ttl_store_set_get_pop(store):
+    store.set("code:1", "123456", ttl_seconds=60)
+
+    assert store.get("code:1") == "123456"
+    assert store.pop("code:1") == "123456"
+    # Значення можна забрати лише один раз
+    assert store.pop("code:1") is None
+    assert store.get("code:1") is None
+
+
+def test_ttl_store_expires_entries(store):
+    store.set("code:2", "654321", ttl_seconds=1)
+    time.sleep(1.1)
+
+    assert store.get("code:2") is None
+    assert store.pop("code:2") is None
+
+
+def test_ttl_store_removes_expired_entries(store):
+    store.set("code:3", "111111", ttl_seconds=1)
+    store.set("code:4", "222222", ttl_seconds=60)
+    time.sleep(1.1)
+
+    assert store.remove_expired() >= 1
+    assert store.get("code:4") == "222222"
+    store.delete("code:4")
+
+
+def test_database_store_concurrent_sets_of_one_key():
+    store = DatabaseTTLStore()
+    errors = []
+
+    def set_value(value):
+        try:
+            store.set("lease:same-photo", value, ttl_seconds=60)
+        except Exception as e:
+            errors.append(e)
+
+    # Два користувачі одночасно завантажують одне фото
+    threads = [threading.Thread(target=set_value, args=(str(i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.get("lease:same-photo") in {str(i) for i in range(8)}
+    store.delete("lease:same-photo")
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryTTLStore(max_entries=2)
+    store.set("a", "1", 60)
+    store.set("b", "2", 60)
+    store.get("a")
+    store.set("c", "3", 60)
+
+    assert store.get("b") is None
+    assert store.get("a") == "1" and store.get("c") == "3"
+
+
+def test_password_reset_token_is_one_time():
+    token = create_password_reset_token("bob@example.com")
+    data = {"new_password": "pass", "confirm_password": "pass"}
+
+    assert client.get("/change-password-form", params={"token": token}).status_code == 200
+    first = client.put("/change-password-form", params={"token": token}, data=data, follow_redirects=False)
+    assert first.status_code == 303
+
+    second = client.put("/change-password-form", params={"token": token}, data=data, follow_redirects=False)
+    assert second.status_code == 400
+    assert client.get("/change-password-form", params={"token": token}).status_code == 400
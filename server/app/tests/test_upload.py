@@ -0,0 +1,97 @@
+import hashlib
+import io
+import os
+import pytest
+from fastapi import HTTPException
+from app.storage_manager.storage_backends import LocalStorageBackend
+from app.storage_manager.upload_controller import get_file_extension, publish_staged_file, stream_to_temp_file
+
+
+def test_stream_to_temp_file_hashes_and_publishes(tmp_path):
+    content = b"x" * 200_000
+    staged = stream_to_temp_file(io.BytesIO(content), directory=str(tmp_path), max_bytes=1_000_000)
+
+    assert staged.size == len(content)
+    assert staged.sha256 == hashlib.sha256(content).hexdigest()
+
+    filename = publish_staged_file(staged, "item.jpg", LocalStorageBackend(root=str(tmp_path)))
+    assert os.listdir(tmp_path) == [filename]
+    assert (tmp_path / filename).read_bytes() == content
+
+
+def test_stream_to_temp_file_aborts_on_size_limit(tmp_path):
+    content = b"x" * 200_000
+
+    with pytest.raises(HTTPException) as exc_info:
+        stream_to_temp_file(io.BytesIO(content), directory=str(tmp_path), max_bytes=100_000)
+
+    assert exc_info.value.status_code == 400
+    # Temporary file must be removed after the abort
+    assert os.listdir(tmp_path) == []
+
+
+def test_identical_uploads_are_deduplicated():
+    from app.constants import UPLOAD_DIR
+    from app.storage_manager.blob_store import commit_staged_blob
+
+    content = b"same garment photo bytes"
+    first = commit_staged_blob(stream_to_temp_file(io.BytesIO(content), extension="jpg"))
+    second = commit_staged_blob(stream_to_temp_file(io.BytesIO(content), extension="jpg"))
+
+    assert first.filename == second.filename
+    assert first.filename.startswith(f"{first.sha256[:2]}/{first.sha256[2:4]}/")
+    assert second.is_new is False
+    assert os.path.exists(os.path.join(UPLOAD_DIR, first.filename))
+    # Staged copy of the duplicate must not be left behind
+    shard_dir = os.path.dirname(os.path.join(UPLOAD_DIR, first.filename))
+    assert not [name for name in os.listdir(UPLOAD_DIR) if name.endswith(".part")]
+    assert os.listdir(shard_dir) == [os.path.basename(first.filename)]
+
+
+def test_decode_image_applies_exif_orientation(tmp_path):
+    from PIL import Image
+    from app.close_manager.image_ingestion import decode_image
+
+    path = tmp_path / "rotated.jpg"
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90° CW
+    Image.new("RGB", (40, 20), (200, 30, 30)).save(path, format="JPEG", exif=exif)
+
+    assert decode_image(str(path)).size == (20, 40)
+
+
+def test_decode_image_rejects_decompression_bombs(tmp_path, monkeypatch):
+    from PIL import Image
+    from app.close_manager import image_ingestion
+
+    path = tmp_path / "huge.png"
+    Image.new("RGB", (200, 200)).save(path, format="PNG")
+    monkeypatch.setattr(image_ingestion, "MAX_IMAGE_PIXELS", 100 * 100)
+
+    with pytest.raises(HTTPException) as exc_info:
+        image_ingestion.decode_image(str(path))
+
+    assert exc_info.value.status_code == 400
+
+
+def test_file_extension_is_sanitized():
+    assert get_file_extension("photo.JPEG") == "jpeg"
+    # Розширення потрапляє в ключ сховища, тож шляхи та довгі хвости відкидаються
+    assert get_file_extension("photo.jpg/../../etc") == "jpg"
+    assert get_file_extension("photo..") == "jpg"
+    assert get_file_extension("photo.verylongext") == "jpg"
+
+
+def test_blob_extension_follows_the_detected_format():
+    from starlette.datastructures import UploadFile
+    from app.close_manager.image_ingestion import ingest_image
+    from app.tests.conftest import make_image
+
+    content = make_image((10, 120, 200))
+    as_jpeg = ingest_image(UploadFile(io.BytesIO(content), filename="shirt.jpeg"))
+    as_png = ingest_image(UploadFile(io.BytesIO(content), filename="shirt.png"))
+
+    # Однакові байти з різними розширеннями клієнта стають одним блобом
+    assert as_jpeg.blob.filename == as_png.blob.filename
+    assert as_jpeg.blob.filename.endswith(".jpg")
+    assert as_png.blob.is_new is False
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database.database import SessionLocal
+from app.model import ClothingItem
+from app.tests.conftest import create_test_user, make_image
+from app.user_manager.upload_session_controller import lock_part_file
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def session_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.user_manager.upload_session_controller.UPLOAD_SESSION_DIR", str(tmp_path))
+    return tmp_path
+
+
+def create_session(headers, *contents):
+    response = client.post("/synchronize/uploads", json={"files": [
+        {"size": len(content), "sha256": hashlib.sha256(content).hexdigest(), "filename": f"{i}.jpg"}
+        for i, content in enumerate(contents)
+    ]}, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["data"]["upload_id"]
+
+
+def put_chunk(headers, upload_id, file_index, offset, chunk, **extra_headers):
+    return client.put(f"/synchronize/uploads/{upload_id}/files/{file_index}", content=chunk,
+                      headers={**headers, "Upload-Offset": str(offset), **extra_headers})
+
+
+def test_resumable_upload_and_finalize(auth_token, session_dir):
+    shirt, pants = make_image((200, 10, 10)), make_image((10, 10, 200))
+    upload_id = create_session(auth_token, shirt, pants)
+
+    half = len(shirt) // 2
+    response = put_chunk(auth_token, upload_id, 0, 0, shirt[:half])
+    assert response.status_code == 200
+    assert response.headers["Upload-Offset"] == str(half)
+
+    # Повтор вже підтвердженого фрагмента відхиляється з правильним зсувом
+    response = put_chunk(auth_token, upload_id, 0, 0, shirt[:half])
+    assert response.status_code == 409
+    assert response.json()["detail"]["offset"] == half
+
+    # Після обриву клієнт дізнається, звідки продовжувати
+    files = client.get(f"/synchronize/uploads/{upload_id}", headers=auth_token).json()["data"]["files"]
+    assert [file["offset"] for file in files] == [half, 0]
+
+    response = client.post(f"/synchronize/uploads/{upload_id}/finalize", data={"changes": "{}"}, headers=auth_token)
+    assert response.status_code == 409
+
+    assert put_chunk(auth_token, upload_id, 0, half, shirt[half:]).json()["data"]["complete"] is True
+    checksum = hashlib.sha256(pants).hexdigest()
+    assert put_chunk(auth_token, upload_id, 1, 0, pants, **{"Upload-Checksum": checksum}).json()["data"]["complete"] is True
+
+    shirt_uuid, pants_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+    response = client.post(f"/synchronize/uploads/{upload_id}/finalize", data={"changes": json.dumps({
+        "clothing_items": [
+            {"uuid": shirt_uuid, "name": "Shirt", "category": "tshirt", "season": "summer",
+             "material": "Cotton", "file_index": 0},
+            {"uuid": pants_uuid, "name": "Pants", "category": "pants", "season": "summer",
+             "material": "Denim", "file_index": 1},
+        ]
+    })}, headers=auth_token)
+    assert response.status_code == 200, response.text
+    assert {item["uuid"] for item in response.json()["data"]["items"]} == {shirt_uuid, pants_uuid}
+
+    with SessionLocal() as db:
+        items = db.query(ClothingItem).filter(ClothingItem.uuid.in_([shirt_uuid, pants_uuid])).all()
+        assert {item.content_hash for item in items} == {
+            hashlib.sha256(shirt).hexdigest(), hashlib.sha256(pants).hexdigest()}
+
+    # Сесія та її файли видалені
+    assert client.get(f"/synchronize/uploads/{upload_id}", headers=auth_token).status_code == 404
+    assert not os.path.exists(session_dir / upload_id)
+
+
+def test_invalid_chunks_are_not_stored(auth_token):
+    content = make_image((10, 200, 10))
+    upload_id = create_session(auth_token, content)
+
+    response = put_chunk(auth_token, upload_id, 0, 0, content[:100], **{"Upload-Checksum": "0" * 64})
+    assert response.status_code == 400
+    response = put_chunk(auth_token, upload_id, 0, 0, content + b"extra")
+    assert response.status_code == 400
+    assert client.get(f"/synchronize/uploads/{upload_id}", headers=auth_token).json()["data"]["files"][0]["offset"] == 0
+
+    # Пошкоджений файл завантажується знову з початку
+    corrupted = bytes([content[0] ^ 0xFF]) + content[1:]
+    response = put_chunk(auth_token, upload_id, 0, 0, corrupted)
+    assert response.status_code == 400
+    assert response.json()["detail"]["offset"] == 0
+    assert put_chunk(auth_token, upload_id, 0, 0, content).json()["data"]["complete"] is True
+
+
+def test_concurrent_chunk_at_the_same_offset_is_rejected(auth_token):
+    content = make_image((200, 200, 10))
+    upload_id = create_session(auth_token, content)
+
+    # Інший запит ще пише цей файл
+    lock = lock_part_file(upload_id, 0)
+    try:
+        assert lock_part_file(upload_id, 0) is None
+        response = put_chunk(auth_token, upload_id, 0, 0, content)
+        assert response.status_code == 409
+        assert response.json()["detail"]["offset"] == 0
+    finally:
+        lock.close()
+    assert put_chunk(auth_token, upload_id, 0, 0, content).json()["data"]["complete"] is True
+
+
+def test_upload_session_belongs_to_its_owner(auth_token):
+    upload_id = create_session(auth_token, b"content")
+    _, other_token = create_test_user("upload")
+    assert client.get(f"/synchronize/uploads/{upload_id}", headers=other_token).status_code == 404
+    assert put_chunk(other_token, upload_id, 0, 0, b"content").status_code == 404
+
+    assert client.delete(f"/synchronize/uploads/{upload_id}", headers=auth_token).status_code == 200
+    assert client.get(f"/synchronize/uploads/{upload_id}", headers=auth_token).status_code == 404
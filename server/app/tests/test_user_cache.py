@@ -0,0 +1,70 @@
+from datetime import datetime
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database.database import engine
+from app.main import app
+from app.user_manager.user_cache import CachedUser, UserCache, user_cache
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def users_queries():
+    """Collects the SELECT statements on the users table."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM users" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_current_user_is_loaded_once_and_cached(auth_token, users_queries):
+    user_cache.clear()
+
+    first = client.put("/clothing-combinations/999999", json={"name": "x", "item_ids": []}, headers=auth_token)
+    assert first.status_code == 404
+    assert len(users_queries) == 1
+
+    # Другий запит бере користувача з кешу
+    second = client.put("/clothing-combinations/999999", json={"name": "x", "item_ids": []}, headers=auth_token)
+    assert second.status_code == 404
+    assert len(users_queries) == 1
+
+
+def test_invalid_token_is_rejected():
+    response = client.put("/clothing-combinations/1", json={"name": "x", "item_ids": []},
+                          headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
+
+
+def test_stats_use_the_cached_user(auth_token, users_queries):
+    user_cache.clear()
+
+    client.get("/stats/category", headers=auth_token)
+    client.get("/stats/category", headers=auth_token)
+
+    # Користувач завантажується лише при першому запиті
+    assert len(users_queries) == 1
+    assert client.get("/stats/category", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
+
+
+def test_user_cache_expires_and_updates_synchronized_at():
+    cache = UserCache(ttl_seconds=60)
+    user = CachedUser(id=1, email="a@b.com", is_email_verified=True, synchronized_at=None)
+    cache.set(user)
+
+    synchronized_at = datetime(2024, 1, 1, 12, 0)
+    cache.update_synchronized_at("a@b.com", synchronized_at)
+    assert cache.get("a@b.com").synchronized_at_iso == "2024-01-01T12:00:00"
+
+    cache.invalidate("a@b.com")
+    assert cache.get("a@b.com") is None
+
+    expired = UserCache(ttl_seconds=0)
+    expired.set(user)
+    assert expired.get("a@b.com") is None
@@ -0,0 +1,191 @@
+"""
+Small key-value store for short-lived values such as verification codes and
+one-time password reset tokens.
+
+The "memory" backend is a bounded LRU in the current process. The "database"
+backend keeps the entries in the `ttl_entries` table, so every worker process
+sees the same values without an external service.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.constants import TTL_STORE_BACKEND, TTL_STORE_MAX_ENTRIES
+
+
+class TTLStore(ABC):
+    """Key-value store whose entries disappear after their time to live."""
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl_seconds: int):
+        """Stores a value, replacing an existing one."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Returns the value or None if it is missing or expired."""
+
+    @abstractmethod
+    def pop(self, key: str) -> Optional[str]:
+        """
+        Removes and returns the value.
+
+        Of concurrent calls for the same key only one gets the value, so values
+        that must be used once can be consumed with it.
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def remove_expired(self) -> int:
+        """Deletes expired entries and returns how many there were."""
+
+
+class MemoryTTLStore(TTLStore):
+    """In-process store; the least recently used entries are dropped above `max_entries`."""
+
+    def __init__(self, max_entries: int = TTL_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _get_live(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            return self._get_live(key)
+
+    def pop(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self._get_live(key)
+            if value is not None:
+                del self.entries[key]
+            return value
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def remove_expired(self) -> int:
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]
+            for key in expired:
+                del self.entries[key]
+        return len(expired)
+
+
+class DatabaseTTLStore(TTLStore):
+    """Store in the `ttl_entries` table of the application database."""
+
+    def __init__(self, session_factory=None):
+        if session_factory is None:
+            from app.database.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+
+    @staticmethod
+    def _now() -> datetime:
+        # DATETIME columns are stored without time zone
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def set(self, key: str, value: str, ttl_seconds: int):
+        from app.model import TTLEntry
+        values = {"key": key, "value": value, "expires_at": self._now() + timedelta(seconds=ttl_seconds)}
+        with self.session_factory() as db:
+            # One upsert statement, so concurrent sets of a key don't collide on the primary key
+            if db.get_bind().dialect.name == "mysql":
+                statement = mysql_insert(TTLEntry).values(**values)
+                statement = statement.on_duplicate_key_update(
+                    value=statement.inserted.value, expires_at=statement.inserted.expires_at)
+            else:
+                statement = sqlite_insert(TTLEntry).values(**values)
+                statement = statement.on_conflict_do_update(index_elements=[TTLEntry.key], set_={
+                    "value": statement.excluded.value, "expires_at": statement.excluded.expires_at})
+            db.execute(statement)
+            db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        from app.model import TTLEntry
+        with self.session_factory() as db:
+            entry = db.query(TTLEntry.value).filter(
+                TTLEntry.key == key,
+                TTLEntry.expires_at > self._now()
+            ).first()
+            return entry.value if entry else None
+
+    def pop(self, key: str) -> Optional[str]:
+        from app.model import TTLEntry
+        with self.session_factory() as db:
+            entry = db.query(TTLEntry.value).filter(
+                TTLEntry.key == key,
+                TTLEntry.expires_at > self._now()
+            ).first()
+            if entry is None:
+                return None
+            # Only the request whose DELETE removed the row gets the value
+            deleted = db.query(TTLEntry).filter(TTLEntry.key == key).delete(synchronize_session=False)
+            db.commit()
+            return entry.value if deleted else None
+
+    def delete(self, key: str):
+        from app.model import TTLEntry
+        with self.session_factory() as db:
+            db.query(TTLEntry).filter(TTLEntry.key == key).delete(synchronize_session=False)
+            db.commit()
+
+    def remove_expired(self) -> int:
+        from app.model import TTLEntry
+        with self.session_factory() as db:
+            removed = db.query(TTLEntry).filter(
+                TTLEntry.expires_at <= self._now()
+            ).delete(synchronize_session=False)
+            db.commit()
+        if removed:
+            logging.info(f"🧹 Removed {removed} expired TTL store entries")
+        return removed
+
+
+TTL_STORE_BACKENDS = {
+    "memory": MemoryTTLStore,
+    "database": DatabaseTTLStore,
+}
+
+
+def create_ttl_store(name: str) -> TTLStore:
+    store_class = TTL_STORE_BACKENDS.get(name)
+    if store_class is None:
+        raise ValueError(f"❌ Unsupported TTL store backend: '{name}'")
+    logging.info(f"Using '{name}' TTL store backend")
+    return store_class()
+
+
+@lru_cache(maxsize=1)
+def get_ttl_store() -> TTLStore:
+    """Returns the store configured by TTL_STORE_BACKEND."""
+    return create_ttl_store(TTL_STORE_BACKEND)
@@ -1,2 +1,9 @@
 from .user_controller import *
-from .mail_controller import *
\ No newline at end of file
+from .user_cache import *
+from .token_controller import *
+from .mail_controller import *
+from .email_outbox import *
+from .sync_controller import *
+from .etag_controller import *
+from .upload_session_controller import *
+from .change_feed_controller import *
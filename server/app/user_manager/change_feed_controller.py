@@ -0,0 +1,110 @@
+"""
+Authentication of the `/changes` WebSocket.
+
+Connections stay open much longer than a request, so the credentials are
+kept for the whole connection: the socket is closed when the access token
+expires, and when a "user" update event arrives (password or email change)
+the token is checked against `users.tokens_revoked_at` again.
+
+Browsers can't send headers with a WebSocket handshake, so instead of the
+access token in the URL (where it would end up in access logs) they
+exchange it for a one-time ticket with a lifetime of
+CHANGE_FEED_TICKET_TTL_SECONDS.
+"""
+import json
+import secrets
+import time
+from dataclasses import dataclass
+from datetime import timezone
+
+import jwt
+from fastapi import HTTPException
+
+from app.constants import CHANGE_FEED_TICKET_TTL_SECONDS
+from app.model import User
+from app.ttl_store import get_ttl_store
+from .user_cache import CachedUser
+from .user_controller import ALGORITHM, SECRET_KEY, load_cached_user
+
+
+@dataclass
+class ChangeFeedCredentials:
+    user: CachedUser
+    issued_at: float  # Unix time the access token was issued
+    expires_at: float  # Unix time the access token expires
+
+
+def _get_session():
+    from app.database.database import SessionLocal
+    return SessionLocal()
+
+
+def _decode_access_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+
+def _load_credentials(email: str, issued_at: float, expires_at: float) -> ChangeFeedCredentials:
+    # A short-lived session: the connection stays open much longer than a request
+    with _get_session() as db:
+        credentials = ChangeFeedCredentials(load_cached_user(db, email), issued_at, expires_at)
+    if not is_change_feed_authorized(credentials):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return credentials
+
+
+def load_change_feed_credentials(token: str) -> ChangeFeedCredentials:
+    """
+    Checks an access token for a change feed connection.
+
+    :raises HTTPException: 401 if the token is invalid, revoked or its user doesn't exist.
+    """
+    payload = _decode_access_token(token)
+    # Tokens issued before `iat` was added count as issued when they are used
+    issued_at = float(payload.get("iat", time.time()))
+    return _load_credentials(payload["sub"], issued_at, float(payload["exp"]))
+
+
+def issue_change_feed_ticket(token: str) -> str:
+    """
+    Exchanges an access token for a one-time ticket to open the change feed.
+
+    :raises HTTPException: 401 if the token is invalid.
+    """
+    credentials = load_change_feed_credentials(token)
+    ticket = secrets.token_urlsafe(32)
+    get_ttl_store().set(f"change_feed_ticket:{ticket}", json.dumps({
+        "email": credentials.user.email,
+        "issued_at": credentials.issued_at,
+        "expires_at": credentials.expires_at,
+    }), CHANGE_FEED_TICKET_TTL_SECONDS)
+    return ticket
+
+
+def redeem_change_feed_ticket(ticket: str) -> ChangeFeedCredentials:
+    """
+    Returns the credentials of a ticket, which can't be used again.
+
+    :raises HTTPException: 401 if the ticket is unknown, used or expired.
+    """
+    value = get_ttl_store().pop(f"change_feed_ticket:{ticket}")
+    if value is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired ticket")
+    data = json.loads(value)
+    return _load_credentials(data["email"], data["issued_at"], data["expires_at"])
+
+
+def is_change_feed_authorized(credentials: ChangeFeedCredentials) -> bool:
+    """Checks that the user still exists under the same email and its tokens weren't revoked since."""
+    with _get_session() as db:
+        row = db.query(User.email, User.tokens_revoked_at).filter(User.id == credentials.user.id).first()
+    if row is None or row.email != credentials.user.email:
+        return False
+    if row.tokens_revoked_at is None:
+        return True
+    return row.tokens_revoked_at.replace(tzinfo=timezone.utc).timestamp() <= credentials.issued_at
@@ -0,0 +1,298 @@
+"""
+Outbox for outgoing emails.
+
+Request handlers only write the message to the `email_outbox` table and return.
+The background `EmailSender` claims due messages in batches, sends them over a
+small pool of SMTP connections that stay open between sends, and retries
+failures with exponential backoff. The bodies of sent messages are cleared
+right away, and sent or failed messages are deleted after
+EMAIL_RETENTION_SECONDS, since they contain codes and reset links.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+from sqlalchemy.orm import Session
+
+from app.constants import (
+    MAIL_USERNAME, MAIL_PASSWORD, MAIL_SERVER, MAIL_PORT, MAIL_STARTTLS,
+    EMAIL_SMTP_POOL_SIZE, EMAIL_BATCH_SIZE, EMAIL_POLL_INTERVAL_SECONDS,
+    EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_BASE_SECONDS, EMAIL_CLAIM_TIMEOUT_SECONDS, EMAIL_SMTP_MAX_IDLE_SECONDS,
+    EMAIL_RETENTION_SECONDS, EMAIL_CLEANUP_INTERVAL_SECONDS,
+)
+from app.executors import run_in_pool
+from app.model import OutboxEmail
+
+
+def _now() -> datetime:
+    # DATETIME columns are stored without time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@dataclass
+class ClaimedEmail:
+    id: int
+    recipient: str
+    subject: str
+    body: str
+    subtype: str
+    attempts: int
+
+
+def _get_session() -> Session:
+    from app.database.database import SessionLocal
+    return SessionLocal()
+
+
+def enqueue_email_sync(recipient: str, subject: str, body: str, subtype: str = "html") -> int:
+    """Stores a message in the outbox and returns its id."""
+    with _get_session() as db:
+        email = OutboxEmail(recipient=recipient, subject=subject, body=body, subtype=subtype,
+                            status="pending", attempts=0, next_attempt_at=_now())
+        db.add(email)
+        db.commit()
+        return email.id
+
+
+async def enqueue_email(recipient: str, subject: str, body: str, subtype: str = "html") -> int:
+    """Queues a message for the background sender without waiting for SMTP."""
+    email_id = await run_in_pool("db", enqueue_email_sync, recipient, subject, body, subtype)
+    email_sender.wake()
+    return email_id
+
+
+def claim_due_emails(limit: int = EMAIL_BATCH_SIZE) -> list[ClaimedEmail]:
+    """
+    Marks up to `limit` due messages as being sent and returns them.
+
+    Every message is claimed with a conditional UPDATE, so several workers can
+    run senders without sending a message twice. A claim expires after
+    EMAIL_CLAIM_TIMEOUT_SECONDS, in case the sender dies while sending.
+    """
+    now = _now()
+    claimed = []
+    with _get_session() as db:
+        candidates = db.query(OutboxEmail).filter(
+            OutboxEmail.status.in_(("pending", "sending")),
+            OutboxEmail.next_attempt_at <= now
+        ).order_by(OutboxEmail.next_attempt_at).limit(limit).all()
+        for email in candidates:
+            updated = db.query(OutboxEmail).filter(
+                OutboxEmail.id == email.id,
+                OutboxEmail.status == email.status,
+                OutboxEmail.next_attempt_at == email.next_attempt_at
+            ).update({
+                OutboxEmail.status: "sending",
+                OutboxEmail.next_attempt_at: now + timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS),
+            }, synchronize_session=False)
+            if updated:
+                claimed.append(ClaimedEmail(email.id, email.recipient, email.subject,
+                                            email.body, email.subtype, email.attempts))
+        db.commit()
+    return claimed
+
+
+def record_send_results(results: dict[int, Optional[str]], attempts: dict[int, int]):
+    """
+    Stores the outcome of a batch: `results` maps message ids to None on success
+    or to the error message. Failed messages are retried with exponential
+    backoff until EMAIL_MAX_ATTEMPTS.
+    """
+    now = _now()
+    with _get_session() as db:
+        for email_id, error in results.items():
+            attempt = attempts[email_id] + 1
+            if error is None:
+                values = {OutboxEmail.status: "sent", OutboxEmail.sent_at: now, OutboxEmail.attempts: attempt,
+                          OutboxEmail.last_error: None, OutboxEmail.body: ""}
+            elif attempt >= EMAIL_MAX_ATTEMPTS:
+                values = {OutboxEmail.status: "failed", OutboxEmail.attempts: attempt, OutboxEmail.last_error: error}
+            else:
+                delay = EMAIL_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+                values = {OutboxEmail.status: "pending", OutboxEmail.attempts: attempt, OutboxEmail.last_error: error,
+                          OutboxEmail.next_attempt_at: now + timedelta(seconds=delay)}
+            db.query(OutboxEmail).filter(OutboxEmail.id == email_id).update(values, synchronize_session=False)
+        db.commit()
+
+
+def remove_old_emails(retention_seconds: int = EMAIL_RETENTION_SECONDS) -> int:
+    """Deletes sent and failed messages older than `retention_seconds` and returns their number."""
+    with _get_session() as db:
+        removed = db.query(OutboxEmail).filter(
+            OutboxEmail.status.in_(("sent", "failed")),
+            OutboxEmail.created_at < _now() - timedelta(seconds=retention_seconds)
+        ).delete(synchronize_session=False)
+        db.commit()
+    if removed:
+        logging.info(f"🧹 Removed {removed} old emails from the outbox")
+    return removed
+
+
+class SMTPConnectionPool:
+    """Keeps up to `size` authenticated SMTP connections open for reuse."""
+
+    def __init__(
+        self,
+        hostname: str = MAIL_SERVER,
+        port: int = MAIL_PORT,
+        username: Optional[str] = MAIL_USERNAME,
+        password: Optional[str] = MAIL_PASSWORD,
+        start_tls: bool = MAIL_STARTTLS,
+        size: int = EMAIL_SMTP_POOL_SIZE,
+        max_idle_seconds: float = EMAIL_SMTP_MAX_IDLE_SECONDS,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.idle: list[tuple[aiosmtplib.SMTP, float]] = []  # Connections with the time they were released
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.opened_connections = 0
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, start_tls=self.start_tls)
+        await client.connect()
+        if self.username and self.password:
+            await client.login(self.username, self.password)
+        self.opened_connections += 1
+        return client
+
+    async def acquire(self) -> aiosmtplib.SMTP:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.size)
+        await self.semaphore.acquire()
+        try:
+            while self.idle:
+                client, released_at = self.idle.pop()
+                if await self._is_usable(client, released_at):
+                    return client
+                client.close()
+            return await self._connect()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    async def _is_usable(self, client: aiosmtplib.SMTP, released_at: float) -> bool:
+        """Checks an idle connection, which the server may have closed after its idle timeout."""
+        if not client.is_connected or time.monotonic() - released_at > self.max_idle_seconds:
+            return False
+        try:
+            await client.noop()
+            return True
+        except Exception:
+            return False
+
+    def release(self, client: aiosmtplib.SMTP, healthy: bool = True):
+        if healthy and client.is_connected:
+            self.idle.append((client, time.monotonic()))
+        else:
+            client.close()
+        self.semaphore.release()
+
+    async def close(self):
+        while self.idle:
+            client, _ = self.idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+
+def build_message(email: ClaimedEmail, sender: Optional[str] = MAIL_USERNAME) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender or "noreply@localhost"
+    message["To"] = email.recipient
+    message["Subject"] = email.subject
+    message.set_content(email.body, subtype=email.subtype, charset="utf-8")
+    return message
+
+
+class EmailSender:
+    """Background task that delivers queued emails."""
+
+    def __init__(self, pool: Optional[SMTPConnectionPool] = None, batch_size: int = EMAIL_BATCH_SIZE):
+        self.pool = pool or SMTPConnectionPool()
+        self.batch_size = batch_size
+        self.wakeup: Optional[asyncio.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self):
+        """Lets the running sender pick up a new message without waiting for the next poll."""
+        if self.wakeup is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _send(self, email: ClaimedEmail, reconnect: bool = True) -> Optional[str]:
+        try:
+            client = await self.pool.acquire()
+        except Exception as e:
+            return f"SMTP connection failed: {e}"
+        healthy = True
+        try:
+            await client.send_message(build_message(email))
+            return None
+        except aiosmtplib.SMTPResponseException as e:
+            # The server rejected the message, but the connection is still usable
+            return f"{e.code} {e.message}"
+        except aiosmtplib.SMTPRecipientsRefused as e:
+            return "; ".join(f"{error.code} {error.message}" for error in e.recipients)
+        except Exception as e:
+            healthy = False
+            error = str(e)
+        finally:
+            self.pool.release(client, healthy)
+        if reconnect:
+            # The connection broke; one more try over a new one before it counts as a failed attempt
+            logging.debug(f"SMTP connection lost while sending email {email.id}: {error}")
+            return await self._send(email, reconnect=False)
+        return error
+
+    async def send_pending_batch(self) -> int:
+        """Sends one batch of due messages and returns how many were delivered."""
+        emails = await run_in_pool("db", claim_due_emails, self.batch_size)
+        if not emails:
+            return 0
+        errors = await asyncio.gather(*(self._send(email) for email in emails))
+        results = {email.id: error for email, error in zip(emails, errors)}
+        await run_in_pool("db", record_send_results, results, {email.id: email.attempts for email in emails})
+
+        failed = [f"{email.recipient}: {error}" for email, error in zip(emails, errors) if error]
+        if failed:
+            logging.warning(f"⚠️ Failed to send {len(failed)} emails, will retry: {failed}")
+        logging.info(f"📧 Sent {len(emails) - len(failed)} of {len(emails)} queued emails")
+        return len(emails) - len(failed)
+
+    async def run_forever(self, poll_interval: float = EMAIL_POLL_INTERVAL_SECONDS):
+        self.wakeup = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        last_cleanup = 0.0
+        try:
+            while True:
+                try:
+                    # A full batch means more messages are probably waiting
+                    while await self.send_pending_batch() >= self.batch_size:
+                        pass
+                    if time.monotonic() - last_cleanup > EMAIL_CLEANUP_INTERVAL_SECONDS:
+                        await run_in_pool("db", remove_old_emails)
+                        last_cleanup = time.monotonic()
+                except Exception as e:
+                    logging.error(f"❌ Email sender error: {e}")
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+        finally:
+            self.wakeup = None
+            self.loop = None
+            await self.pool.close()
+
+
+email_sender = EmailSender()
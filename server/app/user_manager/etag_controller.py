@@ -0,0 +1,81 @@
+"""
+ETags of the wardrobe read endpoints.
+
+Every change to the items or combinations of a user moves `synchronized_at`
+(see `mark_user_synchronized`), so a tag built from it and the response
+schema version identifies the data a client already has. Requests with a
+matching `If-None-Match` get `304 Not Modified` after a single indexed user
+lookup instead of the item queries.
+"""
+import hashlib
+import time
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.constants import RESPONSE_SCHEMA_VERSION, STORAGE_BACKEND, STORAGE_URL_EXPIRES_SECONDS
+from app.model import User
+
+# Clients should revalidate every time, and shared caches must not keep the data
+CACHE_CONTROL = "private, no-cache"
+
+
+def build_etag(scope: str, user_id: int, synchronized_at: Optional[datetime], *extra) -> str:
+    """Returns a weak ETag of one endpoint's data of one user."""
+    parts = [RESPONSE_SCHEMA_VERSION, scope, user_id, synchronized_at.isoformat() if synchronized_at else "", *extra]
+    if STORAGE_BACKEND == "s3":
+        # Responses contain presigned URLs, which must be refreshed before they expire
+        parts.append(int(time.time() // max(STORAGE_URL_EXPIRES_SECONDS // 2, 1)))
+    digest = hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def load_user_etag(db: Session, email: str, scope: str) -> str:
+    """
+    Builds the ETag of `scope` with one lookup through the unique index of users.email.
+
+    The user is read from the database rather than the user cache, so changes
+    made through other worker processes are seen immediately.
+
+    :raises HTTPException: 401 if the user doesn't exist.
+    """
+    return _etag_of_row(db.execute(_user_etag_statement(email)).first(), scope)
+
+
+async def load_user_etag_async(db: AsyncSession, email: str, scope: str) -> str:
+    """Async version of `load_user_etag`."""
+    return _etag_of_row((await db.execute(_user_etag_statement(email))).first(), scope)
+
+
+def _user_etag_statement(email: str):
+    return select(User.id, User.synchronized_at).where(User.email == email).limit(1)
+
+
+def _etag_of_row(row, scope: str) -> str:
+    if row is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return build_etag(scope, row.id, row.synchronized_at)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Checks `If-None-Match` of the request with weak comparison (RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def set_etag_headers(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
@@ -1,32 +1,25 @@
+import hmac
 import logging
 import os
-import random
+import secrets
 import string
 from typing import Optional
 from dotenv import load_dotenv
 from fastapi import HTTPException
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
 from requests import Session
 
 from app.model.user import User
 from app.constants import *
+from app.executors import run_in_pool
+from app.ttl_store import get_ttl_store
+from app.user_manager.email_outbox import enqueue_email
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=MAIL_USERNAME, 
-    MAIL_PASSWORD=MAIL_PASSWORD,
-    MAIL_FROM=MAIL_USERNAME,
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-
-)
-
-verification_codes = {}
+def get_verification_code_key(user_id: int) -> str:
+    return f"verification_code:{user_id}"
 
 def generate_verification_code(length=6) -> str:
     """Generate a random verification code of given length."""
-    code  = ''.join(random.choices(string.digits, k=length))
+    code  = ''.join(secrets.choice(string.digits) for _ in range(length))
     logging.debug(f"Generated key  {code} for user_id ")
     return code
 
@@ -35,7 +28,9 @@ async def send_verification_code(email: str, user_id: int, locale: Optional[str]
     
     # Generate a random verification code
     code = generate_verification_code()
-    verification_codes[user_id] = code  # Store the code in the dictionary
+    # Store the code in the shared TTL store, so any worker can check it
+    await run_in_pool(
+        "db", get_ttl_store().set, get_verification_code_key(user_id), code, VERIFICATION_CODE_TTL_SECONDS)
     
     # Create the verification email content
     if locale == "en":
@@ -45,17 +40,9 @@ async def send_verification_code(email: str, user_id: int, locale: Optional[str]
         subject = "Ваш код підтвердження"
         body = f"Ваш код підтвердження: {code}"
 
-    
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email],
-        body=body,
-        subtype="html",
-    )
-    
-    # Send the email
-    fm = FastMail(conf)
-    await fm.send_message(message)
+
+    # Queue the email, it is sent in the background
+    await enqueue_email(email, subject, body)
 
 async def send_verification_link(email: str, token: str, locale: Optional[str] = "en"):
     """
@@ -73,27 +60,17 @@ async def send_verification_link(email: str, token: str, locale: Optional[str] =
         subject = "Підтвердження електронної пошти"
         body = f"Перейдіть за посиланням, щоб підтвердити email: <a href='{verification_url}'>{verification_url}</a>"
 
-    
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email],
-        body=body,
-        subtype="html",
-    )
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    await enqueue_email(email, subject, body)
 
-async def verify_code(user_id: int, code: str, db: Session) -> bool:
-    logging.debug(f"Current list of verification codes: {verification_codes}")
-    """Verifies the confirmation code for the given user_id and updates the email verification status in the database."""
-    logging.debug(f"Verifying code {code} for user_id {user_id}")
-    stored_code = verification_codes.get(user_id)
-    logging.debug(f"Stored code {stored_code} for user_id {user_id}")
-    
-    if stored_code == code:
+def _consume_verification_code(user_id: int, code: str, db: Session) -> bool:
+    store = get_ttl_store()
+    key = get_verification_code_key(user_id)
+    stored_code = store.get(key)
+
+    # Remove the code after successful verification; only one request can consume it
+    if stored_code is not None and hmac.compare_digest(stored_code, code) and store.pop(key) is not None:
         logging.debug(f"Code confirmed for user_id {user_id}")
-        del verification_codes[user_id]  # Remove the code after successful verification
 
         user = db.query(User).filter(User.id == user_id).first()
         if user:
@@ -108,6 +85,13 @@ async def verify_code(user_id: int, code: str, db: Session) -> bool:
     return False
 
 
+async def verify_code(user_id: int, code: str, db: Session) -> bool:
+    """Verifies the confirmation code for the given user_id and updates the email verification status in the database."""
+    logging.debug(f"Verifying code for user_id {user_id}")
+    # The TTL store and the database block, so they are used in the "db" pool
+    return await run_in_pool("db", _consume_verification_code, user_id, code, db)
+
+
 async def send_password_change_form(
         email: str,
         subject: str,
@@ -122,19 +106,10 @@ async def send_password_change_form(
         - `html_content`: The HTML content for the email body.
         - `locale`: The language of the email content (default is 'ua').
 
-    This function sends an email using FastMail service.
+    The email is queued in the outbox and sent in the background.
     """
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email],
-        body=html_content,
-        subtype="html",
-        charset="utf-8"
-    )
-    fm = FastMail(conf)
-
     try:
-        await fm.send_message(message)
+        await enqueue_email(email, subject, html_content)
         return {"detail": "Password reset email sent successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
\ No newline at end of file
@@ -1,13 +1,34 @@
+from datetime import timedelta
+import time
 from typing import List, Optional
 from pydantic import BaseModel
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+import asyncio
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database.database import get_db
+from app.database.database import SessionLocal, get_db
+from app.database.async_database import get_read_db, run_db
 from app.model.user import User
-from .user_controller import ALGORITHM, SECRET_KEY, create_user, authenticate_user, get_current_user, get_user_data, hash_password, is_user_verified, oauth2_scheme, send_password_reset_email, synchronize_user_data, update_user_email, update_user_password
+from .user_controller import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY, consume_password_reset_token, create_access_token, create_user, is_password_reset_token_active, authenticate_user, get_current_user, get_user_data, get_user_data_async, hash_password_async, is_user_verified, oauth2_scheme, send_password_reset_email, synchronize_user_data, update_user_email, update_user_password
+from app.executors import run_in_pool
+from app.change_feed import change_feed, publish_change
+from app.response_encoding import encode_response, get_representation, is_columnar_layout
+from .user_cache import CachedUser, user_cache
+from .user_controller import decode_token_email, get_authenticated_user, load_cached_user
+from .change_feed_controller import (
+    ChangeFeedCredentials, is_change_feed_authorized, issue_change_feed_ticket, load_change_feed_credentials,
+    redeem_change_feed_ticket,
+)
+from .etag_controller import build_etag, etag_matches, load_user_etag, load_user_etag_async, not_modified_response, set_etag_headers
+from .sync_controller import find_missing_content_hashes, synchronize_changes
+from .upload_session_controller import (
+    cancel_upload_session, create_upload_session, finalize_upload_session, get_upload_session, receive_upload_chunk,
+)
+from .token_controller import revoke_refresh_token, revoke_user_refresh_tokens, rotate_refresh_token
+from app.constants import MAX_CLOTHING_ITEMS_COUNT
 import logging
 
 user_manager_router = APIRouter(tags=["Users"])
@@ -39,12 +60,12 @@ class TokenResponse(BaseModel):
 
 
 @user_manager_router.post("/token", response_model=TokenResponse, include_in_schema=False)
-def login_for_access_token(
+async def login_for_access_token(
     db: Session = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     email = form_data.username
-    auth_result = authenticate_user(db, email, form_data.password)
+    auth_result = await authenticate_user(db, email, form_data.password)
 
     if isinstance(auth_result, JSONResponse):
         raise HTTPException(
@@ -56,13 +77,59 @@ def login_for_access_token(
     return auth_result["data"]  # повертаємо саме доступ до токену
 
 
+@user_manager_router.post("/token/refresh", summary="Exchanges a refresh token for a new access token")
+def refresh_access_token(
+    refresh_token: str = Form(...),
+    db: Session = Depends(get_db)
+):
+    """
+    **Issues a new access token without the password.**
+
+    - **Parameters**:
+        - `refresh_token`: Refresh token from `/login_with_email` or a previous refresh.
+    - **Response**:
+        - `200 OK`: New `access_token` and a new `refresh_token`; the presented one can't be used again.
+        - `401 Unauthorized`: The refresh token is invalid, expired or revoked.
+    """
+    user, new_refresh_token = rotate_refresh_token(db, refresh_token)
+    access_token = create_access_token(
+        data={"sub": str(user.email)},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "detail": "Token refreshed successfully",
+        "data": {
+            "access_token": access_token,
+            "refresh_token": new_refresh_token,
+            "token_type": "bearer"
+        }
+    }
+
+
+@user_manager_router.post("/token/revoke", summary="Revokes a refresh token (logout)")
+def revoke_token(
+    refresh_token: str = Form(...),
+    db: Session = Depends(get_db)
+):
+    """
+    **Revokes a refresh token together with all tokens rotated from the same login.**
+
+    - **Response**:
+        - `200 OK`: Token revoked.
+        - `404 Not Found`: Unknown refresh token.
+    """
+    if not revoke_refresh_token(db, refresh_token):
+        raise HTTPException(status_code=404, detail="Refresh token not found")
+    return {"detail": "Refresh token revoked successfully", "data": None}
+
+
 @user_manager_router.post("/login_with_email")
-def login_with_email(
+async def login_with_email(
     email: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    result = authenticate_user(db, email, password)
+    result = await authenticate_user(db, email, password)
 
     # Якщо це JSONResponse — тобто помилка, просто повертаємо її
     if isinstance(result, JSONResponse):
@@ -112,6 +179,8 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
         # Оновлюємо статус підтвердження email
         user.is_email_verified = True
         db.commit()
+        user_cache.invalidate(user.email)
+        await run_in_pool("db", publish_change, user.id, "user", user.id, "update", user.synchronized_at_iso)
 
         # Повертаємо успішну відповідь
         return JSONResponse(
@@ -133,7 +202,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
 
 
 @user_manager_router.get("/profile")
-def get_profile(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_profile(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     logging.debug("Received request for profile with token: %s",
                   token)  # Логування отриманого токена
 
@@ -152,8 +221,13 @@ def get_profile(token: str = Depends(oauth2_scheme), db: Session = Depends(get_d
     # Логування знайденого користувача
     logging.debug("User found: %s", current_user.email)
 
+    # Профіль змінюється і разом з email, тому він теж входить у ETag
+    etag = build_etag("profile", current_user.id, current_user.synchronized_at, current_user.email)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
     # Повертаємо дані користувача через JSONResponse
-    return JSONResponse(
+    response = JSONResponse(
         status_code=200,
         content={
             "detail": "User retrieved successfully",
@@ -164,6 +238,8 @@ def get_profile(token: str = Depends(oauth2_scheme), db: Session = Depends(get_d
                 "synchronized_at": current_user.synchronized_at_iso
         }
     )
+    set_etag_headers(response, etag)
+    return response
 
 
 @user_manager_router.get("/is_activated")
@@ -185,21 +261,239 @@ def is_user_activated(user_id: int, db: Session = Depends(get_db)):
 
 
 @user_manager_router.post("/synchronize", summary="Synchronizes user data between server and local storage")
-async def sync_data(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme),
+async def sync_data(request: Request, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme),
                     clothing_items: str = Form(...),
                     clothing_combinations: str = Form(...),
                     files: Optional[List[UploadFile]] = File(None),
-                    is_server_to_local: bool = Form(True),):
+                    is_server_to_local: bool = Form(True),
+                    read_db: Session | AsyncSession = Depends(get_read_db)):
     if not is_server_to_local:
-        synchronize_user_data(
+        await run_in_pool(
+            "db",
+            synchronize_user_data,
             db=db,
             token=token,
             clothing_items=clothing_items,
             clothing_combinations=clothing_combinations,
             files=files)
-    
-    return get_user_data(token=token, db=db)     
-        
+
+    # Дані відправляються лише якщо вони змінилися після попередньої синхронізації
+    etag = await run_db(read_db, load_user_etag, load_user_etag_async,
+                        email=decode_token_email(token), scope=f"user-data:{get_representation(request)}")
+    if is_server_to_local and etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    content = await run_db(read_db, get_user_data, get_user_data_async,
+                           token=token, columnar=is_columnar_layout(request))
+    response = await run_in_pool("cpu", encode_response, request, content)
+    set_etag_headers(response, etag)
+    return response
+
+
+class ContentHashesRequest(BaseModel):
+    content_hashes: List[str]
+
+
+@user_manager_router.post("/synchronize/missing-files", summary="Returns which photos have to be uploaded for a sync")
+async def sync_missing_files(request: ContentHashesRequest,
+                             db: Session = Depends(get_db),
+                             current_user: CachedUser = Depends(get_authenticated_user)):
+    """
+    **First phase of a sync.**
+
+    - **content_hashes**: SHA-256 (hex) of the photos of the local items.
+    - Returns the hashes the server doesn't have. Only these files are uploaded with
+      `/synchronize` or `/synchronize/changes`; the other items refer to their photo
+      by `content_hash` instead of `file_index`.
+    """
+    if len(request.content_hashes) > MAX_CLOTHING_ITEMS_COUNT * 10:
+        raise HTTPException(status_code=400, detail="Too many content hashes")
+    missing = await run_in_pool("db", find_missing_content_hashes, db, current_user.id, request.content_hashes)
+    return {"detail": "Missing files determined", "data": {"missing_content_hashes": missing}}
+
+
+@user_manager_router.post("/synchronize/changes", summary="Exchanges only the changes made since the last synchronization")
+async def sync_changes(request: Request,
+                       db: Session = Depends(get_db),
+                       current_user: CachedUser = Depends(get_authenticated_user),
+                       since: Optional[str] = Form(None),
+                       changes: str = Form("{}"),
+                       files: Optional[List[UploadFile]] = File(None)):
+    """
+    **Delta synchronization.**
+
+    - **since**: `synchronized_at` of the previous sync; without it all data is returned.
+    - **changes**: JSON with `clothing_items` and `clothing_combinations` changed locally
+      (identified by `uuid`, new photos referenced by `file_index` in `files` or by the
+      `content_hash` of a photo already on the server) and the uuids
+      in `deleted_clothing_items` and `deleted_clothing_combinations`.
+    - Returns the rows changed on the server since `since` and the uuids of deleted rows.
+    - Supports `Accept: application/msgpack`, gzip/brotli compression and `?layout=columnar`.
+    """
+    content = await run_in_pool(
+        "db", synchronize_changes, db, current_user, since, changes, files, is_columnar_layout(request))
+    return await run_in_pool("cpu", encode_response, request, content)
+
+
+class UploadSessionFileRequest(BaseModel):
+    size: int
+    sha256: str
+    filename: Optional[str] = None
+
+
+class UploadSessionRequest(BaseModel):
+    files: List[UploadSessionFileRequest]
+
+
+@user_manager_router.post("/synchronize/uploads", status_code=201, summary="Starts a resumable upload of the photos of a sync")
+async def sync_create_upload(request: UploadSessionRequest,
+                             db: Session = Depends(get_db),
+                             current_user: CachedUser = Depends(get_authenticated_user)):
+    """
+    **Resumable upload, step 1.**
+
+    - **files**: `size` in bytes, `sha256` (hex) and optional `filename` of every photo,
+      in the order of their `file_index`.
+    - Returns the `upload_id` and the offset of every file (0).
+    """
+    files = [file.dict() for file in request.files]
+    data = await run_in_pool("db", create_upload_session, db, current_user, files)
+    return {"detail": "Upload session created", "data": data}
+
+
+@user_manager_router.get("/synchronize/uploads/{upload_id}", summary="Returns the progress of a resumable upload")
+async def sync_get_upload(upload_id: str,
+                          db: Session = Depends(get_db),
+                          current_user: CachedUser = Depends(get_authenticated_user)):
+    """Returns the acknowledged `offset` of every file, where an interrupted upload continues."""
+    data = await run_in_pool("db", get_upload_session, db, current_user, upload_id)
+    return {"detail": "Upload session retrieved", "data": data}
+
+
+@user_manager_router.put("/synchronize/uploads/{upload_id}/files/{file_index}", summary="Uploads a chunk of a file")
+async def sync_upload_chunk(upload_id: str,
+                            file_index: int,
+                            request: Request,
+                            upload_offset: int = Header(...),
+                            upload_checksum: Optional[str] = Header(None),
+                            db: Session = Depends(get_db),
+                            current_user: CachedUser = Depends(get_authenticated_user)):
+    """
+    **Resumable upload, step 2.**
+
+    - The request body is the raw chunk, written at the byte offset in the `Upload-Offset` header,
+      which must equal the offset acknowledged by the server (409 with the right offset otherwise).
+    - **Upload-Checksum**: optional SHA-256 (hex) of the chunk.
+    - The completed file is checked against its `sha256`.
+    """
+    data = await receive_upload_chunk(
+        db, current_user, upload_id, file_index, upload_offset, request.stream(), upload_checksum)
+    return JSONResponse(content={"detail": "Chunk stored", "data": data},
+                        headers={"Upload-Offset": str(data["offset"])})
+
+
+@user_manager_router.post("/synchronize/uploads/{upload_id}/finalize", summary="Applies a sync with the uploaded files")
+async def sync_finalize_upload(upload_id: str,
+                               request: Request,
+                               db: Session = Depends(get_db),
+                               current_user: CachedUser = Depends(get_authenticated_user),
+                               since: Optional[str] = Form(None),
+                               changes: str = Form("{}")):
+    """
+    **Resumable upload, step 3.**
+
+    Takes the same `since` and `changes` as `/synchronize/changes`, where `file_index` refers to
+    the files of the session. All changes are committed in one transaction and the session is removed.
+    """
+    content = await run_in_pool(
+        "db", finalize_upload_session, db, current_user, upload_id, since, changes, is_columnar_layout(request))
+    return await run_in_pool("cpu", encode_response, request, content)
+
+
+@user_manager_router.delete("/synchronize/uploads/{upload_id}", summary="Cancels a resumable upload")
+async def sync_cancel_upload(upload_id: str,
+                             db: Session = Depends(get_db),
+                             current_user: CachedUser = Depends(get_authenticated_user)):
+    await run_in_pool("db", cancel_upload_session, db, current_user, upload_id)
+    return {"detail": "Upload session cancelled"}
+
+
+
+def _load_socket_credentials(websocket: WebSocket, ticket: Optional[str]) -> ChangeFeedCredentials:
+    if ticket is not None:
+        return redeem_change_feed_ticket(ticket)
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return load_change_feed_credentials(token)
+
+
+@user_manager_router.post("/changes/ticket", summary="Issues a one-time ticket for opening the change feed")
+async def create_change_feed_ticket(token: str = Depends(oauth2_scheme)):
+    """Returns a ticket for `/changes?ticket=...`, valid once within a minute, for clients that can't send headers."""
+    ticket = await run_in_pool("db", issue_change_feed_ticket, token)
+    return {"ticket": ticket}
+
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    # Devices don't send anything, the loop only notices when they disconnect
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+@user_manager_router.websocket("/changes")
+async def change_feed_socket(websocket: WebSocket, ticket: Optional[str] = Query(None)):
+    """
+    **Change feed of the user's data.**
+
+    - Authenticated with the access token in the `Authorization` header, or
+      with a one-time `?ticket=` from `POST /changes/ticket`.
+    - The first message has `op` "subscribed" and the current `synchronized_at`,
+      so a device can tell whether it missed changes while it was disconnected.
+    - Then every change of the user's data is sent as
+      `{"entity", "id", "op", "synchronized_at"}` (see app/change_feed.py).
+    - The socket is closed with code 1008 when the access token expires or is
+      revoked by a password or email change; the device reconnects with a new one.
+    """
+    try:
+        credentials = await run_in_pool("db", _load_socket_credentials, websocket, ticket)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    current_user = credentials.user
+    await websocket.accept()
+    subscription = change_feed.subscribe(current_user.id)
+    disconnected = asyncio.create_task(_wait_for_disconnect(websocket))
+    expired = asyncio.create_task(asyncio.sleep(max(0.0, credentials.expires_at - time.time())))
+    try:
+        await websocket.send_json({"entity": "user", "id": current_user.id, "op": "subscribed",
+                                   "synchronized_at": current_user.synchronized_at_iso})
+        while True:
+            next_event = asyncio.create_task(subscription.get())
+            await asyncio.wait({next_event, disconnected, expired}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_event.cancel()
+                break
+            if expired.done():
+                next_event.cancel()
+                await websocket.close(code=1008, reason="Token has expired")
+                break
+            event = next_event.result()
+            if event["entity"] == "user" and event["op"] == "update" and not await run_in_pool(
+                    "db", is_change_feed_authorized, credentials):
+                await websocket.close(code=1008, reason="Token has been revoked")
+                break
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        change_feed.unsubscribe(subscription)
+        disconnected.cancel()
+        expired.cancel()
 
 
 @user_manager_router.post("/forgot-password", summary="Initiates a password reset process")
@@ -253,6 +547,11 @@ async def get_change_password_form_from_forgot_password(
 
     - **Headers**: `Authorization: Bearer <token>`
     """
+    # Посилання одноразове: використаний або прострочений токен не показує форму
+    if not is_password_reset_token_active(token):
+        if locale == "ua":
+            return HTMLResponse(status_code=400, content="<html><body><h2>Посилання недійсне або вже використане.</h2></body></html>")
+        return HTMLResponse(status_code=400, content="<html><body><h2>The link is invalid or has already been used.</h2></body></html>")
     try:
         # Отримуємо користувача на основі токену
         current_user = get_current_user(token, db)
@@ -388,6 +687,11 @@ async def change_password_form_from_forgot_password(
             raise HTTPException(
                 status_code=400, detail="New password and confirm password do not match")
 
+        # Токен скидання пароля можна використати лише один раз
+        if not consume_password_reset_token(token):
+            raise HTTPException(
+                status_code=400, detail="Reset link is invalid or has already been used")
+
         # Отримуємо користувача на основі токену
         current_user = get_current_user(token, db)
     except HTTPException as e:
@@ -405,8 +709,11 @@ async def change_password_form_from_forgot_password(
 
     # Оновлюємо пароль (можливо, потрібно зашифрувати пароль перед збереженням)
     # Увага: тут потрібно зашифрувати пароль
-    user.password = hash_password(new_password)
+    user.password = await hash_password_async(new_password)
     db.commit()
+    user_cache.invalidate(user.email)
+    revoke_user_refresh_tokens(db, user.id)
+    await run_in_pool("db", publish_change, user.id, "user", user.id, "update", user.synchronized_at_iso)
 
     return RedirectResponse(url="/change-password-success", status_code=303)
 
@@ -420,7 +727,7 @@ async def change_password_success(locale: Optional[str] = 'en'):
 
 
 @user_manager_router.put("/change-password", summary="Changes the password for the currently authenticated user")
-def change_password(
+async def change_password(
     db: Session = Depends(get_db),
     token: str = Depends(oauth2_scheme),
     old_password: str = Form(...),
@@ -440,8 +747,8 @@ def change_password(
     """
 
     try:
-        current_user = get_current_user(token, db)
-        result = update_user_password(
+        current_user = await run_in_pool("db", get_current_user, token, db)
+        result = await update_user_password(
             db, current_user, old_password, new_password)
         return JSONResponse(status_code=200, content=result)
 
@@ -0,0 +1,601 @@
+"""
+Delta synchronization of clothing items and combinations.
+
+Items and combinations are identified by their `uuid`, which clients may also
+generate themselves for rows created offline. A client sends only the rows it
+changed or deleted since its last sync and receives only the rows changed on
+the server since then, plus tombstones of deleted rows, so the cost of a sync
+grows with the number of edits instead of the size of the wardrobe.
+"""
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Iterable, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session, selectinload
+
+from app.constants import (
+    BATCH_UPLOAD_WORKERS, MAX_CLOTHING_ITEMS_COUNT, MAX_CLOTHING_COMBINATIONS_COUNT,
+    SYNC_DELTA_OVERLAP_SECONDS, SYNC_TOMBSTONE_RETENTION_DAYS,
+)
+from app.change_feed import publish_change
+from app.executors import get_executor
+from app.response_encoding import to_columnar
+from app.model import CategoryEnum, ClothingCombination, ClothingItem, SeasonEnum, SyncTombstone, User
+from app.model.clothing_combination import clothing_combination_items
+from app.model.sync_tombstone import sync_timestamp
+from app.user_manager.user_cache import CachedUser, user_cache
+
+if TYPE_CHECKING:
+    from app.close_manager.image_ingestion import IngestedImage
+
+# Fields of an item that clients may change
+ITEM_SYNC_FIELDS = (
+    "name", "category", "season", "red", "green", "blue", "material",
+    "brand", "purchase_date", "price", "is_favorite",
+)
+REQUIRED_ITEM_FIELDS = ("name", "category", "season", "material")
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def parse_sync_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parses an ISO 8601 timestamp into naive UTC, as stored in the database."""
+    if value in (None, ""):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_item_values(data: dict) -> dict:
+    """
+    Converts the item fields sent by a client to column values.
+
+    Only the fields present in `data` are returned, so partial updates don't
+    reset the other fields.
+
+    :raises HTTPException: 400 for invalid values.
+    """
+    values = {}
+    for key in ITEM_SYNC_FIELDS:
+        if key not in data:
+            continue
+        value = data[key]
+        try:
+            if key == "purchase_date":
+                value = value if isinstance(value, date) or not value else datetime.strptime(value, "%Y-%m-%d").date()
+            elif key == "price":
+                value = float(value) if value not in (None, "") else None
+            elif key in ("red", "green", "blue"):
+                value = int(value) if value not in (None, "") else None
+            elif key == "is_favorite":
+                if isinstance(value, str):
+                    value = value.lower() in ("true", "1", "yes")
+                value = bool(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid value of '{key}': {value}")
+        values[key] = value
+
+    if "category" in values and values["category"] not in CategoryEnum.__members__:
+        raise HTTPException(status_code=400, detail=f"Invalid category value: {values['category']}")
+    if "season" in values and values["season"] not in SeasonEnum.__members__:
+        raise HTTPException(status_code=400, detail=f"Invalid season value: {values['season']}")
+    return values
+
+
+def normalize_content_hashes(content_hashes: Iterable[str]) -> list[str]:
+    """Returns the distinct SHA-256 hex digests in their original order, or raises 400."""
+    normalized = []
+    for content_hash in content_hashes:
+        content_hash = str(content_hash).lower()
+        if not CONTENT_HASH_PATTERN.match(content_hash):
+            raise HTTPException(status_code=400, detail=f"Invalid content hash: {content_hash}")
+        normalized.append(content_hash)
+    return list(dict.fromkeys(normalized))
+
+
+def find_missing_content_hashes(db: Session, owner_id: int, content_hashes: Iterable[str]) -> list[str]:
+    """
+    Returns the hashes of files the client has to upload for a sync.
+
+    Only photos of the user's own items count as present: a client can't find
+    out which files other users have uploaded, and a referenced file is known
+    to exist.
+    """
+    content_hashes = normalize_content_hashes(content_hashes)
+    if not content_hashes:
+        return []
+    present = {content_hash for (content_hash,) in db.query(ClothingItem.content_hash).filter(
+        ClothingItem.owner_id == owner_id,
+        ClothingItem.content_hash.in_(content_hashes)
+    ).distinct()}
+    return [content_hash for content_hash in content_hashes if content_hash not in present]
+
+
+def _load_stored_photos(db: Session, owner_id: int, content_hashes: set[str]) -> dict[str, dict]:
+    """Loads the file columns of the user's items with the given photos, by content hash."""
+    if not content_hashes:
+        return {}
+    photos = {}
+    for row in db.query(
+        ClothingItem.content_hash, ClothingItem.filename, ClothingItem.perceptual_hash, ClothingItem.image_variants,
+        ClothingItem.red, ClothingItem.green, ClothingItem.blue
+    ).filter(ClothingItem.owner_id == owner_id, ClothingItem.content_hash.in_(content_hashes)):
+        photos.setdefault(row.content_hash, {
+            "filename": row.filename, "content_hash": row.content_hash, "perceptual_hash": row.perceptual_hash,
+            "image_variants": row.image_variants,
+            "dominant_color": (row.red, row.green, row.blue) if row.red is not None else None,
+        })
+    missing = content_hashes - photos.keys()
+    if missing:
+        # The file was deleted after the negotiation, the client has to upload it
+        raise HTTPException(status_code=409, detail={
+            "message": "Some referenced files are not stored on the server",
+            "missing_content_hashes": sorted(missing),
+        })
+    return photos
+
+
+def _require_uuids(rows: Iterable[dict], entity: str) -> list[str]:
+    uuids = []
+    for row in rows:
+        if not isinstance(row, dict) or not row.get("uuid"):
+            raise HTTPException(status_code=400, detail=f"Every changed {entity} needs a 'uuid'")
+        uuids.append(str(row["uuid"]))
+    return uuids
+
+
+def _tombstoned_uuids(db: Session, owner_id: int, entity: str, uuids: Iterable[str]) -> set[str]:
+    uuids = set(uuids)
+    if not uuids:
+        return set()
+    return {uuid for (uuid,) in db.query(SyncTombstone.uuid).filter(
+        SyncTombstone.owner_id == owner_id,
+        SyncTombstone.entity == entity,
+        SyncTombstone.uuid.in_(uuids)
+    )}
+
+
+def _ingest_files(db: Session, files: list[UploadFile], indexes: set[int]) -> dict[int, "IngestedImage"]:
+    """
+    Runs the photos of a sync through the ingestion pipeline in parallel on the image pool.
+
+    If one photo fails, the files already stored for the others are released
+    and the error is raised.
+    """
+    from app.close_manager import ingest_image
+    from app.storage_manager import release_blobs
+
+    def ingest(index):
+        try:
+            return ingest_image(files[index], require_image=False), None
+        except Exception as e:
+            return None, e
+
+    indexes = sorted(indexes)
+    results = list(get_executor("image").map(ingest, indexes, max_in_flight=BATCH_UPLOAD_WORKERS))
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        release_blobs(db, {image.blob.filename for image, _ in results if image is not None})
+        raise errors[0]
+    return {index: image for index, (image, _) in zip(indexes, results)}
+
+
+def _add_tombstones(db: Session, owner_id: int, entity: str, uuids: Iterable[str], deleted_at: datetime):
+    db.add_all([SyncTombstone(owner_id=owner_id, entity=entity, uuid=uuid, deleted_at=deleted_at) for uuid in uuids])
+
+
+def apply_sync_changes(
+    db: Session,
+    user: CachedUser,
+    items: list[dict],
+    combinations: list[dict],
+    deleted_items: Iterable[str] = (),
+    deleted_combinations: Iterable[str] = (),
+    files: Optional[list[UploadFile]] = None,
+) -> str:
+    """
+    Applies the changes of a client in one transaction.
+
+    Rows are matched by uuid: unknown uuids create rows, known ones are updated
+    with the fields present. An item with a new photo refers to it by
+    `file_index`, its position in `files`, or by the `content_hash` of a photo
+    the user already has on the server (see `find_missing_content_hashes`);
+    new items must have one of them. A combination lists its items as `item_uuids`. Rows that were already deleted
+    on the server are not brought back by clients that haven't seen the deletion.
+
+    New items and combinations are inserted with one statement each, the links
+    of combinations with one more, and ids are mapped through the uuids in
+    memory, so the number of queries doesn't grow with the number of rows.
+    synchronized_at of the user is set in the same transaction.
+
+    :raises HTTPException: 400 for invalid changes or if a limit would be exceeded,
+        409 if a photo referenced by hash is not stored.
+    :return: The new synchronized_at in ISO 8601 format.
+    """
+    from app.close_manager.duplicate_detector import duplicate_index
+    from app.storage_manager import release_blobs
+
+    owner_id = user.id
+    files = files or []
+    item_uuids = _require_uuids(items, "item")
+    combination_uuids = _require_uuids(combinations, "combination")
+    deleted_items = {str(uuid) for uuid in deleted_items}
+    deleted_combinations = {str(uuid) for uuid in deleted_combinations}
+
+    existing_items = {item.uuid: item for item in db.query(ClothingItem).filter(
+        ClothingItem.owner_id == owner_id,
+        ClothingItem.uuid.in_(set(item_uuids) | deleted_items)
+    )} if item_uuids or deleted_items else {}
+    existing_combinations = {combo.uuid: combo for combo in db.query(ClothingCombination).filter(
+        ClothingCombination.owner_id == owner_id,
+        ClothingCombination.uuid.in_(set(combination_uuids) | deleted_combinations)
+    )} if combination_uuids or deleted_combinations else {}
+    deleted_on_server = {
+        "item": _tombstoned_uuids(db, owner_id, "item", set(item_uuids) - existing_items.keys()),
+        "combination": _tombstoned_uuids(db, owner_id, "combination", set(combination_uuids) - existing_combinations.keys()),
+    }
+
+    # ✅ Limits are checked once for the result of all changes
+    new_items = set(item_uuids) - existing_items.keys() - deleted_on_server["item"] - deleted_items
+    removed_items = deleted_items & existing_items.keys()
+    item_count = db.query(ClothingItem).filter(ClothingItem.owner_id == owner_id).count()
+    if item_count + len(new_items) - len(removed_items) > MAX_CLOTHING_ITEMS_COUNT:
+        raise HTTPException(
+            status_code=400, detail=f"Item limit reached. Maximum {MAX_CLOTHING_ITEMS_COUNT} clothing items allowed per user.")
+    new_combinations = set(combination_uuids) - existing_combinations.keys() - deleted_on_server["combination"] - deleted_combinations
+    removed_combinations = deleted_combinations & existing_combinations.keys()
+    combo_count = db.query(ClothingCombination).filter(ClothingCombination.owner_id == owner_id).count()
+    if combo_count + len(new_combinations) - len(removed_combinations) > MAX_CLOTHING_COMBINATIONS_COUNT:
+        raise HTTPException(
+            status_code=400, detail=f"Combination limit reached. Maximum {MAX_CLOTHING_COMBINATIONS_COUNT} combinations allowed per user.")
+
+    # Everything is validated before the photos are stored
+    item_changes = {}
+    for data in items:
+        uuid = str(data["uuid"])
+        if uuid in deleted_items or (uuid not in existing_items and uuid in deleted_on_server["item"]):
+            continue
+        values = parse_item_values(data)
+        file_index = data.get("file_index")
+        if file_index is not None and (not isinstance(file_index, int) or not 0 <= file_index < len(files)):
+            raise HTTPException(status_code=400, detail=f"Item {uuid} refers to a missing file")
+        # An uploaded file wins over a reference to a stored one
+        content_hash = None
+        if file_index is None and data.get("content_hash"):
+            content_hash = normalize_content_hashes([data["content_hash"]])[0]
+        if uuid in item_changes:
+            # The same row sent twice: the later values win
+            previous_values, previous_file_index, previous_content_hash = item_changes[uuid]
+            values = {**previous_values, **values}
+            if file_index is None and content_hash is None:
+                file_index, content_hash = previous_file_index, previous_content_hash
+        if uuid not in existing_items:
+            missing = [key for key in REQUIRED_ITEM_FIELDS if not values.get(key)]
+            if file_index is None and content_hash is None:
+                missing.append("file_index or content_hash")
+            if missing:
+                raise HTTPException(status_code=400, detail=f"New item {uuid} is missing {', '.join(missing)}")
+        elif content_hash == existing_items[uuid].content_hash:
+            content_hash = None
+        item_changes[uuid] = (values, file_index, content_hash)
+
+    combination_changes = {}
+    for data in combinations:
+        uuid = str(data["uuid"])
+        if uuid in deleted_combinations or (uuid not in existing_combinations and uuid in deleted_on_server["combination"]):
+            continue
+        if uuid not in existing_combinations and uuid not in combination_changes and not data.get("name"):
+            raise HTTPException(status_code=400, detail=f"New combination {uuid} is missing name")
+        combination_changes.setdefault(uuid, {}).update(data)
+
+    stored_photos = _load_stored_photos(
+        db, owner_id, {content_hash for _, _, content_hash in item_changes.values() if content_hash is not None})
+    ingested = _ingest_files(db, files, {file_index for _, file_index, _ in item_changes.values() if file_index is not None})
+    stored_filenames = {image.blob.filename for image in ingested.values()}
+    replaced_filenames = set()
+    now = sync_timestamp()
+    try:
+        # 1. Items: changed rows through the session, new rows in one INSERT
+        new_item_rows = []
+        for uuid, (values, file_index, content_hash) in item_changes.items():
+            photo = None
+            if file_index is not None:
+                image = ingested[file_index]
+                photo = {"filename": image.blob.filename, "content_hash": image.blob.sha256,
+                         "perceptual_hash": image.perceptual_hash, "image_variants": image.blob.image_variants,
+                         "dominant_color": image.dominant_color}
+            elif content_hash is not None:
+                photo = stored_photos[content_hash]
+            if photo is not None:
+                values.update(filename=photo["filename"], content_hash=photo["content_hash"],
+                              perceptual_hash=photo["perceptual_hash"], image_variants=photo["image_variants"])
+                if photo["dominant_color"] and all(values.get(key) is None for key in ("red", "green", "blue")):
+                    values["red"], values["green"], values["blue"] = photo["dominant_color"]
+
+            item = existing_items.get(uuid)
+            if item is None:
+                row = {key: None for key in ITEM_SYNC_FIELDS}
+                row["is_favorite"] = False
+                row.update(values)
+                row.update(uuid=uuid, owner_id=owner_id, updated_at=now)
+                new_item_rows.append(row)
+            else:
+                if "filename" in values and values["filename"] != item.filename:
+                    replaced_filenames.add(item.filename)
+                for key, value in values.items():
+                    setattr(item, key, value)
+        if new_item_rows:
+            db.execute(insert(ClothingItem), new_item_rows)
+
+        # 2. Combinations: new rows in one INSERT, then the links of all changed ones
+        new_combination_rows = []
+        for uuid, data in combination_changes.items():
+            combo = existing_combinations.get(uuid)
+            if combo is None:
+                new_combination_rows.append({"uuid": uuid, "name": data["name"], "owner_id": owner_id, "updated_at": now})
+            elif data.get("name"):
+                combo.name = data["name"]
+        if new_combination_rows:
+            db.execute(insert(ClothingCombination), new_combination_rows)
+        db.flush()
+
+        linked = {uuid: [str(item_uuid) for item_uuid in data["item_uuids"] or []]
+                  for uuid, data in combination_changes.items() if "item_uuids" in data}
+        if linked:
+            referenced = {item_uuid for item_uuids in linked.values() for item_uuid in item_uuids} - deleted_items
+            item_ids = dict(db.query(ClothingItem.uuid, ClothingItem.id).filter(
+                ClothingItem.owner_id == owner_id,
+                ClothingItem.uuid.in_(referenced)
+            ).all()) if referenced else {}
+            combination_ids = dict(db.query(ClothingCombination.uuid, ClothingCombination.id).filter(
+                ClothingCombination.owner_id == owner_id,
+                ClothingCombination.uuid.in_(linked.keys())
+            ).all())
+            current_links = {}
+            for combination_id, item_id in db.execute(
+                select(clothing_combination_items.c.combination_id, clothing_combination_items.c.item_id)
+                .where(clothing_combination_items.c.combination_id.in_(combination_ids.values()))
+            ):
+                current_links.setdefault(combination_id, set()).add(item_id)
+
+            # Items deleted in the meantime are left out
+            new_links = {}
+            for uuid, item_uuids in linked.items():
+                ids = list(dict.fromkeys(item_ids[item_uuid] for item_uuid in item_uuids if item_uuid in item_ids))
+                if set(ids) != current_links.get(combination_ids[uuid], set()):
+                    new_links[combination_ids[uuid]] = ids
+            if new_links:
+                db.execute(clothing_combination_items.delete().where(
+                    clothing_combination_items.c.combination_id.in_(new_links.keys())))
+                link_rows = [{"combination_id": combination_id, "item_id": item_id}
+                             for combination_id, ids in new_links.items() for item_id in ids]
+                if link_rows:
+                    db.execute(clothing_combination_items.insert(), link_rows)
+                # Changed links don't touch the combination row, so updated_at is set here
+                db.query(ClothingCombination).filter(
+                    ClothingCombination.id.in_(new_links.keys())
+                ).update({ClothingCombination.updated_at: now}, synchronize_session=False)
+
+        # 3. Deleted rows: the links go first, so the delete cascades of the relationships don't apply
+        if removed_combinations:
+            combination_ids = [existing_combinations[uuid].id for uuid in removed_combinations]
+            db.execute(clothing_combination_items.delete().where(
+                clothing_combination_items.c.combination_id.in_(combination_ids)))
+            db.query(ClothingCombination).filter(
+                ClothingCombination.id.in_(combination_ids)
+            ).delete(synchronize_session=False)
+            _add_tombstones(db, owner_id, "combination", removed_combinations, now)
+        if removed_items:
+            item_ids = [existing_items[uuid].id for uuid in removed_items]
+            replaced_filenames.update(existing_items[uuid].filename for uuid in removed_items)
+            affected = select(clothing_combination_items.c.combination_id).where(
+                clothing_combination_items.c.item_id.in_(item_ids))
+            db.query(ClothingCombination).filter(
+                ClothingCombination.id.in_(affected)
+            ).update({ClothingCombination.updated_at: now}, synchronize_session=False)
+            db.execute(clothing_combination_items.delete().where(
+                clothing_combination_items.c.item_id.in_(item_ids)))
+            db.query(ClothingItem).filter(
+                ClothingItem.id.in_(item_ids)
+            ).delete(synchronize_session=False)
+            _add_tombstones(db, owner_id, "item", removed_items, now)
+
+        db.query(User).filter(User.id == owner_id).update({User.synchronized_at: now})
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_blobs(db, stored_filenames)
+        raise
+
+    user_cache.update_synchronized_at(user.email, now)
+    publish_change(owner_id, "wardrobe", None, "sync", now.isoformat())
+    if item_changes or removed_items:
+        duplicate_index.invalidate(owner_id)
+    release_blobs(db, replaced_filenames)
+    return now.isoformat()
+
+
+def serialize_sync_combination(combo: ClothingCombination) -> dict:
+    return {
+        "id": combo.id,
+        "uuid": combo.uuid,
+        "name": combo.name,
+        "items": [item.id for item in combo.items],
+        "item_uuids": [item.uuid for item in combo.items],
+        "updated_at": combo.updated_at.isoformat() if combo.updated_at else None,
+    }
+
+
+def get_changes_since(db: Session, owner_id: int, since: Optional[datetime], columnar: bool = False) -> dict:
+    """
+    Returns the items and combinations changed after `since` and the uuids of
+    the ones deleted since then; without `since` all rows are returned.
+
+    The window starts SYNC_DELTA_OVERLAP_SECONDS early, so rows written while
+    the previous sync was reading are not missed. Clients apply the changes by
+    uuid, so rows they receive twice do no harm.
+
+    :param columnar: Return items and combinations column by column (see `to_columnar`).
+    """
+    from app.close_manager.clothing_controller import serialize_clothing_item, serialize_clothing_items_columnar
+
+    items = db.query(ClothingItem).filter(ClothingItem.owner_id == owner_id)
+    combos = db.query(ClothingCombination).options(
+        selectinload(ClothingCombination.items)
+    ).filter(ClothingCombination.owner_id == owner_id)
+    deleted = {"items": [], "combinations": []}
+    if since is not None:
+        cutoff = since - timedelta(seconds=SYNC_DELTA_OVERLAP_SECONDS)
+        items = items.filter(ClothingItem.updated_at > cutoff)
+        combos = combos.filter(ClothingCombination.updated_at > cutoff)
+        tombstones = db.query(SyncTombstone.entity, SyncTombstone.uuid).filter(
+            SyncTombstone.owner_id == owner_id,
+            SyncTombstone.deleted_at > cutoff
+        )
+        for entity, uuid in tombstones:
+            deleted["items" if entity == "item" else "combinations"].append(uuid)
+
+    items = items.order_by(ClothingItem.id).all()
+    combinations = [serialize_sync_combination(combo) for combo in combos.order_by(ClothingCombination.id)]
+    if columnar:
+        return {
+            "items": serialize_clothing_items_columnar(items),
+            "combinations": to_columnar(combinations),
+            "deleted": deleted,
+        }
+    return {
+        "items": [serialize_clothing_item(item) for item in items],
+        "combinations": combinations,
+        "deleted": deleted,
+    }
+
+
+def synchronize_changes(
+    db: Session,
+    user: CachedUser,
+    since: Optional[str],
+    changes: Optional[str],
+    files: Optional[list[UploadFile]] = None,
+    columnar: bool = False,
+) -> dict:
+    """
+    Handles one delta sync: applies the changes of the client and returns the
+    changes on the server since its last sync.
+
+    `changes` is a JSON object with the optional keys "clothing_items",
+    "clothing_combinations", "deleted_clothing_items" and
+    "deleted_clothing_combinations" (lists of uuids). `since` is the
+    `synchronized_at` of the previous response; if it's missing or older than
+    the tombstone retention, all rows are returned with `is_full` set and the
+    client should replace its local data.
+
+    :return: The content of the response, see `app.response_encoding.encode_response`.
+    """
+    since_at = parse_sync_timestamp(since)
+    try:
+        changes = json.loads(changes) if changes else {}
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON in 'changes'")
+    if not isinstance(changes, dict):
+        raise HTTPException(status_code=400, detail="'changes' must be a JSON object")
+
+    items = changes.get("clothing_items") or []
+    combinations = changes.get("clothing_combinations") or []
+    deleted_items = changes.get("deleted_clothing_items") or []
+    deleted_combinations = changes.get("deleted_clothing_combinations") or []
+
+    if items or combinations or deleted_items or deleted_combinations:
+        apply_sync_changes(db, user, items, combinations, deleted_items, deleted_combinations, files)
+
+    # Tombstones older than the retention may be gone (see `remove_old_tombstones`), such clients need everything again
+    synchronized_at = sync_timestamp()
+    if since_at is not None and since_at < synchronized_at - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS):
+        since_at = None
+
+    # The cursor is taken before reading, so changes committed during the read are sent again next time
+    data = get_changes_since(db, user.id, since_at, columnar=columnar)
+    logging.debug(f"Delta sync of user {user.email} since {since_at} done")
+    return {
+        "detail": "Changes synchronized successfully",
+        "data": data,
+        "is_full": since_at is None,
+        "synchronized_at": synchronized_at.isoformat()
+    }
+
+
+def remove_old_tombstones(db: Session) -> int:
+    """Deletes tombstones of all users older than SYNC_TOMBSTONE_RETENTION_DAYS."""
+    retention_cutoff = sync_timestamp() - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)
+    removed = db.query(SyncTombstone).filter(
+        SyncTombstone.deleted_at < retention_cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    if removed:
+        logging.info(f"🧹 Removed {removed} old sync tombstones")
+    return removed
+
+
+def synchronize_snapshot(
+    db: Session,
+    user: CachedUser,
+    items_data: list[dict],
+    combos_data: list[dict],
+    files: list[UploadFile],
+):
+    """
+    Makes the server data equal to a full snapshot sent by a client.
+
+    The snapshot is turned into changes against the current rows: items and
+    combinations are matched by uuid, rows missing from the snapshot are
+    deleted, and nothing else is touched. Snapshot rows without a uuid (older
+    clients) are created as new rows.
+
+    Items refer to their photos by `file_index` or by the `content_hash` of a
+    photo already on the server, so only missing files have to be uploaded.
+    If no item has a `file_index` (older clients), items are paired with
+    `files` by position.
+
+    :return: The new synchronized_at in ISO 8601 format.
+    """
+    items_data = items_data or []
+    combos_data = combos_data or []
+
+    files = files or []
+    if files and not any("file_index" in item for item in items_data):
+        # Older clients send a file for every item, items without one are dropped as before
+        items_data = [{**item, "file_index": index} for index, item in enumerate(items_data[:len(files)])]
+
+    client_to_uuid = {}
+    items = []
+    for item in items_data:
+        uuid = str(item.get("uuid") or uuid4())
+        if item.get("id") is not None:
+            client_to_uuid[item["id"]] = uuid
+        items.append({**item, "uuid": uuid})
+
+    combinations = []
+    for combo in combos_data:
+        item_ids = combo.get("item_ids") or []
+        combinations.append({
+            "uuid": str(combo.get("uuid") or uuid4()),
+            "name": combo.get("name"),
+            "item_uuids": [client_to_uuid[item_id] for item_id in item_ids if item_id in client_to_uuid],
+        })
+
+    kept_items = {item["uuid"] for item in items}
+    kept_combinations = {combo["uuid"] for combo in combinations}
+    deleted_items = [uuid for (uuid,) in db.query(ClothingItem.uuid).filter(
+        ClothingItem.owner_id == user.id) if uuid not in kept_items]
+    deleted_combinations = [uuid for (uuid,) in db.query(ClothingCombination.uuid).filter(
+        ClothingCombination.owner_id == user.id) if uuid not in kept_combinations]
+
+    return apply_sync_changes(db, user, items, combinations, deleted_items, deleted_combinations, files)
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from app.constants import REFRESH_TOKEN_EXPIRE_DAYS
+from app.model import RefreshToken, User
+
+
+def hash_refresh_token(token: str) -> str:
+    # Refresh tokens are long random strings, so a fast hash is enough (unlike passwords)
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _now() -> datetime:
+    # DATETIME columns are stored without time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """
+    Creates a refresh token for the user and commits it.
+
+    :param family_id: Family of the rotated token; a new login starts a new family.
+    :return: The token itself, which is never stored.
+    """
+    token = secrets.token_urlsafe(48)
+    db.add(RefreshToken(
+        token_hash=hash_refresh_token(token),
+        user_id=user_id,
+        family_id=family_id or str(uuid.uuid4()),
+        expires_at=_now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    db.commit()
+    return token
+
+
+def revoke_refresh_token_family(db: Session, family_id: str):
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: _now()}, synchronize_session=False)
+    db.commit()
+
+
+def revoke_user_refresh_tokens(db: Session, user_id: int):
+    """
+    Revokes every refresh token of the user, e.g. after the password or email changed.
+
+    `users.tokens_revoked_at` is set as well, so open change feed connections
+    authenticated before can be closed.
+    """
+    now = _now()
+    db.query(RefreshToken).filter(
+        RefreshToken.user_id == user_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: now}, synchronize_session=False)
+    db.query(User).filter(User.id == user_id).update({User.tokens_revoked_at: now}, synchronize_session=False)
+    db.commit()
+
+
+def rotate_refresh_token(db: Session, token: str) -> tuple[User, str]:
+    """
+    Exchanges a refresh token for a new one.
+
+    The presented token is revoked. If it was already revoked, it has been used
+    before, so it was probably stolen, and its whole family is revoked.
+
+    :raises HTTPException: 401 if the token is unknown, expired or revoked.
+    :return: The owner of the token and the new refresh token.
+    """
+    row = db.query(RefreshToken, User).join(User, User.id == RefreshToken.user_id).filter(
+        RefreshToken.token_hash == hash_refresh_token(token)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    refresh_token, user = row
+    if refresh_token.expires_at <= _now():
+        raise HTTPException(status_code=401, detail="Refresh token has expired")
+
+    # Conditional update, so of two concurrent requests with the same token only one wins
+    revoked = db.query(RefreshToken).filter(
+        RefreshToken.id == refresh_token.id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: _now()}, synchronize_session=False)
+    if not revoked:
+        logging.warning(f"⚠️ Reuse of a revoked refresh token of user {user.email}, revoking the token family")
+        revoke_refresh_token_family(db, refresh_token.family_id)
+        raise HTTPException(status_code=401, detail="Refresh token has been revoked")
+
+    new_token = issue_refresh_token(db, user.id, refresh_token.family_id)
+    return user, new_token
+
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Revokes the family of a refresh token (logout). Returns False for unknown tokens."""
+    refresh_token = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(token)
+    ).first()
+    if refresh_token is None:
+        return False
+    revoke_refresh_token_family(db, refresh_token.family_id)
+    return True
+
+
+def remove_stale_refresh_tokens(db: Session, batch_size: int = 500) -> int:
+    """
+    Deletes refresh tokens of all users that can't be used anymore.
+
+    Expired tokens are deleted, and revoked ones once no token of their family
+    is active. Revoked tokens of an active family are kept until they expire,
+    because their reuse has to revoke the family.
+
+    :return: The number of deleted tokens.
+    """
+    now = _now()
+    removed = db.query(RefreshToken).filter(RefreshToken.expires_at <= now).delete(synchronize_session=False)
+    # Selected first: MySQL can't delete from a table that a subquery of the DELETE reads
+    revoked_families = [family_id for (family_id,) in db.query(RefreshToken.family_id).group_by(
+        RefreshToken.family_id
+    ).having(func.sum(case((RefreshToken.revoked_at.is_(None), 1), else_=0)) == 0)]
+    for start in range(0, len(revoked_families), batch_size):
+        removed += db.query(RefreshToken).filter(
+            RefreshToken.family_id.in_(revoked_families[start:start + batch_size]),
+            RefreshToken.revoked_at.isnot(None)
+        ).delete(synchronize_session=False)
+    db.commit()
+    if removed:
+        logging.info(f"🧹 Removed {removed} stale refresh tokens")
+    return removed
@@ -0,0 +1,389 @@
+"""
+Resumable uploads of the photos of a sync.
+
+Instead of sending every photo in one multipart request, a client
+
+1. creates a session with the size and SHA-256 of every file,
+2. PUTs each file in chunks at the offset the server acknowledged
+   (`GET` of the session returns the offsets after a dropped connection),
+3. finalizes the session with the changes of the sync, which refer to the
+   files by `file_index` and are applied in one transaction.
+
+Chunks are streamed straight into a part file per file, so neither a chunk nor
+a file is held in memory, and a retry only resends the bytes that were lost.
+A request holds an exclusive lock on the file until its chunk is
+acknowledged, so concurrent requests at the same offset don't overwrite each
+other's bytes.
+"""
+import hashlib
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, BinaryIO, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from app.constants import (
+    MAX_CLOTHING_ITEMS_COUNT, MAX_FILE_SIZE_BYTES, MAX_FILE_SIZE_MB, UPLOAD_CHUNK_SIZE,
+    UPLOAD_SESSION_DIR, UPLOAD_SESSION_MAX_OPEN, UPLOAD_SESSION_TTL_SECONDS,
+)
+from app.executors import run_in_pool
+from app.model import UploadSession, UploadSessionFile
+from app.user_manager.sync_controller import CONTENT_HASH_PATTERN, synchronize_changes
+from app.user_manager.user_cache import CachedUser
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _now() -> datetime:
+    # DATETIME columns are stored without time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _session_dir(upload_id: str) -> str:
+    return os.path.join(UPLOAD_SESSION_DIR, upload_id)
+
+
+def _part_path(upload_id: str, file_index: int) -> str:
+    return os.path.join(_session_dir(upload_id), f"{file_index}.part")
+
+
+def _remove_session_files(upload_id: str):
+    shutil.rmtree(_session_dir(upload_id), ignore_errors=True)
+
+
+def _delete_sessions(db: Session, upload_ids: list[str]):
+    if not upload_ids:
+        return
+    db.query(UploadSessionFile).filter(UploadSessionFile.session_id.in_(upload_ids)).delete(synchronize_session=False)
+    db.query(UploadSession).filter(UploadSession.id.in_(upload_ids)).delete(synchronize_session=False)
+    db.commit()
+    for upload_id in upload_ids:
+        _remove_session_files(upload_id)
+
+
+def remove_expired_upload_sessions(db: Session) -> int:
+    """Deletes expired sessions of all users with their part files."""
+    expired = [upload_id for (upload_id,) in db.query(UploadSession.id).filter(UploadSession.expires_at <= _now())]
+    _delete_sessions(db, expired)
+    if expired:
+        logging.info(f"🧹 Removed {len(expired)} expired upload sessions")
+    return len(expired)
+
+
+def _serialize_session(session: UploadSession, files: list[UploadSessionFile]) -> dict:
+    return {
+        "upload_id": session.id,
+        "expires_at": session.expires_at.isoformat(),
+        "files": [{
+            "file_index": file.file_index,
+            "size": file.size,
+            "offset": file.received,
+            "complete": file.received == file.size,
+        } for file in files],
+    }
+
+
+def _load_session(db: Session, owner_id: int, upload_id: str) -> UploadSession:
+    """:raises HTTPException: 404 if the session doesn't exist, expired or belongs to another user."""
+    session = db.query(UploadSession).filter(
+        UploadSession.id == upload_id,
+        UploadSession.owner_id == owner_id,
+        UploadSession.expires_at > _now()
+    ).first()
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+def _load_session_files(db: Session, upload_id: str) -> list[UploadSessionFile]:
+    return db.query(UploadSessionFile).filter(
+        UploadSessionFile.session_id == upload_id
+    ).order_by(UploadSessionFile.file_index).all()
+
+
+def create_upload_session(db: Session, user: CachedUser, files: list[dict]) -> dict:
+    """
+    Starts a resumable upload of `files`, each a dict with `size`, `sha256`
+    (hex) and an optional `filename`.
+
+    :raises HTTPException: 400 for invalid files or too many open sessions.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="An upload session needs at least one file")
+    if len(files) > MAX_CLOTHING_ITEMS_COUNT:
+        raise HTTPException(status_code=400, detail=f"An upload session may contain at most {MAX_CLOTHING_ITEMS_COUNT} files")
+    for file in files:
+        if not 0 < file["size"] <= MAX_FILE_SIZE_BYTES:
+            raise HTTPException(status_code=400, detail=f"File size must be between 1 byte and {MAX_FILE_SIZE_MB} MB.")
+        if not CONTENT_HASH_PATTERN.match(str(file["sha256"]).lower()):
+            raise HTTPException(status_code=400, detail="Invalid sha256 of a file")
+
+    remove_expired_upload_sessions(db)
+    open_sessions = db.query(UploadSession).filter(UploadSession.owner_id == user.id).count()
+    if open_sessions >= UPLOAD_SESSION_MAX_OPEN:
+        raise HTTPException(status_code=400, detail=f"Too many open upload sessions. Maximum {UPLOAD_SESSION_MAX_OPEN} allowed per user.")
+
+    session = UploadSession(id=str(uuid4()), owner_id=user.id,
+                            expires_at=_now() + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS))
+    session_files = [UploadSessionFile(
+        session_id=session.id,
+        file_index=index,
+        filename=file.get("filename"),
+        size=file["size"],
+        sha256=str(file["sha256"]).lower(),
+        received=0,
+    ) for index, file in enumerate(files)]
+    db.add(session)
+    db.flush()
+    db.add_all(session_files)
+    db.commit()
+    os.makedirs(_session_dir(session.id), exist_ok=True)
+    logging.debug(f"Upload session {session.id} of user {user.email} created for {len(files)} files")
+    return _serialize_session(session, session_files)
+
+
+def get_upload_session(db: Session, user: CachedUser, upload_id: str) -> dict:
+    """Returns the acknowledged offset of every file, where a resumed upload continues."""
+    session = _load_session(db, user.id, upload_id)
+    return _serialize_session(session, _load_session_files(db, upload_id))
+
+
+def cancel_upload_session(db: Session, user: CachedUser, upload_id: str):
+    _load_session(db, user.id, upload_id)
+    _delete_sessions(db, [upload_id])
+
+
+def _load_session_file(db: Session, owner_id: int, upload_id: str, file_index: int) -> UploadSessionFile:
+    _load_session(db, owner_id, upload_id)
+    session_file = db.query(UploadSessionFile).filter(
+        UploadSessionFile.session_id == upload_id,
+        UploadSessionFile.file_index == file_index
+    ).first()
+    if session_file is None:
+        raise HTTPException(status_code=404, detail="File of the upload session not found")
+    db.expunge(session_file)
+    return session_file
+
+
+def lock_part_file(upload_id: str, file_index: int) -> Optional[BinaryIO]:
+    """
+    Takes the exclusive lock of a part file, which is held until the returned lock file is closed.
+
+    A separate lock file is locked, because locks on Windows also block
+    reading and truncating the part file through other handles.
+
+    :return: None if another request holds the lock.
+    """
+    path = _part_path(upload_id, file_index) + ".lock"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def _open_part(path: str, offset: int) -> BinaryIO:
+    """Opens the part file for writing at `offset`, dropping unacknowledged bytes after it."""
+    part = open(path, "r+b" if os.path.exists(path) else "w+b")
+    part.truncate(offset)
+    part.seek(offset)
+    return part
+
+
+def _close_part(part: BinaryIO, keep_until: int):
+    try:
+        part.truncate(keep_until)
+        part.flush()
+        os.fsync(part.fileno())
+    finally:
+        part.close()
+
+
+def _hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _load_received(db: Session, session_file: UploadSessionFile) -> int:
+    return db.query(UploadSessionFile.received).filter(
+        UploadSessionFile.session_id == session_file.session_id,
+        UploadSessionFile.file_index == session_file.file_index
+    ).scalar()
+
+
+def _restart_if_corrupted(session_file: UploadSessionFile, received: int) -> bool:
+    """Checks a completed file against its SHA-256 and empties it if it doesn't match."""
+    path = _part_path(session_file.session_id, session_file.file_index)
+    if received != session_file.size or _hash_file(path) == session_file.sha256:
+        return False
+    with open(path, "r+b") as part:
+        part.truncate(0)
+    logging.warning(f"⚠️ File {session_file.file_index} of upload session {session_file.session_id} "
+                    f"doesn't match its sha256, restarting it")
+    return True
+
+
+def _acknowledge_chunk(
+    db: Session, session_file: UploadSessionFile, offset: int, received: int, checksum_mismatch: bool
+) -> int:
+    """
+    Stores the new offset of a file; a file that didn't match its SHA-256 starts from zero again.
+
+    :raises HTTPException: 409 if another request moved the offset meanwhile,
+        400 if the completed file doesn't match its SHA-256.
+    """
+    if checksum_mismatch:
+        received = 0
+    # Conditional update, so a session that was restarted or removed meanwhile isn't overwritten
+    updated = db.query(UploadSessionFile).filter(
+        UploadSessionFile.session_id == session_file.session_id,
+        UploadSessionFile.file_index == session_file.file_index,
+        UploadSessionFile.received == offset
+    ).update({UploadSessionFile.received: received}, synchronize_session=False)
+    db.commit()
+    if not updated:
+        raise HTTPException(status_code=409, detail={
+            "message": "The file was written by another request", "offset": _load_received(db, session_file)})
+    if checksum_mismatch:
+        raise HTTPException(status_code=400, detail={
+            "message": "File doesn't match its sha256, upload it again", "offset": 0})
+    return received
+
+
+async def receive_upload_chunk(
+    db: Session,
+    user: CachedUser,
+    upload_id: str,
+    file_index: int,
+    offset: int,
+    chunks: AsyncIterator[bytes],
+    chunk_sha256: Optional[str] = None,
+) -> dict:
+    """
+    Appends a chunk to a file of an upload session, streaming it into the part file.
+
+    The chunk must start at the acknowledged offset of the file. Without
+    `chunk_sha256` the bytes received before a dropped connection are kept,
+    so the client only resends the rest; with it the chunk is stored only if
+    it matches.
+
+    :raises HTTPException: 409 (with the expected offset) for a wrong offset,
+        400 if the chunk doesn't match `chunk_sha256` or exceeds the declared size.
+    """
+    session_file = await run_in_pool("db", _load_session_file, db, user.id, upload_id, file_index)
+    if offset != session_file.received:
+        raise HTTPException(status_code=409, detail={
+            "message": "Offset doesn't match the uploaded size", "offset": session_file.received})
+
+    # Part files are written in the "upload" pool, so slow disks don't hold up the queries
+    lock = await run_in_pool("upload", lock_part_file, upload_id, file_index)
+    if lock is None:
+        raise HTTPException(status_code=409, detail={
+            "message": "The file is being written by another request", "offset": session_file.received})
+    try:
+        # The request that held the lock before may have moved the offset
+        received = await run_in_pool("db", _load_received, db, session_file)
+        if offset != received:
+            raise HTTPException(status_code=409, detail={
+                "message": "Offset doesn't match the uploaded size", "offset": received})
+        written = await _write_chunk(session_file, offset, chunks, chunk_sha256)
+        checksum_mismatch = await run_in_pool("upload", _restart_if_corrupted, session_file, offset + written)
+        received = await run_in_pool(
+            "db", _acknowledge_chunk, db, session_file, offset, offset + written, checksum_mismatch)
+    finally:
+        await run_in_pool("upload", lock.close)
+    return {"file_index": file_index, "offset": received, "complete": received == session_file.size}
+
+
+async def _write_chunk(
+    session_file: UploadSessionFile,
+    offset: int,
+    chunks: AsyncIterator[bytes],
+    chunk_sha256: Optional[str],
+) -> int:
+    """Streams a chunk into the locked part file at `offset` and returns the number of bytes kept."""
+    upload_id, file_index = session_file.session_id, session_file.file_index
+    part = await run_in_pool("upload", _open_part, _part_path(upload_id, file_index), offset)
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        try:
+            async for data in chunks:
+                if offset + written + len(data) > session_file.size:
+                    raise HTTPException(status_code=400, detail="Chunk exceeds the declared file size")
+                hasher.update(data)
+                await run_in_pool("upload", part.write, data)
+                written += len(data)
+        except ClientDisconnect:
+            if chunk_sha256 is not None:
+                raise
+            logging.debug(f"Upload of file {file_index} of session {upload_id} interrupted after {written} bytes")
+        if chunk_sha256 is not None and hasher.hexdigest() != chunk_sha256.lower():
+            raise HTTPException(status_code=400, detail="Chunk doesn't match its sha256")
+    except BaseException:
+        await run_in_pool("upload", _close_part, part, offset)
+        raise
+    await run_in_pool("upload", _close_part, part, offset + written)
+    return written
+
+
+def finalize_upload_session(
+    db: Session,
+    user: CachedUser,
+    upload_id: str,
+    since: Optional[str],
+    changes: Optional[str],
+    columnar: bool = False,
+) -> dict:
+    """
+    Applies the changes of a sync with the uploaded files, see `synchronize_changes`.
+
+    The changes are committed in one transaction; the session is removed
+    afterwards. If they are rejected, the session stays, so the client can
+    correct the changes and finalize again without uploading the files again.
+
+    :raises HTTPException: 409 with the offsets if some file is incomplete.
+    """
+    _load_session(db, user.id, upload_id)
+    session_files = _load_session_files(db, upload_id)
+    incomplete = [file for file in session_files if file.received != file.size]
+    if incomplete:
+        raise HTTPException(status_code=409, detail={
+            "message": "Upload is incomplete",
+            "files": [{"file_index": file.file_index, "offset": file.received} for file in incomplete],
+        })
+
+    files = []
+    try:
+        for session_file in session_files:
+            files.append(UploadFile(
+                file=open(_part_path(upload_id, session_file.file_index), "rb"),
+                size=session_file.size,
+                filename=session_file.filename or f"{session_file.file_index}.jpg",
+            ))
+        content = synchronize_changes(db, user, since, changes, files, columnar=columnar)
+    finally:
+        for file in files:
+            file.file.close()
+
+    _delete_sessions(db, [upload_id])
+    logging.info(f"📦 Upload session {upload_id} of user {user.email} finalized with {len(files)} files")
+    return content
@@ -0,0 +1,76 @@
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Optional
+
+from app.constants import USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The fields of a user that request handlers need, detached from any DB session."""
+    id: int
+    email: str
+    is_email_verified: bool
+    synchronized_at: Optional[datetime]
+
+    @property
+    def synchronized_at_iso(self) -> str | None:
+        """Returns synchronized_at in ISO 8601 format or None."""
+        return self.synchronized_at.isoformat() if self.synchronized_at else None
+
+
+class UserCache:
+    """
+    Process-wide cache of email -> CachedUser with a short TTL.
+
+    Entries must be invalidated whenever the email, password or verification
+    status of the user changes; synchronized_at is updated in place.
+    """
+
+    def __init__(self, ttl_seconds: int = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: dict[str, tuple[float, CachedUser]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        with self.lock:
+            entry = self.entries.get(email)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self.entries[email]
+                return None
+            return user
+
+    def set(self, user: CachedUser):
+        if self.ttl_seconds <= 0:
+            return
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                now = time.monotonic()
+                self.entries = {email: entry for email, entry in self.entries.items() if entry[0] >= now}
+                if len(self.entries) >= self.max_entries:
+                    self.entries.clear()
+            self.entries[user.email] = (time.monotonic() + self.ttl_seconds, user)
+
+    def update_synchronized_at(self, email: str, synchronized_at: datetime):
+        with self.lock:
+            entry = self.entries.get(email)
+            if entry is not None:
+                self.entries[email] = (entry[0], replace(entry[1], synchronized_at=synchronized_at))
+
+    def invalidate(self, *emails: str):
+        with self.lock:
+            for email in emails:
+                self.entries.pop(email, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
@@ -1,5 +1,6 @@
 import json
 import re
+import secrets
 from typing import Optional
 import bcrypt
 from fastapi.responses import JSONResponse
@@ -8,12 +9,21 @@ import os
 import logging
 from datetime import datetime, timedelta, timezone
 from scipy import stats
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi.security import OAuth2PasswordBearer
 
+from app.database.database import get_db
 from app.user_manager.mail_controller import send_password_change_form, send_verification_link
+from app.user_manager.user_cache import CachedUser, user_cache
+from app.user_manager.token_controller import issue_refresh_token, revoke_user_refresh_tokens
+from app.executors import run_in_pool
+from app.ttl_store import get_ttl_store
+from app.change_feed import publish_change
+from app.response_encoding import to_columnar
 from app.model import *
 from app.constants import *
 
@@ -32,8 +42,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 # 🔹 Hash
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    salt = bcrypt.gensalt(rounds=rounds)
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed_password.decode('utf-8')
 
@@ -41,12 +51,31 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+
+def password_needs_rehash(hashed_password: str, rounds: int = BCRYPT_ROUNDS) -> bool:
+    """Checks whether a hash was made with a different work factor than the configured one."""
+    try:
+        # $2b$<cost>$<salt and hash>
+        return int(hashed_password.split("$")[2]) != rounds
+    except (IndexError, ValueError):
+        return True
+
+
+# bcrypt takes hundreds of milliseconds by design, so async code runs it on the password pool
+async def hash_password_async(password: str) -> str:
+    return await run_in_pool("password", hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_in_pool("password", verify_password, plain_password, hashed_password)
+
 # 🔹 Generate JWT token
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.now(
         timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})  # Додаємо час дії токену
+    # Додаємо час дії токену та час видачі (з частками секунди, щоб порівнювати з tokens_revoked_at)
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc).timestamp()})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 # Create a new user
@@ -72,7 +101,7 @@ async def create_user(db: Session, email: str, password: str, locale: str):
                 }
             )
 
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password_async(password)
         user = User(
             email=email,
             password=hashed_password,
@@ -112,17 +141,17 @@ async def create_user(db: Session, email: str, password: str, locale: str):
 
 
 # 🔹 Authenticate user and generate JWT token
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: Session, email: str, password: str):
+    user = await run_in_pool("db", db.query(User).filter(User.email == email).first)
     logging.debug(f"Retrieved user: {user}")
 
     # Check if user exists in DB
-    if not user or not verify_password(password, user.password):
-        
-        if(not user):
+    password_matches = user is not None and await verify_password_async(password, user.password)
+    if not password_matches:
+        if not user:
             logging.debug(f"No user found with email: {email}")
-        elif not verify_password(password, user.password): 
-            logging.debug(f"Authentication failed for user: {email}") 
+        else:
+            logging.debug(f"Authentication failed for user: {email}")
         return JSONResponse(
             status_code=404,
             content={
@@ -131,6 +160,12 @@ def authenticate_user(db: Session, email: str, password: str):
             }
         )
     
+    # Upgrade hashes made with an outdated work factor while the plain password is at hand
+    if password_needs_rehash(user.password):
+        user.password = await hash_password_async(password)
+        await run_in_pool("db", db.commit)
+        logging.info(f"Password hash of user {email} upgraded to {BCRYPT_ROUNDS} rounds")
+
     if user.is_email_verified == False:
         return JSONResponse(
             status_code=403,
@@ -144,11 +179,14 @@ def authenticate_user(db: Session, email: str, password: str):
         data={"sub": str(user.email)},
         expires_delta=timedelta(minutes=30)
     )
+    # Long-lived token for /token/refresh, so the password isn't needed again
+    refresh_token = await run_in_pool("db", issue_refresh_token, db, user.id)
 
     return {
         "detail": "Authentication successful",
         "data": {
             "access_token": access_token,
+            "refresh_token": refresh_token,
             "token_type": "bearer"
         }
     }
@@ -185,8 +223,8 @@ def get_current_user(token: str, db: Session):
     return user  # Повертаємо користувача, якщо він знайдений
 
 
-def get_current_user_id(token: str, db: Session):
-    logging.debug("Decoding token: %s", token)  # Логування токена
+def decode_token_email(token: str) -> str:
+    """Returns the email from an access token or raises 401."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_email: str = payload.get("sub")
@@ -194,21 +232,63 @@ def get_current_user_id(token: str, db: Session):
             # Логування помилки, якщо ID відсутнє
             logging.error("Invalid token: User ID not found")
             raise HTTPException(status_code=401, detail="Invalid token")
-        # Логування ID користувача
-        logging.debug("Decoded user email: %s", user_email)
     except jwt.PyJWTError as e:
         logging.debug("JWT error: %s", str(e))  # Логування помилки декодування
         raise HTTPException(
             status_code=401, detail="Could not validate credentials")
+    return user_email
 
-    user = db.query(User).filter(User.email == user_email).first()
-    if user is None:
+
+def load_cached_user(db: Session, email: str) -> CachedUser:
+    """Returns the user with the given email from the user cache, loading it on a miss."""
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+    return _cache_user_row(db.execute(_cached_user_statement(email)).first(), email)
+
+
+async def load_cached_user_async(db: AsyncSession, email: str) -> CachedUser:
+    """Async version of `load_cached_user`."""
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+    return _cache_user_row((await db.execute(_cached_user_statement(email))).first(), email)
+
+
+def _cached_user_statement(email: str):
+    return select(User.id, User.email, User.is_email_verified, User.synchronized_at).where(
+        User.email == email).limit(1)
+
+
+def _cache_user_row(row, email: str) -> CachedUser:
+    if row is None:
         # Логування, якщо користувач не знайдений
-        logging.debug("User with email %s not found in DB", user_email)
+        logging.debug("User with email %s not found in DB", email)
         raise HTTPException(status_code=401, detail="User not found")
-    # Логування знайденого користувача
-    logging.debug("User found in DB: %s", user.email)
-    return user.id
+    user = CachedUser(id=row.id, email=row.email, is_email_verified=bool(row.is_email_verified),
+                      synchronized_at=row.synchronized_at)
+    user_cache.set(user)
+    return user
+
+
+def get_authenticated_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> CachedUser:
+    """
+    FastAPI dependency with the user of the request's access token.
+
+    FastAPI resolves it once per request, and the user itself comes from a
+    short-lived cache, so most requests don't query the users table at all.
+
+    :raises HTTPException: 401 if the token is invalid or the user doesn't exist.
+    """
+    return load_cached_user(db, decode_token_email(token))
+
+
+def get_current_user_id(token: str, db: Session):
+    return load_cached_user(db, decode_token_email(token)).id
+
+
+async def get_current_user_id_async(token: str, db: AsyncSession) -> int:
+    return (await load_cached_user_async(db, decode_token_email(token))).id
 
 def synchronize_user_data(
     token: str,
@@ -217,6 +297,15 @@ def synchronize_user_data(
     db: Session,
     files: list[tuple[str, tuple[str, bytes, str]]]
 ):
+    """
+    Makes the server data equal to the full snapshot of the local storage.
+
+    Only the difference to the stored rows is written (see
+    `synchronize_snapshot`), rows that didn't change are kept together with
+    their ids and files. All writes happen in one transaction with bulk
+    inserts, so the number of queries doesn't depend on the wardrobe size.
+    """
+    from app.user_manager.sync_controller import synchronize_snapshot
     logging.debug("Received request for data synchronization")
     logging.debug("clothing_items: %s", clothing_items)  
     logging.debug("clothing_combinations: %s", clothing_combinations) 
@@ -227,154 +316,144 @@ def synchronize_user_data(
         items_data = clothing_items
     combos_data = json.loads(clothing_combinations)
 
-    logging.debug("items_data: %s, type: %s", items_data, type(items_data))
-    logging.debug("combos_data: %s, type: %s", combos_data, type(combos_data))
-
-
-    current_user = get_current_user(token, db)
-    
-    if isinstance(current_user, JSONResponse):
-        return current_user
-    # 1. Cleans up the clothing item data before adding it to the database and associates them with the current user.
-    old_combos = db.query(ClothingCombination).filter_by(owner_id = current_user.id).all()
-    for combo in old_combos:
-        combo.items.clear()  
-        db.delete(combo)
-
-    old_items = db.query(ClothingItem).filter_by(owner_id=current_user.id).all()
-    for item in old_items:
-        db.delete(item)
-
-    db.commit()
-    print(f"🧹 Cleared old items and combinations for user {current_user.email}")
-
-    old_to_new_items_map = {}
-    new_items = []
-    # 2. Add new clothing items to the database and associate them with the current user.
-    if items_data is not None and len(items_data) > 0:
-        for file, item in zip(files, items_data):
-            print("Original item:", item)
-            from app.close_manager import save_file
-
-            saved_name = save_file(file)
-            logging.debug(f"File '{file.filename}' saved as '{saved_name}'")
-
-
-            item_data_cleaned = {
-                k: v for k, v in item.items()
-                if k not in ("id", "owner_id")
-            }
-
-            item_data_cleaned["filename"] = saved_name
-
-            new_item = ClothingItem(**item_data_cleaned, owner_id=current_user.id)
-            db.add(new_item)
-            db.commit()
-
-            old_to_new_items_map[item["id"]] = new_item.id
-            new_items.append(new_item)
-
-        db.commit()
-
-    # 3. Creates new clothing combinations and maps the old IDs to the new ones.
-    old_to_new_combos_map = {}  
-    if combos_data is not None:
-        for combo in combos_data:
-            old_combo_id = combo["id"]
-
-            new_combo = ClothingCombination(
-                name=combo["name"], owner_id=current_user.id)
-            db.add(new_combo)
-            db.commit()  
-            
-            old_to_new_combos_map[old_combo_id] = new_combo.id
-
-            for old_item_id in combo["item_ids"]:
-                new_item_id = old_to_new_items_map.get(old_item_id)
-                if new_item_id:
-                    item = db.get(ClothingItem, new_item_id)
-                    if item:
-                        new_combo.items.append(item)
-
-            db.commit()
-
-    current_user.synchronized_at = datetime.now(timezone.utc)
-    db.commit()
+    current_user = load_cached_user(db, decode_token_email(token))
+    synchronized_at = synchronize_snapshot(db, current_user, items_data, combos_data, files)
+    logging.info(f"🔄 Synchronized local data of user {current_user.email}")
 
     return JSONResponse(
         status_code=200,
         content={
-             "synchronized_at": current_user.synchronized_at_iso
+             "synchronized_at": synchronized_at
         }
     )
 
-def update_synchronized_at(token: str, db: Session):
-    current_user = get_current_user(token, db)
-    current_user.synchronized_at = datetime.now(timezone.utc)
+def mark_user_synchronized(
+    db: Session,
+    user: CachedUser,
+    entity: str = "wardrobe",
+    entity_id: Optional[int] = None,
+    op: str = "update",
+) -> str | None:
+    """
+    Sets synchronized_at of the user to now, commits and publishes the change
+    to the connected devices of the user (see app/change_feed.py).
+
+    :param entity: "item", "combination" or "wardrobe" if several rows changed.
+    :param entity_id: Id of the changed row, None if several rows changed.
+    :param op: "create", "update" or "delete".
+    :return: The new synchronized_at in ISO 8601 format.
+    """
+    # Stored without time zone, as it's read back from the DATETIME column
+    synchronized_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.query(User).filter(User.id == user.id).update({User.synchronized_at: synchronized_at})
     db.commit()
+    user_cache.update_synchronized_at(user.email, synchronized_at)
+    publish_change(user.id, entity, entity_id, op, synchronized_at.isoformat())
+    return synchronized_at.isoformat()
+
+
+def update_synchronized_at(token: str, db: Session):
+    synchronized_at = mark_user_synchronized(db, load_cached_user(db, decode_token_email(token)))
     return JSONResponse(
         status_code=200,
         content={
             "detail": "Synchronized at updated",
             "data": {
-                 "synchronized_at": current_user.synchronized_at_iso
+                 "synchronized_at": synchronized_at
             }
         }
     )
-def get_user_data(token: str, db: Session):
-    from app.close_manager.clothing_controller import get_all_combinations_for_user, get_all_clothing_items_for_user
-    items = get_all_clothing_items_for_user(db, token)
-    combos = get_all_combinations_for_user(db,token)
-    combo_ids = []
-    for combo in combos:
-        items_only = []
-        
-        # Перебираємо кожен елемент у списку items
-        for item in combo['items']:
-            items_only.append(item['id'])
-        
-        combo_ids.append({
-            'id': combo["id"],
-            'name': combo["name"],
-            'items': items_only
-        })
-
-    logging.debug(f"Items: {items}, Combinations: {combos}")
+def get_user_data(token: str, db: Session, columnar: bool = False) -> dict:
+    """
+    Returns all items and combinations of the user (the server-to-local sync).
 
-    
-    items_data = [
-        item.to_dict() if hasattr(item, 'to_dict') else item
-        for item in items['data'].values()  
-        ]
-    
-    current_user = get_current_user(token, db)
-    logging.debug(f"items_data: {items_data}")
-    return JSONResponse(content={
+    Combinations only list the ids of their items. The data is read with three
+    queries (user, items, combinations with their links), however large the
+    wardrobe is.
+
+    :param columnar: Return them column by column (see `app.response_encoding.to_columnar`).
+    """
+    from app.close_manager.clothing_controller import get_combinations_with_item_ids, user_items_statement
+    # Read from the database rather than the user cache, synchronized_at must be current
+    user = db.execute(_user_data_statement(token)).first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    items = db.scalars(user_items_statement(user.id)).all()
+    combinations = get_combinations_with_item_ids(db, user.id)
+    return _user_data_response(user, items, combinations, columnar)
+
+
+async def get_user_data_async(token: str, db: AsyncSession, columnar: bool = False) -> dict:
+    """Async version of `get_user_data`."""
+    from app.close_manager.clothing_controller import get_combinations_with_item_ids_async, user_items_statement
+    user = (await db.execute(_user_data_statement(token))).first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    items = (await db.scalars(user_items_statement(user.id))).all()
+    combinations = await get_combinations_with_item_ids_async(db, user.id)
+    return _user_data_response(user, items, combinations, columnar)
+
+
+def _user_data_statement(token: str):
+    return select(User.id, User.synchronized_at).where(User.email == decode_token_email(token)).limit(1)
+
+
+def _user_data_response(user, items: list[ClothingItem], combinations: list[dict], columnar: bool) -> dict:
+    from app.close_manager.clothing_controller import serialize_clothing_item, serialize_clothing_items_columnar
+    logging.debug(f"User {user.id} has {len(items)} items and {len(combinations)} combinations")
+    return {
         "detail": "All data retrieved successfully",
         "data": {
-            "items": items_data,
-            "combinations": combo_ids
+            "items": serialize_clothing_items_columnar(items) if columnar else [
+                serialize_clothing_item(item) for item in items],
+            "combinations": to_columnar(combinations) if columnar else combinations
         },
-            "synchronized_at": current_user.synchronized_at_iso
-    })
+        "synchronized_at": user.synchronized_at.isoformat() if user.synchronized_at else None
+    }
 
 def is_user_verified(user_id, db: Session) -> bool:
     user = db.query(User).filter(User.id == user_id).first()
     return user is not None and user.is_email_verified
 
 # Functions to update the user's password
-def create_password_reset_token(email: str, expires_delta: timedelta = timedelta(hours=1)) -> str:
+def get_password_reset_key(token: str) -> str:
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return f"password_reset:{payload.get('jti')}"
+
+
+def create_password_reset_token(email: str, expires_delta: timedelta = timedelta(seconds=PASSWORD_RESET_TOKEN_TTL_SECONDS)) -> str:
     """
-    Creates a password reset token.
+    Creates a one-time password reset token.
 
     - **Parameters**:
         - `email`: User's email address.
         - `expires_delta`: Expiration time for the token.
 
-    - **Returns**: JWT token for password reset.
+    - **Returns**: JWT token for password reset. Its id is kept in the TTL store
+      until the token is used by `consume_password_reset_token`.
     """
-    to_encode = {"sub": email, "exp": datetime.utcnow() + expires_delta}
+    token_id = secrets.token_urlsafe(16)
+    to_encode = {"sub": email, "jti": token_id, "exp": datetime.utcnow() + expires_delta}
+    get_ttl_store().set(f"password_reset:{token_id}", email, int(expires_delta.total_seconds()))
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def is_password_reset_token_active(token: str) -> bool:
+    """Checks that a reset token is valid and was not used yet, without using it."""
+    try:
+        return get_ttl_store().get(get_password_reset_key(token)) is not None
+    except jwt.PyJWTError:
+        return False
+
+
+def consume_password_reset_token(token: str) -> bool:
+    """Marks a reset token as used. Returns False if it is invalid, expired or already used."""
+    try:
+        return get_ttl_store().pop(get_password_reset_key(token)) is not None
+    except jwt.PyJWTError:
+        return False
 async def send_password_reset_email(db: Session, email: str, locale: Optional[str] = 'en'):
     """
     Sends a password reset form to the user's email after verifying the password.
@@ -437,7 +516,7 @@ async def send_password_reset_email(db: Session, email: str, locale: Optional[st
 
     return {"detail": "Password reset email sent successfully."}
 
-def update_user_password(db: Session, user: User, old_password: str, new_password: str):
+async def update_user_password(db: Session, user: User, old_password: str, new_password: str):
     """
     Updates the user's password after verifying the old password.
 
@@ -448,11 +527,15 @@ def update_user_password(db: Session, user: User, old_password: str, new_passwor
     :raises HTTPException: If the old password is incorrect
     :return: A message confirming the successful password change
     """
-    if not verify_password(old_password, user.password):
+    if not await verify_password_async(old_password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect old password")
 
-    user.password = hash_password(new_password)
-    db.commit()
+    user.password = await hash_password_async(new_password)
+    await run_in_pool("db", db.commit)
+    await run_in_pool("db", revoke_user_refresh_tokens, db, user.id)
+    user_cache.invalidate(user.email)
+    # Other devices are logged out by the revoked refresh tokens
+    await run_in_pool("db", publish_change, user.id, "user", user.id, "update", user.synchronized_at_iso)
 
     return {"detail": "Password successfully updated", "data": ""}
 
@@ -463,7 +546,7 @@ async def update_user_email(db: Session, user: User, password: str, new_email: s
     """
     Updates the user's email after verifying the password.
     """
-    if not verify_password(password, user.password):
+    if not await verify_password_async(password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect password")
     try:
         # Перевірка формату email
@@ -492,9 +575,13 @@ async def update_user_email(db: Session, user: User, password: str, new_email: s
             status_code=500,
             detail="Database error"
         )
+    old_email, user_id, synchronized_at = user.email, user.id, user.synchronized_at_iso
     user.email = new_email
     user.is_email_verified = False
-    db.commit()
+    await run_in_pool("db", db.commit)
+    user_cache.invalidate(old_email, new_email)
+    await run_in_pool("db", revoke_user_refresh_tokens, db, user_id)
+    await run_in_pool("db", publish_change, user_id, "user", user_id, "update", synchronized_at)
     # Надсилання посилання для підтвердження електронної пошти
     await send_verification_link(new_email, token, locale)
 